@@ -1,5 +1,5 @@
 import os
-import time
+import threading
 import traceback
 from typing import Optional
 
@@ -10,9 +10,12 @@ import app.core.styles as styles
 import flet as ft
 from app.controls import CopyButton, ThumbsUpDownButtons
 from app.controls.illiana.chat_config import ChatConfig
+from app.controls.illiana.latency_panel import LatencyPanel
 from app.controls.illiana.text import ErrorText
+from app.core.chat_pipeline import ChatJob, ChatPipeline, ChatQueueFullError
 from app.core.config import settings
 from app.core.log import ic, logger
+from app.core.streaming import TokenBuffer, get_animation_frames
 
 
 # ChatMessage class
@@ -32,6 +35,7 @@ class ChatMessage(ft.Column):
             ),
             auto_follow_links=True,
         )
+        self._skip_animation = threading.Event()
         super().__init__(spacing=4)
         avatar_color: str = styles.ColorPalette.ACCENT
         if username == settings.CHAT_BOTNAME:
@@ -61,12 +65,36 @@ class ChatMessage(ft.Column):
         else:
             return ""
 
-    def animate_message(self, message: str):
-        characters = list(message)
-        for character in characters:
-            self.message_display.value += character
+    def animate_message(self, message: str) -> threading.Thread:
+        """
+        Types out the message in the background, a few words per frame, within
+        settings.CHAT_TEXT_ANIMATION_MAX_DURATION.
+
+        Args:
+            message (str): The message to type.
+
+        Returns:
+            threading.Thread: The thread running the animation.
+        """
+        self._skip_animation.clear()
+        thread = threading.Thread(target=self._animate, args=(message,), daemon=True)
+        thread.start()
+        return thread
+
+    def _animate(self, message: str):
+        for frame in get_animation_frames(message):
+            if self._skip_animation.is_set():
+                break
+            self.message_display.value += frame
             self.message_display.update()
-            time.sleep(settings.CHAT_TEXT_ANIMATION_SPEED)
+            self._skip_animation.wait(settings.CHAT_TEXT_ANIMATION_SPEED)
+        if self.message_display.value != message:
+            self.message_display.value = message
+            self.message_display.update()
+
+    def skip_animation(self):
+        # Shows the whole message right away
+        self._skip_animation.set()
 
 
 # ChatView class
@@ -77,6 +105,10 @@ class ChatView(ft.Container):
         self.content = self.chat
         self.chat_config = chat_config
         self.page = page
+        self.animated_chat_message: Optional[ChatMessage] = None
+        self.latency_panel: Optional[LatencyPanel] = (
+            LatencyPanel() if settings.LATENCY_PANEL_ENABLED else None
+        )
 
     def add_line(self, control: ft.Control):
         self.chat.controls.append(control)
@@ -97,8 +129,15 @@ class ChatView(ft.Container):
         chat_message.message_display.value = ""
         self.add_line(chat_message)
 
+        self.skip_animation()
+        self.animated_chat_message = chat_message
         chat_message.animate_message(chat_message.message)
 
+    def skip_animation(self):
+        if self.animated_chat_message is not None:
+            self.animated_chat_message.skip_animation()
+            self.animated_chat_message = None
+
 
 class ChatResponseGenerator:
     def __init__(
@@ -111,24 +150,18 @@ class ChatResponseGenerator:
         next(self.generator)
 
     def _create_generator(self):
+        token_buffer = TokenBuffer(self.render)
         try:
-            removed_progress_ring: bool = False
-            iter_count: int = 0
-            token_count: int = 0
             while True:
-                iter_count += 1
                 token = yield
-                if token:
-                    if not removed_progress_ring:
-                        # self.chat_view.remove_line(self.progress_ring)
-                        removed_progress_ring = True
-                    self.chat_message.message_display.value += token
-                    self.chat_message.message_display.update()
-                    token_count += 1
-                    self.chat_view.chat.scroll_to(offset=-1)
-                    self.chat_view.chat.update()
+                token_buffer.add(token)
         except GeneratorExit:
-            ic(token_count, iter_count)
+            token_buffer.close()
+
+    def render(self, text: str):
+        self.chat_message.message_display.value += text
+        self.chat_view.chat.scroll_to(offset=-1)
+        self.chat_view.chat.update()
 
     def send(self, token: str):
         self.generator.send(token)
@@ -139,10 +172,17 @@ class ChatResponseGenerator:
 
 
 class StreamingCallbackHandler(BaseCallbackHandler):
-    def __init__(self, response_generator: ChatResponseGenerator):
+    def __init__(
+        self,
+        response_generator: ChatResponseGenerator,
+        job: Optional[ChatJob] = None,
+    ):
         self.response_generator = response_generator
+        self.job = job
 
     def on_llm_new_token(self, token: str, **kwargs) -> None:
+        if self.job is not None and self.job.is_cancelled:
+            return
         self.response_generator.send(token)
 
 
@@ -203,6 +243,7 @@ class MessageHandler:
         progress_ring: ft.Row,
         initial_chat_message: ChatMessage,
         stream_response=True,
+        job: Optional[ChatJob] = None,
     ) -> Optional[StreamingCallbackHandler]:
         if stream_response:
             response_generator = ChatResponseGenerator(
@@ -210,7 +251,9 @@ class MessageHandler:
                 chat_view=self.chat_view,
                 chat_message=initial_chat_message,
             )
-            streaming_callback_handler = StreamingCallbackHandler(response_generator)
+            streaming_callback_handler = StreamingCallbackHandler(
+                response_generator, job=job
+            )
             return streaming_callback_handler
         return None
 
@@ -223,21 +266,30 @@ class MessageHandler:
                 on_click=on_click,
             )
 
-        self.chat_view.add_line(
-            ft.Row(
-                spacing=0,
-                controls=[
-                    CopyButton(self.chat_view.page, response["response"]),
-                    ThumbsUpDownButtons(self.chat_view.page),
-                    create_icon_button(
-                        icon=ft.icons.REFRESH_OUTLINED,
-                        tooltip="Retry prompt",
-                    ),
-                ],
+        controls = [
+            CopyButton(self.chat_view.page, response["response"]),
+            ThumbsUpDownButtons(self.chat_view.page),
+            create_icon_button(
+                icon=ft.icons.REFRESH_OUTLINED,
+                tooltip="Retry prompt",
+            ),
+        ]
+        if response.get("cached"):
+            controls.append(
+                ft.Icon(
+                    name=ft.icons.BOLT_OUTLINED,
+                    size=16,
+                    tooltip="Served from the response cache",
+                )
             )
-        )
+        self.chat_view.add_line(ft.Row(spacing=0, controls=controls))
 
-    def handle_bot_response(self, user_input: str, stream_response: bool = True):
+    def handle_bot_response(
+        self,
+        user_input: str,
+        stream_response: bool = True,
+        job: Optional[ChatJob] = None,
+    ):
         # Get response from AI
         # TODO: Add real exception handling
         try:
@@ -261,6 +313,7 @@ class MessageHandler:
                 progress_ring=progress_ring,
                 initial_chat_message=initial_chat_message,
                 stream_response=stream_response,
+                job=job,
             )
 
             knowledge_base_name = (
@@ -276,8 +329,30 @@ class MessageHandler:
                 knowledge_base_name=knowledge_base_name,
                 use_knowledge_base=self.chat_view.chat_config.use_knowledge_base_checkbox.value,  # noqa
                 streaming_callback_handler=streaming_callback_handler,
+                cancellation_token=job.cancellation_token if job else None,
+                session_id=self.chat_view.page.session_id,
             )
 
+            # The knowledge base was indexed even if the response was stopped
+            if refreshed_vectorstore:
+                self.chat_view.chat_config.knowledge_base_helper.refesh(
+                    knowledge_base_name
+                )
+                self.chat_view.chat_config.files_container_control.update_files_container()  # noqa
+
+            if response.get("cancelled"):
+                if streaming_callback_handler:
+                    streaming_callback_handler.response_generator.close()
+                self.chat_view.remove_line(progress_ring)
+                self.chat_view.add_line(
+                    ft.Text(
+                        "Response stopped, saving at most "
+                        f"{response['max_tokens_saved']} output tokens",
+                        opacity=0.6,
+                    )
+                )
+                return
+
             if stream_response:
                 if streaming_callback_handler:
                     streaming_callback_handler.response_generator.close()
@@ -304,11 +379,8 @@ class MessageHandler:
             # Display sources
             self.display_sources(response, self.chat_view)
 
-            if refreshed_vectorstore:
-                self.chat_view.chat_config.knowledge_base_helper.refesh(
-                    knowledge_base_name
-                )
-                self.chat_view.chat_config.files_container_control.update_files_container()  # noqa
+            if self.chat_view.latency_panel is not None:
+                self.chat_view.latency_panel.refresh()
         except Exception:
             exception: str = traceback.format_exc(limit=10, chain=True)
             logger.error("chat.handle_bot_response.error", exception=exception)
@@ -319,6 +391,7 @@ class MessageHandler:
 class UserInputField(ft.TextField):
     ENABLED_PROMPT = "Enter a prompt here"
     DISABLED_PROMPT = "Illiana is thinking about your question..."
+    QUEUE_FULL_PROMPT = "Too many prompts are waiting, try again shortly"
 
     def __init__(self, chat_view: ChatView) -> None:
         super().__init__(
@@ -337,6 +410,7 @@ class UserInputField(ft.TextField):
         )
         self.chat_view = chat_view
         self.message_handler = MessageHandler(chat_view)
+        self.chat_pipeline = ChatPipeline(self.answer, on_change=self.update_hint)
 
     def handle_user_input(self, event: ft.ControlEvent) -> None:
         ic(event.control.value)
@@ -345,20 +419,33 @@ class UserInputField(ft.TextField):
     def handle_input(self, input: str) -> None:
         message = self.sanitize_input(input)
         if message:
-            # Disable input
+            self.chat_view.skip_animation()
             self.value = ""
-            self.disabled = True
-            self.hint_text = self.DISABLED_PROMPT
+            try:
+                self.chat_pipeline.submit(message)
+            except ChatQueueFullError:
+                self.value = message
+                self.hint_text = self.QUEUE_FULL_PROMPT
             self.update()
 
-            # Send message to chat view
-            self.message_handler.handle_user_message(message)
-            self.message_handler.handle_bot_response(message)
+    def answer(self, job: ChatJob) -> None:
+        # Runs on the chat pipeline's worker thread
+        self.message_handler.handle_user_message(job.prompt)
+        self.message_handler.handle_bot_response(job.prompt, job=job)
 
-            # Re-enable input
+    def stop(self) -> None:
+        self.chat_pipeline.cancel()
+
+    def update_hint(self) -> None:
+        if not self.page:
+            return
+        if self.chat_pipeline.busy:
+            self.hint_text = self.DISABLED_PROMPT
+            if self.chat_pipeline.queued:
+                self.hint_text += f" ({self.chat_pipeline.queued} queued)"
+        else:
             self.hint_text = self.ENABLED_PROMPT
-            self.disabled = False
-            self.update()
+        self.update()
 
     def sanitize_input(self, message: str) -> str:
         return message.strip()
@@ -384,9 +471,7 @@ class StopButton(ft.IconButton):
             icon_size=36,
             icon_color=styles.ColorPalette.ACCENT_STOP,
             tooltip="Stop",
-            on_click=lambda _: user_input_field.handle_input(
-                user_input_field.value
-            ),  # noqa
+            on_click=lambda _: user_input_field.stop(),
         )
 
 
@@ -403,7 +488,7 @@ class UserInputBar(ft.Container):
                     ),
                     user_input_field,
                     SubmitButton(user_input_field),
-                    # stop_button,
+                    StopButton(user_input_field),
                 ],
                 vertical_alignment=ft.CrossAxisAlignment.START,
                 alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
@@ -17,10 +17,15 @@ from app.controls.illiana.file_picker import FilePickerControl
 from app.controls.illiana.files_container import FilesContainerControl
 from app.controls.illiana.slider import MaximumLengthSlider, TemperatureSlider
 from app.controls.illiana.text import ErrorText
-from app.core.ai import refresh_vectorstore
+from app.core.ai import invalidate_chains, refresh_vectorstore
 from app.core.config import settings
 from app.core.log import logger
-from app.models import KnowledgeBase, KnowledgeBaseDocument, KnowledgeBaseHelper
+from app.models import (
+    KnowledgeBaseData,
+    KnowledgeBaseDocument,
+    KnowledgeBaseHelper,
+    load_knowledge_base,
+)
 
 
 class AlertDialogControl(ft.AlertDialog):
@@ -70,7 +75,7 @@ class ChatConfig(ft.UserControl):
         update_llm_values(selected_llm): Updates the values for the selected LLM.
         get_llm_dropdown() -> DropdownControl: Returns the dropdown control for LLM selection.
         get_knowledge_base_dropdown() -> DropdownControl: Returns the dropdown control for knowledge base selection.
-        on_files_processed(document_data: dict[str, bytes]): Event handler for files processed.
+        on_files_processed(document_data: KnowledgeBaseData): Event handler for files processed.
         delete_file(e: ft.ControlEvent, knowledge_base_name: str, document_name: str): Deletes a file from the knowledge base.
         on_click_close_dialog(): Event handler for closing the dialog.
         on_add_new_knowledge_base(): Event handler for adding a new knowledge base.
@@ -88,7 +93,7 @@ class ChatConfig(ft.UserControl):
             read_only=True,
         )
         self.temperature_slider = TemperatureSlider()
-        self.knowledge_base = KnowledgeBase.load()
+        self.knowledge_base = load_knowledge_base()
         self.knowledge_base_helper = KnowledgeBaseHelper(self.knowledge_base)
         knowledge_base_names = self.knowledge_base_helper.get_knowledge_base_names()
         self.loading_indicator = ft.ProgressRing(visible=False)
@@ -155,7 +160,7 @@ class ChatConfig(ft.UserControl):
             else knowledge_base_names[0],
         )
 
-    def on_files_processed(self, document_data: dict[str, bytes]):
+    def on_files_processed(self, document_data: KnowledgeBaseData):
         self.document_data = document_data
         self.files_container_control.update_files_container()
 
@@ -302,6 +307,7 @@ class ChatConfig(ft.UserControl):
     def delete_knowledge_base(self, knowledge_base_name: str):
         knowledge_base_name = self.knowledge_base_dropdown.get_dropdown_value()
         self.knowledge_base_helper.delete_knowledge_base(knowledge_base_name)
+        invalidate_chains(knowledge_base_name)
         self.knowledge_base_dropdown.remove_option(knowledge_base_name)
         SuccessSnackBar(
             message=f"Successfully deleted knowledge base: {knowledge_base_name}",
@@ -371,12 +377,15 @@ class ChatConfig(ft.UserControl):
         )
 
     def refresh_knowledge_base(self, knowledge_base_name: str):
-        refresh_vectorstore(
+        index_stats = refresh_vectorstore(
             self.knowledge_base_helper.get_documents(knowledge_base_name),
             self.knowledge_base_dropdown.get_dropdown_value(),
+            progress_callback=self.file_picker_control.update_progress,
         )
         SuccessSnackBar(
-            message=f"Successfully refreshed knowledge base: {knowledge_base_name}",
+            message=f"Successfully refreshed knowledge base: {knowledge_base_name} "
+            f"(chunks skipped: {index_stats.skipped}, added: {index_stats.added}, "
+            f"removed: {index_stats.removed})",
             page=self.page,
         ).open()
         self.update()
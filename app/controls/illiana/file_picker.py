@@ -39,6 +39,7 @@ class FilePickerControl(ft.UserControl):
 
             knowledge_base_name = self.knowledge_base_dropdown.dropdown.value
 
+            documents = []
             for uploaded_file in e.files:
                 uploaded_file_path = uploaded_file.path
                 document_name = os.path.basename(uploaded_file_path)
@@ -47,14 +48,15 @@ class FilePickerControl(ft.UserControl):
                     knowledge_base_name,
                     document_name,
                 )
-
-                self.knowledge_base_helper.add_document(
-                    knowledge_base_name=knowledge_base_name,
-                    document_name=document_name,
-                    incoming_filename=uploaded_file_path,
-                    outgoing_filename=knowledge_base_file_path,
+                documents.append(
+                    (document_name, uploaded_file_path, knowledge_base_file_path)
                 )
 
+            self.knowledge_base_helper.add_documents(
+                knowledge_base_name=knowledge_base_name,
+                documents=documents,
+            )
+
             if self.on_files_processed:
                 self.on_files_processed(self.knowledge_base_helper.document_data)
 
@@ -66,5 +68,12 @@ class FilePickerControl(ft.UserControl):
 
         self.update()
 
+    def update_progress(self, processed: int, total: int):
+        # Determinate while work is in progress, back to indeterminate once done
+        done = processed >= total
+        self.loading_indicator.visible = not done
+        self.loading_indicator.value = None if done else processed / total
+        self.update()
+
     def build(self):
         return ft.Column([self.loading_indicator, self.pick_files_dialog])
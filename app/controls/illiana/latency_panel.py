@@ -0,0 +1,38 @@
+import app.core.styles as styles
+import flet as ft
+from app.core.log import get_latency_stats
+
+
+class LatencyPanel(ft.Container):
+    """
+    Shows the latest and mean duration of every recorded span, e.g. retrieval,
+    the LLM request and the time to first token.
+    """
+
+    def __init__(self):
+        self.rows = ft.Column(spacing=2)
+        super().__init__(
+            content=ft.Column(
+                controls=[
+                    ft.Text("Latency", **styles.ModalSubtitle().to_dict()),
+                    self.rows,
+                ],
+                spacing=6,
+            ),
+            padding=10,
+            border_radius=10,
+            bgcolor=styles.ColorPalette.BG_SECONDARY,
+        )
+
+    def refresh(self):
+        self.rows.controls = [
+            ft.Text(
+                f"{name}: {stats.last * 1000:.0f} ms "
+                f"(mean {stats.mean * 1000:.0f} ms, n={stats.count})",
+                font_family="Roboto Mono",
+                size=11,
+                opacity=0.8,
+            )
+            for name, stats in sorted(get_latency_stats().items())
+        ]
+        self.update()
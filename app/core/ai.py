@@ -1,13 +1,12 @@
-from typing import Optional, Tuple
+from dataclasses import dataclass
+from typing import Any, Optional, Tuple
 
 from langchain.callbacks import get_openai_callback
 from langchain.callbacks.base import BaseCallbackHandler
-from langchain.callbacks.manager import CallbackManager
+from langchain.callbacks.manager import CallbackManagerForChainRun
 from langchain.chains import ConversationalRetrievalChain, LLMChain
 from langchain.chains.base import Chain
-from langchain.chat_models import ChatOpenAI
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.memory import ConversationBufferMemory
+from langchain.chat_models.base import BaseChatModel
 from langchain.prompts import (
     ChatPromptTemplate,
     HumanMessagePromptTemplate,
@@ -16,12 +15,22 @@ from langchain.prompts import (
 from langchain.schema import Document
 from langchain.schema.messages import SystemMessage
 
+from app.core.cancellation import ANSWER_TAG, CancellationToken
 from app.core.config import settings
-from app.core.loader import load_documents
-from app.core.log import ic, logger
-from app.core.splitter import get_document_chunks
+from app.core.embeddings import create_embeddings
+from app.core.indexer import IndexStats, ProgressCallback, index_knowledge_base
+from app.core.log import ic, logger, span, timed
+from app.core.memory import TokenBudgetMemory, get_memory_token_budget
+from app.core.providers import create_chat_model
+from app.core.response_cache import (
+    ResponseCache,
+    ResponseCacheKey,
+    get_history_version,
+    get_knowledge_base_version,
+)
+from app.core.streaming import split_words
+from app.core.tokens import count_tokens
 from app.core.vectorstore import (
-    create_vectorstore,
     delete_vectorstore,
     get_vectorstore_retriever,
     vectorstore_exists,
@@ -29,10 +38,50 @@ from app.core.vectorstore import (
 from app.models import KnowledgeBaseDocument
 
 CHAT_HISTORY = "chat_history"
+RETRIEVED_DOCUMENTS = "retrieved_documents"
 
 
-conversation_memories: dict[str, ConversationBufferMemory] = {}
+conversation_memories: dict[Tuple[str, str], TokenBudgetMemory] = {}
 conversation_prompts: dict[str, ChatPromptTemplate] = {}
+conversation_chains: dict[tuple, Tuple[Chain, str]] = {}
+response_caches: dict[str, ResponseCache] = {}
+summary_llms: dict[str, BaseChatModel] = {}
+
+
+@dataclass
+class LLMRoute:
+    """
+    The model chosen to answer a prompt.
+
+    Attributes:
+        provider (str): The provider of the model.
+        model (str): The name of the model.
+        reason (str): Why the model was chosen: "selected", "short" or "long".
+    """
+
+    provider: str
+    model: str
+    reason: str
+
+
+class PrefetchedRetrievalChain(ConversationalRetrievalChain):
+    """
+    ConversationalRetrievalChain that answers from documents retrieved ahead of
+    time, passed in as `retrieved_documents`, unless the question was rephrased
+    from the chat history.
+    """
+
+    def _get_docs(
+        self,
+        question: str,
+        inputs: dict[str, Any],
+        *,
+        run_manager: CallbackManagerForChainRun,
+    ) -> list[Document]:
+        documents = inputs.get(RETRIEVED_DOCUMENTS)
+        if documents is not None and question == inputs["question"]:
+            return self._reduce_tokens_below_limit(documents)
+        return super()._get_docs(question, inputs, run_manager=run_manager)
 
 
 def process_sources(sources: list):
@@ -41,16 +90,34 @@ def process_sources(sources: list):
         logger.info(source.metadata["source"])
 
 
-def _get_memory(knowledge_base_name: str) -> ConversationBufferMemory:
-    # Get or create the conversation memory for the given conversation ID
-    if knowledge_base_name not in conversation_memories:
-        conversation_memories[knowledge_base_name] = ConversationBufferMemory(
+def _get_summary_llm(model: str) -> BaseChatModel:
+    # Summaries are never streamed to the user
+    if model not in summary_llms:
+        summary_llms[model] = create_llm(model, temperature=0.0)
+    return summary_llms[model]
+
+
+def _get_memory(
+    knowledge_base_name: str, session_id: str, model: str
+) -> TokenBudgetMemory:
+    # Get or create the conversation memory for the given session and knowledge base
+    memory_key = (session_id, knowledge_base_name)
+    if memory_key not in conversation_memories:
+        conversation_memories[memory_key] = TokenBudgetMemory(
+            llm=_get_summary_llm(model),
+            model=model,
+            max_token_limit=get_memory_token_budget(model),
             memory_key=f"{CHAT_HISTORY}",
             return_messages=True,
             input_key="question",
             output_key="answer",
         )
-    memory = conversation_memories[knowledge_base_name]
+    memory = conversation_memories[memory_key]
+    if memory.model != model:
+        # The history is measured and summarized with the selected model
+        memory.llm = _get_summary_llm(model)
+        memory.model = model
+        memory.max_token_limit = get_memory_token_budget(model)
     return memory
 
 
@@ -68,6 +135,7 @@ def _get_prompt(knowledge_base_name: str) -> ChatPromptTemplate:
     return prompt
 
 
+@timed("ai.chat")
 def stream_chat_with_llm(
     user_input: str,
     knowledge_base_name: str,
@@ -77,6 +145,8 @@ def stream_chat_with_llm(
     knowledge_base_documents: dict[str, KnowledgeBaseDocument] = {},
     use_knowledge_base: bool = False,
     streaming_callback_handler: Optional[BaseCallbackHandler] = None,
+    cancellation_token: Optional[CancellationToken] = None,
+    session_id: str = "",
 ) -> Tuple[dict, bool]:
     logger.debug(
         "llm.chat",
@@ -89,34 +159,252 @@ def stream_chat_with_llm(
         streaming_callback_handler=streaming_callback_handler,
     )
 
-    llm = create_llm(model, temperature, streaming_callback_handler)
-    memory, prompt = get_conversation_components(knowledge_base_name)
-    chain, response_key, refreshed_vectorstore = configure_chain(
-        llm,
-        memory,
-        prompt,
-        use_knowledge_base,
-        knowledge_base_name,
-        knowledge_base_documents,
+    use_knowledge_base = bool(
+        use_knowledge_base and knowledge_base_name and knowledge_base_documents
     )
+    refreshed_vectorstore = False
+    if use_knowledge_base:
+        refreshed_vectorstore = prepare_documents(
+            knowledge_base_name, knowledge_base_documents
+        )
 
-    logger.debug("ai.send_request", model=model, user_input=user_input)
-    llm_response = get_response(
-        chain=chain,
-        qa={"question": user_input}
-        if use_knowledge_base
-        else {"user_input": user_input, "question": user_input},
-        model=model,
+    route = get_llm_route(
         user_input=user_input,
-        response_key=response_key,
-        return_sources=True if use_knowledge_base else False,
+        knowledge_base_name=knowledge_base_name,
+        session_id=session_id,
+        model=model,
+        use_knowledge_base=use_knowledge_base,
+    )
+    chain, response_key = get_chain(
+        knowledge_base_name=knowledge_base_name,
+        model=model,
+        temperature=temperature,
+        use_knowledge_base=use_knowledge_base,
+        streaming=streaming_callback_handler is not None,
+        session_id=session_id,
+        route=route,
     )
 
+    response_cache = get_response_cache()
+    retrieved_documents: Optional[list[Document]] = None
+    if response_cache is not None:
+        cache_key, retrieved_documents = get_response_cache_key(
+            chain=chain,
+            user_input=user_input,
+            model=route.model,
+            temperature=temperature,
+            knowledge_base_documents=knowledge_base_documents,
+            use_knowledge_base=use_knowledge_base,
+        )
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
+            replay_response(
+                chain,
+                user_input,
+                cached_response["response"],
+                streaming_callback_handler,
+            )
+            cached_response["cached"] = True
+            process_sources(cached_response.get("sources", []))
+            return cached_response, refreshed_vectorstore
+
+    callbacks: list[BaseCallbackHandler] = []
+    if streaming_callback_handler:
+        callbacks.append(streaming_callback_handler)
+    if cancellation_token is not None:
+        if cancellation_token.is_cancelled:
+            return (
+                get_cancelled_response(chain, user_input, cancellation_token),
+                refreshed_vectorstore,
+            )
+        callbacks.append(cancellation_token)
+
+    qa = (
+        {"question": user_input}
+        if use_knowledge_base
+        else {"user_input": user_input, "question": user_input}
+    )
+    if retrieved_documents is not None:
+        # Answer from the chunks the cache key was built from
+        qa[RETRIEVED_DOCUMENTS] = retrieved_documents
+
+    logger.debug("ai.send_request", model=route.model, user_input=user_input)
+    try:
+        llm_response = get_response(
+            chain=chain,
+            qa=qa,
+            model=route.model,
+            provider=route.provider,
+            user_input=user_input,
+            response_key=response_key,
+            return_sources=True if use_knowledge_base else False,
+            callbacks=callbacks or None,
+        )
+    except Exception:
+        if cancellation_token is None or not cancellation_token.is_cancelled:
+            raise
+        return (
+            get_cancelled_response(chain, user_input, cancellation_token),
+            refreshed_vectorstore,
+        )
+
+    if response_cache is not None:
+        response_cache.put(cache_key, llm_response)
+
     sources = llm_response.get("sources", [])
     process_sources(sources)
     return llm_response, refreshed_vectorstore
 
 
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Gets the shared response cache, or None unless it is enabled in the settings.
+
+    Returns:
+        Optional[ResponseCache]: The response cache.
+    """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return None
+    filepath = settings.RESPONSE_CACHE_FILEPATH
+    if filepath not in response_caches:
+        response_caches[filepath] = ResponseCache(
+            cache_filepath=filepath,
+            embeddings=(
+                create_embeddings()
+                if settings.RESPONSE_CACHE_SIMILARITY_THRESHOLD > 0
+                else None
+            ),
+        )
+    return response_caches[filepath]
+
+
+@timed("ai.response_cache.key")
+def get_response_cache_key(
+    chain: Chain,
+    user_input: str,
+    model: str,
+    temperature: float,
+    knowledge_base_documents: dict[str, KnowledgeBaseDocument],
+    use_knowledge_base: bool,
+) -> Tuple[ResponseCacheKey, Optional[list[Document]]]:
+    """
+    Builds the response cache key of a prompt.
+
+    The key includes the conversation history, so a follow-up is only answered
+    from the cache within the same conversation. With a knowledge base and no
+    history, the chunks are retrieved up front so a cached response is only reused
+    when the same context would be sent to the model; the chain then answers from
+    those chunks instead of retrieving them again. Follow-ups are rephrased with
+    the history before retrieval, so their chunks are pinned down by the history.
+
+    Args:
+        chain (Chain): The chain that would answer the prompt.
+        user_input (str): The user's prompt.
+        model (str): The name of the model.
+        temperature (float): The sampling temperature.
+        knowledge_base_documents (dict[str, KnowledgeBaseDocument]): The documents of the knowledge base.
+        use_knowledge_base (bool): Whether to retrieve from the knowledge base.
+
+    Returns:
+        Tuple[ResponseCacheKey, Optional[list[Document]]]: The cache key, and the chunks retrieved for it, if any.
+    """  # noqa
+    memory = chain.memory
+    history_version = get_history_version(
+        memory.chat_memory.messages, memory.moving_summary_buffer
+    )
+    knowledge_base_version = ""
+    chunk_ids: list[str] = []
+    documents: Optional[list[Document]] = None
+    if use_knowledge_base:
+        knowledge_base_version = get_knowledge_base_version(knowledge_base_documents)
+        if not history_version:
+            documents = chain.retriever.get_relevant_documents(user_input)
+            chunk_ids = [
+                document.metadata.get("chunk_id", document.page_content)
+                for document in documents
+            ]
+    cache_key = ResponseCacheKey(
+        model=model,
+        temperature=temperature,
+        knowledge_base_version=knowledge_base_version,
+        prompt=user_input,
+        chunk_ids=chunk_ids,
+        history_version=history_version,
+    )
+    return cache_key, documents
+
+
+def replay_response(
+    chain: Chain,
+    user_input: str,
+    response: str,
+    streaming_callback_handler: Optional[BaseCallbackHandler] = None,
+) -> None:
+    """
+    Replays a cached response as if the model had just produced it: its tokens
+    are streamed to the handler and the exchange is added to the chain's memory.
+
+    Args:
+        chain (Chain): The chain that would have answered the prompt.
+        user_input (str): The user's prompt.
+        response (str): The cached response.
+        streaming_callback_handler (Optional[BaseCallbackHandler], optional): The handler to stream tokens to.
+    """  # noqa
+    if streaming_callback_handler is not None:
+        for token in split_words(response):
+            streaming_callback_handler.on_llm_new_token(token)
+    save_exchange(chain, user_input, response)
+
+
+def save_exchange(chain: Chain, user_input: str, response: str) -> None:
+    """
+    Adds a prompt and its response to the chain's conversation memory.
+
+    Args:
+        chain (Chain): The chain whose memory to add to.
+        user_input (str): The user's prompt.
+        response (str): The response.
+    """
+    memory = chain.memory
+    memory.save_context({"question": user_input}, {memory.output_key: response})
+
+
+def get_cancelled_response(
+    chain: Chain, user_input: str, cancellation_token: CancellationToken
+) -> dict:
+    """
+    Builds the response of a cancelled request from the answer streamed before it
+    was cancelled, and keeps that partial answer in the conversation memory.
+
+    The tokens saved are an upper bound: the output limit of the model less the
+    tokens already streamed, though the answer may have ended well before it.
+
+    Args:
+        chain (Chain): The chain that was answering the prompt.
+        user_input (str): The user's prompt.
+        cancellation_token (CancellationToken): The token the request was cancelled with.
+
+    Returns:
+        dict: The partial response, flagged as cancelled, with the most tokens the cancellation saved.
+    """  # noqa
+    partial_output = cancellation_token.partial_output
+    if partial_output:
+        save_exchange(chain, user_input, partial_output)
+    max_tokens_saved = max(
+        0, settings.LLM_MAX_OUTPUT_TOKENS - cancellation_token.tokens
+    )
+    logger.info(
+        "ai.cancelled",
+        tokens_streamed=cancellation_token.tokens,
+        max_tokens_saved=max_tokens_saved,
+    )
+    return {
+        "response": partial_output,
+        "cancelled": True,
+        "max_tokens_saved": max_tokens_saved,
+    }
+
+
 def get_response(
     chain: Chain,
     qa: dict[str, str],
@@ -124,16 +412,22 @@ def get_response(
     user_input: str,
     response_key: str,
     return_sources: bool = False,
+    callbacks: Optional[list[BaseCallbackHandler]] = None,
+    provider: Optional[str] = None,
 ) -> dict:
     ic(chain, model, user_input)
-    with get_openai_callback() as cb:
+    # Timed per provider, so local and hosted models can be compared
+    provider = provider or settings.LLM_PROVIDER
+    with span(f"ai.llm.{provider}", model=model) as fields, get_openai_callback() as cb:
         logger.debug("ai.send_request", model=model)
-        llm_response = chain(qa)
+        llm_response = chain(qa, callbacks=callbacks)
         logger.debug(
             "ai.get_response",
             usage=cb,
             model=model,
         )
+        fields["prompt_tokens"] = cb.prompt_tokens
+        fields["completion_tokens"] = cb.completion_tokens
 
     result = {"response": llm_response[response_key]}
     if return_sources and "source_documents" in llm_response:
@@ -142,88 +436,304 @@ def get_response(
 
 
 def refresh_vectorstore(
-    knowledge_base_documents: dict[str, KnowledgeBaseDocument], knowledge_base_name: str
-) -> None:
+    knowledge_base_documents: dict[str, KnowledgeBaseDocument],
+    knowledge_base_name: str,
+    full_rebuild: bool = False,
+    progress_callback: Optional[ProgressCallback] = None,
+) -> IndexStats:
     """
-    Recreates the ChromaDB vector store for a given knowledge base.
+    Syncs the ChromaDB vector store for a given knowledge base with its documents.
+
+    By default only new or changed chunks are embedded and chunks of removed
+    documents are deleted. A full rebuild drops the vector store first, which
+    re-embeds every chunk.
 
     Args:
-        document_data (dict[str, bytes]): A dictionary containing document data, where the keys are document filenames
-            and the values are the document contents in bytes.
+        knowledge_base_documents (dict[str, KnowledgeBaseDocument]): The documents of the knowledge base.
         knowledge_base_name (str): The name of the knowledge base.
+        full_rebuild (bool, optional): Whether to delete and recreate the vector store. Defaults to False.
+        progress_callback (Optional[ProgressCallback], optional): Called with the number of processed and total documents.
+
+    Returns:
+        IndexStats: How many chunks were skipped, added and removed.
     """  # noqa
-    delete_vectorstore(knowledge_base_name)
-    create_vectorstore(
-        documents=get_document_chunks(load_documents(knowledge_base_documents)),
-        embeddings=OpenAIEmbeddings(api_key=settings.OPENAI_API_KEY),
+    if full_rebuild:
+        delete_vectorstore(knowledge_base_name)
+    index_stats = index_knowledge_base(
         knowledge_base_name=knowledge_base_name,
+        knowledge_base_documents=knowledge_base_documents,
+        embeddings=create_embeddings(),
+        progress_callback=progress_callback,
     )
+    invalidate_chains(knowledge_base_name)
+    return index_stats
 
 
 def create_llm(
-    model, temperature: float, streaming_callback_handler: Optional[BaseCallbackHandler]
-):
-    return ChatOpenAI(
-        api_key=settings.OPENAI_API_KEY,
-        temperature=temperature,
-        model=model,
-        streaming=True if streaming_callback_handler else False,
-        verbose=True if streaming_callback_handler else False,
-        callback_manager=(
-            CallbackManager([streaming_callback_handler])
-            if streaming_callback_handler
-            else None
-        ),
+    model,
+    temperature: float,
+    streaming: bool = False,
+    provider: Optional[str] = None,
+) -> BaseChatModel:
+    """
+    Creates the chat model with the given or configured provider. Streaming
+    callbacks are passed per request rather than bound to the model, so the same
+    client can be reused across turns.
+
+    Args:
+        model (str): The name of the model.
+        temperature (float): The sampling temperature.
+        streaming (bool, optional): Whether to stream tokens. Defaults to False.
+        provider (Optional[str], optional): The provider. Defaults to settings.LLM_PROVIDER.
+
+    Returns:
+        BaseChatModel: The chat model.
+    """  # noqa
+    return create_chat_model(model, temperature, streaming, provider)
+
+
+def get_prompt_tokens(
+    user_input: str,
+    memory: TokenBudgetMemory,
+    model: str,
+    use_knowledge_base: bool,
+) -> int:
+    """
+    Estimates the tokens of the prompt sent for a user input: the input, the
+    conversation history and its summary, and with a knowledge base the budget of
+    retrieved context.
+
+    Args:
+        user_input (str): The user's prompt.
+        memory (TokenBudgetMemory): The conversation memory.
+        model (str): The name of the model.
+        use_knowledge_base (bool): Whether to retrieve from the knowledge base.
+
+    Returns:
+        int: The estimated number of prompt tokens.
+    """  # noqa
+    tokens = count_tokens(user_input, model) + memory.count_tokens(memory.buffer)
+    if memory.moving_summary_buffer:
+        tokens += count_tokens(memory.moving_summary_buffer, model)
+    if use_knowledge_base:
+        tokens += get_context_token_budget(model)
+    return tokens
+
+
+def route_llm(prompt_tokens: int, model: str, use_knowledge_base: bool) -> LLMRoute:
+    """
+    Chooses the model to answer a prompt.
+
+    Short prompts without a knowledge base go to the local model, whose context
+    window is too small for retrieved context. Prompts of at least
+    `LLM_ROUTER_HEAVY_MIN_TOKENS` go to the heavy model. Every other prompt, and
+    every prompt when routing is disabled, goes to the selected model.
+
+    Args:
+        prompt_tokens (int): The estimated number of prompt tokens.
+        model (str): The name of the selected model.
+        use_knowledge_base (bool): Whether to retrieve from the knowledge base.
+
+    Returns:
+        LLMRoute: The chosen provider and model.
+    """  # noqa
+    if settings.LLM_ROUTING_ENABLED:
+        if (
+            not use_knowledge_base
+            and prompt_tokens <= settings.LLM_ROUTER_LOCAL_MAX_TOKENS
+        ):
+            return LLMRoute(
+                provider=settings.LLM_ROUTER_LOCAL_PROVIDER,
+                model=settings.LOCAL_LLM_MODEL,
+                reason="short",
+            )
+        if prompt_tokens >= settings.LLM_ROUTER_HEAVY_MIN_TOKENS:
+            return LLMRoute(
+                provider=settings.LLM_PROVIDER,
+                model=settings.LLM_ROUTER_HEAVY_MODEL,
+                reason="long",
+            )
+    return LLMRoute(provider=settings.LLM_PROVIDER, model=model, reason="selected")
+
+
+def get_llm_route(
+    user_input: str,
+    knowledge_base_name: str,
+    session_id: str,
+    model: str,
+    use_knowledge_base: bool,
+) -> LLMRoute:
+    """
+    Chooses the model to answer a prompt of a chat session, see `route_llm`.
+
+    Args:
+        user_input (str): The user's prompt.
+        knowledge_base_name (str): The name of the knowledge base.
+        session_id (str): The chat session.
+        model (str): The name of the selected model.
+        use_knowledge_base (bool): Whether to retrieve from the knowledge base.
+
+    Returns:
+        LLMRoute: The chosen provider and model.
+    """  # noqa
+    if not settings.LLM_ROUTING_ENABLED:
+        return LLMRoute(provider=settings.LLM_PROVIDER, model=model, reason="selected")
+    memory = _get_memory(knowledge_base_name, session_id, model)
+    prompt_tokens = get_prompt_tokens(user_input, memory, model, use_knowledge_base)
+    route = route_llm(prompt_tokens, model, use_knowledge_base)
+    logger.info(
+        "ai.route",
+        provider=route.provider,
+        model=route.model,
+        reason=route.reason,
+        prompt_tokens=prompt_tokens,
+        use_knowledge_base=use_knowledge_base,
     )
+    return route
 
 
-def get_conversation_components(knowledge_base_name: str):
-    memory: ConversationBufferMemory = _get_memory(knowledge_base_name)
+def get_conversation_components(
+    knowledge_base_name: str, session_id: str = "", model: str = "gpt-3.5-turbo-1106"
+):
+    memory: TokenBudgetMemory = _get_memory(knowledge_base_name, session_id, model)
     prompt: ChatPromptTemplate = _get_prompt(knowledge_base_name)
     return memory, prompt
 
 
+def get_context_token_budget(model: str) -> int:
+    """
+    Gets the number of tokens of retrieved context that may be sent to a model.
+
+    Args:
+        model (str): The name of the model.
+
+    Returns:
+        int: The token budget, a share of the model's context window.
+    """  # noqa
+    context_window = settings.LLMS.get(model, {}).get("content_window", 16385)
+    return int(context_window * settings.VECTORSTORE_CONTEXT_RATIO)
+
+
 def configure_chain(
     llm,
-    memory: ConversationBufferMemory,
+    memory: TokenBudgetMemory,
     prompt: ChatPromptTemplate,
     use_knowledge_base: bool,
     knowledge_base_name: str,
-    knowledge_base_documents: dict[str, KnowledgeBaseDocument],
-):
-    refreshed_vectorstore = False
-    if use_knowledge_base and knowledge_base_name and knowledge_base_documents:
-        chunked_documents, refreshed_vectorstore = prepare_documents(
-            knowledge_base_name, knowledge_base_documents
-        )
+    model: str,
+) -> Tuple[Chain, str]:
+    if use_knowledge_base:
         retriever = get_vectorstore_retriever(
-            documents=chunked_documents,
-            embeddings=OpenAIEmbeddings(api_key=settings.OPENAI_API_KEY),
+            documents=[],
+            embeddings=create_embeddings(),
             knowledge_base_name=knowledge_base_name,
+            max_tokens=get_context_token_budget(model),
+            model=model,
         )
-        memory.output_key = "answer"
-        chain = ConversationalRetrievalChain.from_llm(
+        chain = PrefetchedRetrievalChain.from_llm(
             llm=llm,
             retriever=retriever,
             memory=memory,
             return_source_documents=True,
         )
+        # Not the chain that rephrases the question from the chat history
+        chain.combine_docs_chain.llm_chain.tags = [ANSWER_TAG]
         response_key = "answer"
     else:
-        memory.output_key = "text"
-        chain = LLMChain(llm=llm, prompt=prompt, memory=memory)
+        chain = LLMChain(llm=llm, prompt=prompt, memory=memory, tags=[ANSWER_TAG])
         response_key = "text"
-    return chain, response_key, refreshed_vectorstore
+    # Chains validate a shallow copy of the memory; share the original instead so
+    # its summary and budget are the same across every chain of the session
+    chain.memory = memory
+    return chain, response_key
+
+
+def get_chain(
+    knowledge_base_name: str,
+    model: str,
+    temperature: float,
+    use_knowledge_base: bool,
+    streaming: bool,
+    session_id: str = "",
+    route: Optional[LLMRoute] = None,
+) -> Tuple[Chain, str]:
+    """
+    Gets or creates the chain for the given chat configuration.
+
+    Chains, along with their LLM client and retriever, are kept warm across turns
+    and only rebuilt when the configuration changes or the knowledge base's chains
+    are invalidated.
+
+    Args:
+        knowledge_base_name (str): The name of the knowledge base.
+        model (str): The name of the model.
+        temperature (float): The sampling temperature.
+        use_knowledge_base (bool): Whether to retrieve from the knowledge base.
+        streaming (bool): Whether to stream tokens.
+        session_id (str, optional): The chat session, which has its own conversation memory.
+        route (Optional[LLMRoute], optional): The model to answer with. Defaults to the selected model.
+
+    Returns:
+        Tuple[Chain, str]: The chain and the key of the response in its output.
+    """  # noqa
+    memory, prompt = get_conversation_components(knowledge_base_name, session_id, model)
+    # The memory is shared by both chain types of a knowledge base
+    memory.output_key = "answer" if use_knowledge_base else "text"
+
+    # The memory follows the selected model, whichever model answers the turn
+    route = route or LLMRoute(
+        provider=settings.LLM_PROVIDER, model=model, reason="selected"
+    )
+    chain_key = (
+        knowledge_base_name,
+        route.provider,
+        route.model,
+        temperature,
+        use_knowledge_base,
+        streaming,
+        session_id,
+    )
+    if chain_key not in conversation_chains:
+        logger.debug("ai.chain.cache.miss", chain_key=chain_key)
+        conversation_chains[chain_key] = configure_chain(
+            llm=create_llm(route.model, temperature, streaming, route.provider),
+            memory=memory,
+            prompt=prompt,
+            use_knowledge_base=use_knowledge_base,
+            knowledge_base_name=knowledge_base_name,
+            model=route.model,
+        )
+    return conversation_chains[chain_key]
 
 
+def invalidate_chains(knowledge_base_name: str) -> None:
+    """
+    Drops the cached chains of a knowledge base, e.g. after its vector store changed.
+
+    Args:
+        knowledge_base_name (str): The name of the knowledge base.
+    """  # noqa
+    for chain_key in list(conversation_chains.keys()):
+        if chain_key[0] == knowledge_base_name:
+            conversation_chains.pop(chain_key, None)
+    logger.debug("ai.chain.invalidate", knowledge_base_name=knowledge_base_name)
+
+
+@timed("ai.prepare_documents")
 def prepare_documents(
     knowledge_base_name: str, knowledge_base_documents: dict[str, KnowledgeBaseDocument]
-) -> Tuple[list[Document], bool]:
-    refreshed_vectorstore = False
-    chunked_documents: list[Document] = []
-    if not vectorstore_exists(knowledge_base_name):
-        documents = load_documents(knowledge_base_documents)
-        if documents:
-            chunked_documents = get_document_chunks(documents=documents)
-            refreshed_vectorstore = True
-    return chunked_documents, refreshed_vectorstore
+) -> bool:
+    """
+    Indexes the documents of a knowledge base if it has no vector store yet.
+
+    Args:
+        knowledge_base_name (str): The name of the knowledge base.
+        knowledge_base_documents (dict[str, KnowledgeBaseDocument]): The documents of the knowledge base.
+
+    Returns:
+        bool: True if the vector store was built, False if it already existed.
+    """  # noqa
+    if vectorstore_exists(knowledge_base_name):
+        return False
+    index_stats = refresh_vectorstore(knowledge_base_documents, knowledge_base_name)
+    return index_stats.added > 0
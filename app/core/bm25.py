@@ -0,0 +1,251 @@
+import heapq
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Iterable, Tuple
+
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.schema import BaseRetriever, Document
+
+from app.core.config import settings
+from app.core.log import logger
+
+BM25_INDEX_FILENAME = "bm25.json"
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Splits text into lowercase word tokens, keeping identifiers such as ResRefs
+    intact.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        list[str]: The tokens.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Inverted index over the chunks of a knowledge base, scored with Okapi BM25.
+
+    Chunks are keyed by the same IDs as in the vector store, so the index can be
+    updated incrementally alongside it. Only the chunks are persisted; the postings
+    are rebuilt when the index is loaded.
+
+    Args:
+        filepath (str): The path the index is persisted to.
+        k1 (float, optional): The term frequency saturation. Defaults to settings.VECTORSTORE_BM25_K1.
+        b (float, optional): The document length normalization. Defaults to settings.VECTORSTORE_BM25_B.
+    """  # noqa
+
+    def __init__(
+        self,
+        filepath: str,
+        k1: float = settings.VECTORSTORE_BM25_K1,
+        b: float = settings.VECTORSTORE_BM25_B,
+    ):
+        self.filepath = filepath
+        self.k1 = k1
+        self.b = b
+        self._documents: dict[str, Document] = {}
+        self._postings: dict[str, dict[str, int]] = {}
+        self._lengths: dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def _add(self, chunk_id: str, document: Document) -> None:
+        self._remove(chunk_id)
+        term_frequencies = Counter(tokenize(document.page_content))
+        for term, frequency in term_frequencies.items():
+            self._postings.setdefault(term, {})[chunk_id] = frequency
+        length = sum(term_frequencies.values())
+        self._documents[chunk_id] = document
+        self._lengths[chunk_id] = length
+        self._total_length += length
+
+    def _remove(self, chunk_id: str) -> None:
+        document = self._documents.pop(chunk_id, None)
+        if document is None:
+            return
+        for term in set(tokenize(document.page_content)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(chunk_id)
+
+    def add_documents(self, documents: Iterable[Tuple[str, Document]]) -> None:
+        """
+        Adds chunks to the index, replacing any chunks with the same IDs.
+
+        Args:
+            documents (Iterable[Tuple[str, Document]]): The IDs and chunks to add.
+        """
+        with self._lock:
+            for chunk_id, document in documents:
+                self._add(chunk_id, document)
+
+    def delete(self, chunk_ids: Iterable[str]) -> None:
+        """
+        Removes chunks from the index.
+
+        Args:
+            chunk_ids (Iterable[str]): The IDs of the chunks to remove.
+        """
+        with self._lock:
+            for chunk_id in chunk_ids:
+                self._remove(chunk_id)
+
+    def search(self, query: str, k: int) -> list[Tuple[Document, float]]:
+        """
+        Finds the chunks that best match a query.
+
+        Args:
+            query (str): The query.
+            k (int): The maximum number of chunks to return.
+
+        Returns:
+            list[Tuple[Document, float]]: The chunks and their scores, best first.
+        """
+        with self._lock:
+            if not self._documents:
+                return []
+            count = len(self._documents)
+            average_length = self._total_length / count or 1
+            scores: dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                frequency = len(postings)
+                idf = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+                for chunk_id, term_frequency in postings.items():
+                    length_norm = (
+                        1 - self.b + self.b * (self._lengths[chunk_id] / average_length)
+                    )
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * (
+                        term_frequency
+                        * (self.k1 + 1)
+                        / (term_frequency + self.k1 * length_norm)
+                    )
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(self._documents[chunk_id], score) for chunk_id, score in best]
+
+    def save(self) -> None:
+        """
+        Persists the chunks of the index, atomically replacing the previous file.
+        """
+        with self._lock:
+            data = {
+                chunk_id: {
+                    "page_content": document.page_content,
+                    "metadata": document.metadata,
+                }
+                for chunk_id, document in self._documents.items()
+            }
+        os.makedirs(os.path.dirname(self.filepath) or ".", exist_ok=True)
+        temp_filepath = f"{self.filepath}.tmp"
+        with open(temp_filepath, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_filepath, self.filepath)
+        logger.debug("bm25.save", filepath=self.filepath, documents=len(data))
+
+    @classmethod
+    def load(cls, filepath: str) -> "BM25Index":
+        """
+        Loads a persisted index, or creates an empty one if none exists.
+
+        Args:
+            filepath (str): The path the index is persisted to.
+
+        Returns:
+            BM25Index: The index.
+        """
+        index = cls(filepath)
+        if os.path.exists(filepath):
+            with open(filepath, "r") as f:
+                data = json.load(f)
+            index.add_documents(
+                (chunk_id, Document(**document)) for chunk_id, document in data.items()
+            )
+            logger.debug("bm25.load", filepath=filepath, documents=len(index))
+        return index
+
+
+bm25_indexes: dict[str, BM25Index] = {}
+
+
+def get_bm25_filepath(persist_directory: str) -> str:
+    """
+    Gets the path of the BM25 index kept alongside a vector store.
+
+    Args:
+        persist_directory (str): The directory the vector store is persisted in.
+
+    Returns:
+        str: The path of the index.
+    """
+    return os.path.join(persist_directory, BM25_INDEX_FILENAME)
+
+
+def get_bm25_index(persist_directory: str) -> BM25Index:
+    """
+    Gets the BM25 index of a vector store, loading it once per process.
+
+    Args:
+        persist_directory (str): The directory the vector store is persisted in.
+
+    Returns:
+        BM25Index: The index.
+    """
+    if persist_directory not in bm25_indexes:
+        bm25_indexes[persist_directory] = BM25Index.load(
+            get_bm25_filepath(persist_directory)
+        )
+    return bm25_indexes[persist_directory]
+
+
+def delete_bm25_index(persist_directory: str) -> None:
+    """
+    Deletes the BM25 index of a vector store from memory and disk.
+
+    Args:
+        persist_directory (str): The directory the vector store is persisted in.
+    """
+    bm25_indexes.pop(persist_directory, None)
+    filepath = get_bm25_filepath(persist_directory)
+    if os.path.exists(filepath):
+        os.remove(filepath)
+
+
+class BM25Retriever(BaseRetriever):
+    """
+    Retrieves the chunks of a BM25 index that best match the query's keywords.
+
+    Attributes:
+        index (BM25Index): The index to search.
+        k (int): The number of chunks to retrieve.
+    """
+
+    index: BM25Index
+    k: int = settings.VECTORSTORE_MAX_DOCUMENTS
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        return [document for document, _ in self.index.search(query, self.k)]
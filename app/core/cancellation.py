@@ -0,0 +1,126 @@
+import threading
+from typing import Any, Callable, Optional
+from uuid import UUID
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema.messages import BaseMessage
+
+from app.core.log import logger
+
+# Tags the chain whose model writes the answer, as opposed to e.g. rephrasing the
+# question, so only its tokens are kept as partial output
+ANSWER_TAG = "answer"
+
+
+class ChatCancelledError(Exception):
+    """Raised inside a streamed LLM request once it has been cancelled."""
+
+
+class CancellationToken(BaseCallbackHandler):
+    """
+    Cancels an in-flight LLM request.
+
+    The token is passed to the chain as a callback, so it sees every streamed
+    token and raises `ChatCancelledError` on the first one after cancellation.
+    Only the tokens of models called by a chain tagged with `ANSWER_TAG` are kept
+    as the partial output. Streams attached with `attach` are closed as soon as
+    `cancel` is called, so the connection is dropped even while the model is still
+    thinking.
+
+    Attributes:
+        partial_output (str): The answer streamed before the request was cancelled.
+        tokens (int): The number of answer tokens streamed.
+    """
+
+    raise_error: bool = True
+
+    def __init__(self):
+        self.partial_output = ""
+        self.tokens = 0
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._closers: list[Callable[[], Any]] = []
+        self._answer_chain_runs: set[UUID] = set()
+        self._answer_llm_runs: set[UUID] = set()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._cancelled.wait(timeout)
+
+    def attach(self, close: Callable[[], Any]) -> None:
+        """
+        Registers a function that aborts the request, e.g. closing its HTTP stream.
+
+        Args:
+            close (Callable[[], Any]): Closes the request, called once on cancel.
+        """  # noqa
+        with self._lock:
+            if not self.is_cancelled:
+                self._closers.append(close)
+                return
+        close()
+
+    def cancel(self) -> None:
+        """
+        Cancels the request and closes every attached stream.
+        """
+        with self._lock:
+            if self.is_cancelled:
+                return
+            self._cancelled.set()
+            closers, self._closers = self._closers, []
+        for close in closers:
+            try:
+                close()
+            except Exception as e:
+                logger.warning("cancellation.close.error", exception=str(e))
+        logger.debug("cancellation.cancel", tokens=self.tokens)
+
+    def on_chain_start(
+        self,
+        serialized: dict[str, Any],
+        inputs: dict[str, Any],
+        *,
+        run_id: UUID,
+        tags: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        if tags and ANSWER_TAG in tags:
+            self._answer_chain_runs.add(run_id)
+
+    def on_llm_start(
+        self,
+        serialized: dict[str, Any],
+        prompts: list[str],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        if parent_run_id in self._answer_chain_runs:
+            self._answer_llm_runs.add(run_id)
+
+    def on_chat_model_start(
+        self,
+        serialized: dict[str, Any],
+        messages: list[list[BaseMessage]],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        if parent_run_id in self._answer_chain_runs:
+            self._answer_llm_runs.add(run_id)
+
+    def on_llm_new_token(
+        self, token: str, *, run_id: Optional[UUID] = None, **kwargs: Any
+    ) -> None:
+        if self.is_cancelled:
+            raise ChatCancelledError("The request was cancelled")
+        if run_id not in self._answer_llm_runs:
+            return
+        self.partial_output += token
+        self.tokens += 1
@@ -0,0 +1,153 @@
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from app.core.cancellation import CancellationToken
+from app.core.config import settings
+from app.core.log import logger
+
+
+class ChatQueueFullError(Exception):
+    """Raised when a prompt is submitted while the chat queue is full."""
+
+
+@dataclass
+class ChatJob:
+    """
+    A prompt waiting for, or being given, a response.
+
+    Attributes:
+        prompt (str): The user's prompt.
+        cancellation_token (CancellationToken): Cancels the job's LLM request.
+    """
+
+    prompt: str
+    cancellation_token: CancellationToken = field(default_factory=CancellationToken)
+
+    def cancel(self) -> None:
+        self.cancellation_token.cancel()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self.cancellation_token.is_cancelled
+
+
+class ChatPipeline:
+    """
+    Answers prompts one at a time on a background worker thread, so the UI
+    thread is never blocked by indexing or the LLM request.
+
+    Prompts submitted while a response is in progress are queued. Cancelling
+    aborts the LLM request of the job in progress through its cancellation token
+    and drops every queued job.
+
+    Args:
+        handler (Callable[[ChatJob], None]): Answers a prompt, on the worker thread.
+        on_change (Optional[Callable[[], None]], optional): Called whenever the number of pending jobs changes.
+        max_queued (int, optional): The maximum number of queued prompts. Defaults to settings.CHAT_MAX_QUEUED_PROMPTS.
+    """  # noqa
+
+    def __init__(
+        self,
+        handler: Callable[[ChatJob], None],
+        on_change: Optional[Callable[[], None]] = None,
+        max_queued: int = settings.CHAT_MAX_QUEUED_PROMPTS,
+    ):
+        self.handler = handler
+        self.on_change = on_change
+        self.current_job: Optional[ChatJob] = None
+        self._jobs: queue.Queue[Optional[ChatJob]] = queue.Queue(maxsize=max_queued)
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    @property
+    def queued(self) -> int:
+        return self._jobs.qsize()
+
+    @property
+    def busy(self) -> bool:
+        return self.current_job is not None or not self._jobs.empty()
+
+    def _notify(self) -> None:
+        if self.on_change is not None:
+            try:
+                self.on_change()
+            except Exception as e:
+                logger.error("chat_pipeline.on_change.error", exception=str(e))
+
+    def _run(self) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            if job.is_cancelled:
+                continue
+            self.current_job = job
+            self._notify()
+            try:
+                self.handler(job)
+            except Exception as e:
+                logger.error("chat_pipeline.handler.error", exception=str(e))
+            finally:
+                self.current_job = None
+                self._notify()
+
+    def submit(self, prompt: str) -> ChatJob:
+        """
+        Queues a prompt to be answered.
+
+        Args:
+            prompt (str): The user's prompt.
+
+        Raises:
+            ChatQueueFullError: If too many prompts are already queued.
+
+        Returns:
+            ChatJob: The queued job.
+        """
+        job = ChatJob(prompt=prompt)
+        try:
+            self._jobs.put_nowait(job)
+        except queue.Full:
+            raise ChatQueueFullError(
+                f"Only {self._jobs.maxsize} prompts can be queued"
+            ) from None
+        logger.debug("chat_pipeline.submit", queued=self.queued)
+        self._notify()
+        return job
+
+    def cancel(self) -> int:
+        """
+        Cancels the job in progress and drops every queued job.
+
+        Returns:
+            int: The number of jobs cancelled.
+        """
+        cancelled = 0
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job.cancel()
+                cancelled += 1
+        current_job = self.current_job
+        if current_job is not None and not current_job.is_cancelled:
+            current_job.cancel()
+            cancelled += 1
+        logger.debug("chat_pipeline.cancel", cancelled=cancelled)
+        self._notify()
+        return cancelled
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Cancels all jobs and stops the worker thread.
+
+        Args:
+            timeout (Optional[float], optional): How long to wait for the worker to stop.
+        """  # noqa
+        self.cancel()
+        self._jobs.put(None)
+        self._worker.join(timeout)
@@ -4,10 +4,21 @@ from pydantic_settings import BaseSettings
 class Settings(BaseSettings):
     APP_ENV: str = "dev"
     LOG_LEVEL: str = "INFO"
+    # Shows per-stage request latency next to the chat
+    LATENCY_PANEL_ENABLED: bool = False
 
     CHAT_USERNAME: str = "You"
     CHAT_BOTNAME: str = "Illiana"
-    CHAT_TEXT_ANIMATION_SPEED: float = 0.008
+    # Seconds between animation frames, and the longest an animation may take
+    CHAT_TEXT_ANIMATION_SPEED: float = 0.03
+    CHAT_TEXT_ANIMATION_MAX_DURATION: float = 0.5
+    # Streamed tokens are rendered in batches, 0 renders every token
+    CHAT_STREAM_MAX_UPDATES_PER_SECOND: float = 20
+    CHAT_STREAM_FLUSH_TOKENS: int = 0
+    CHAT_MAX_QUEUED_PROMPTS: int = 5
+    # Share of the context window kept as conversation history, older turns are summarized
+    CHAT_MEMORY_CONTEXT_RATIO: float = 0.25
+    CHAT_MEMORY_MAX_TURNS: int = 20
 
     SUPPORTED_DOCUMENTS: list[str] = [
         "csv",
@@ -24,8 +35,39 @@ class Settings(BaseSettings):
 
     OPENAI_API_KEY: str = "OPEN_AI_API_KEY"
 
+    KNOWLEDGE_BASE_BACKEND: str = "sqlite"
     KNOWLEDGE_BASE_FILEPATH: str = "data/knowledge_base/knowledge_base.json"
+    KNOWLEDGE_BASE_CATALOG_FILEPATH: str = "data/knowledge_base/knowledge_base.sqlite3"
+    KNOWLEDGE_BASE_IMPORT_MAX_WORKERS: int = 4
 
+    LOADER_MAX_WORKERS: int = 4
+    # Seconds per document, or 0 to load serially in-process without a timeout
+    LOADER_TIMEOUT: float = 300.0
+
+    # "openai", "local", or "fake" for deterministic stand-ins used in load tests
+    LLM_PROVIDER: str = "openai"
+    EMBEDDING_PROVIDER: str = "openai"
+    FAKE_LLM_LATENCY_SECONDS: float = 0.2
+    FAKE_LLM_TOKENS_PER_SECOND: float = 50.0
+    FAKE_LLM_RESPONSE_TOKENS: int = 200
+    FAKE_EMBEDDING_DIMENSIONS: int = 1536
+    FAKE_EMBEDDING_LATENCY_SECONDS: float = 0.0
+
+    # An OpenAI-compatible local server, e.g. llama.cpp, served by the "local" provider
+    LOCAL_LLM_BASE_URL: str = "http://localhost:8080/v1"
+    LOCAL_LLM_API_KEY: str = "not-needed"
+    LOCAL_LLM_MODEL: str = "local"
+
+    # Routes short prompts without a knowledge base to the local model and long
+    # prompts, counting history and retrieved context, to the heavy model
+    LLM_ROUTING_ENABLED: bool = False
+    LLM_ROUTER_LOCAL_PROVIDER: str = "local"
+    LLM_ROUTER_LOCAL_MAX_TOKENS: int = 512
+    LLM_ROUTER_HEAVY_MODEL: str = "gpt-4-1106-preview"
+    LLM_ROUTER_HEAVY_MIN_TOKENS: int = 8000
+
+    # Upper bound of a response, used to report the tokens saved by cancelling
+    LLM_MAX_OUTPUT_TOKENS: int = 4096
     LLMS: dict[str, dict[str, str | int]] = {
         "gpt-4-1106-preview": {
             "title": "GPT-4 Turbo",
@@ -69,11 +111,58 @@ class Settings(BaseSettings):
         },
     }
 
+    SPLITTER_TOKEN_AWARE: bool = True
+    SPLITTER_CHUNK_TOKENS: int = 512
+    SPLITTER_CHUNK_OVERLAP_TOKENS: int = 64
+
+    VECTORSTORE_BACKEND: str = "chroma"
     VECTORSTORE_MAX_DOCUMENTS: int = 10
+    VECTORSTORE_CONTEXT_RATIO: float = 0.25
+    VECTORSTORE_UPSERT_BATCH_SIZE: int = 64
+    VECTORSTORE_RETRIEVAL_MODE: str = "hybrid"
+    VECTORSTORE_HYBRID_FETCH_K: int = 20
+    VECTORSTORE_HYBRID_DENSE_WEIGHT: float = 1.0
+    VECTORSTORE_HYBRID_SPARSE_WEIGHT: float = 1.0
+    VECTORSTORE_RRF_K: int = 60
+    # Post-retrieval packing: drop near-duplicate chunks (Jaccard similarity of word
+    # shingles), select by MMR among PACKING_FETCH_K candidates, merge chunks that
+    # overlap by at least PACKING_MIN_OVERLAP characters, then trim to the budget
+    VECTORSTORE_CONTEXT_PACKING: bool = True
+    VECTORSTORE_PACKING_FETCH_K: int = 20
+    VECTORSTORE_PACKING_DUPLICATE_THRESHOLD: float = 0.8
+    VECTORSTORE_PACKING_MMR_LAMBDA: float = 0.7
+    VECTORSTORE_PACKING_MIN_OVERLAP: int = 32
+    VECTORSTORE_BM25_K1: float = 1.5
+    VECTORSTORE_BM25_B: float = 0.75
+    VECTORSTORE_NUMPY_INDEX: str = "flat"
+    VECTORSTORE_NUMPY_IVF_MIN_SIZE: int = 20000
+    VECTORSTORE_NUMPY_IVF_LISTS: int = 0
+    VECTORSTORE_NUMPY_IVF_PROBES: int = 8
     VECTORSTORE_ROOT_DIR: str = "data/vectorstore"
     VECTORSTORE_KNOWLEDGE_BASE_DIR: str = f"{VECTORSTORE_ROOT_DIR}/knowledge_base"
     VECTORSTORE_CHROMADB_DIR: str = f"{VECTORSTORE_ROOT_DIR}/chromadb"
 
+    EMBEDDING_MODEL: str = "text-embedding-ada-002"
+    EMBEDDING_API_BASE: str = "https://api.openai.com/v1"
+    EMBEDDING_SCHEDULER_ENABLED: bool = True
+    EMBEDDING_BATCH_MAX_TOKENS: int = 8000
+    EMBEDDING_BATCH_MAX_TEXTS: int = 256
+    EMBEDDING_MAX_CONCURRENCY: int = 4
+    EMBEDDING_MAX_RETRIES: int = 6
+    EMBEDDING_BACKOFF_SECONDS: float = 1.0
+    EMBEDDING_REQUEST_TIMEOUT: float = 60.0
+
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_FILEPATH: str = f"{VECTORSTORE_ROOT_DIR}/embedding_cache.sqlite3"
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 200000
+
+    RESPONSE_CACHE_ENABLED: bool = False
+    RESPONSE_CACHE_FILEPATH: str = f"{VECTORSTORE_ROOT_DIR}/response_cache.sqlite3"
+    RESPONSE_CACHE_TTL_SECONDS: float = 7 * 24 * 60 * 60
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1000
+    # Cosine similarity for near-duplicate prompts to hit, 0 to only match exactly
+    RESPONSE_CACHE_SIMILARITY_THRESHOLD: float = 0.0
+
     class Config:
         env_file = ".env"
 
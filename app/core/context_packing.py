@@ -0,0 +1,238 @@
+import re
+from typing import Optional
+
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+from langchain.vectorstores.utils import maximal_marginal_relevance
+
+from app.core.config import settings
+from app.core.log import logger, timed
+from app.core.splitter import pack_documents
+
+CHUNK_ID_KEY = "chunk_id"
+SHINGLE_SIZE = 5
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def get_shingles(text: str, size: int = SHINGLE_SIZE) -> set[tuple[str, ...]]:
+    """
+    Gets the word shingles of a text, i.e. its runs of `size` consecutive words.
+
+    Args:
+        text (str): The text.
+        size (int, optional): The number of words per shingle. Defaults to 5.
+
+    Returns:
+        set[tuple[str, ...]]: The shingles.
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return {tuple(words)}
+    return set(zip(*(words[offset:] for offset in range(size))))
+
+
+def drop_near_duplicates(
+    documents: list[Document],
+    threshold: float = settings.VECTORSTORE_PACKING_DUPLICATE_THRESHOLD,
+) -> list[Document]:
+    """
+    Drops documents whose shingles overlap a higher ranked document's by at least
+    the Jaccard similarity threshold.
+
+    Retrieval returns tens of chunks at most, so their similarity is computed
+    exactly rather than estimated with MinHash signatures.
+
+    Args:
+        documents (list[Document]): The documents, most relevant first.
+        threshold (float, optional): The Jaccard similarity of near-duplicates. Defaults to settings.VECTORSTORE_PACKING_DUPLICATE_THRESHOLD.
+
+    Returns:
+        list[Document]: The documents without near-duplicates, in order.
+    """  # noqa
+    kept: list[Document] = []
+    kept_shingles: list[set[tuple[str, ...]]] = []
+    for document in documents:
+        shingles = get_shingles(document.page_content)
+        if any(
+            len(shingles & other) / len(shingles | other) >= threshold
+            for other in kept_shingles
+        ):
+            continue
+        kept.append(document)
+        kept_shingles.append(shingles)
+    return kept
+
+
+def select_diverse_documents(
+    query: str,
+    documents: list[Document],
+    embeddings: Embeddings,
+    k: int,
+    lambda_mult: float = settings.VECTORSTORE_PACKING_MMR_LAMBDA,
+) -> list[Document]:
+    """
+    Selects documents by maximal marginal relevance, trading relevance to the query
+    against similarity to the documents already selected.
+
+    Args:
+        query (str): The query.
+        documents (list[Document]): The candidate documents.
+        embeddings (Embeddings): The embeddings the documents were indexed with, so cached vectors are reused.
+        k (int): The number of documents to select.
+        lambda_mult (float, optional): 1 for relevance only, 0 for diversity only. Defaults to settings.VECTORSTORE_PACKING_MMR_LAMBDA.
+
+    Returns:
+        list[Document]: The selected documents, in order of selection.
+    """  # noqa
+    if len(documents) <= 1:
+        return documents[:k]
+    query_embedding = np.array(embeddings.embed_query(query))
+    document_embeddings = embeddings.embed_documents(
+        [document.page_content for document in documents]
+    )
+    indices = maximal_marginal_relevance(
+        query_embedding, document_embeddings, lambda_mult=lambda_mult, k=k
+    )
+    return [documents[index] for index in indices]
+
+
+def merge_overlap(first: str, second: str, min_overlap: int) -> Optional[str]:
+    """
+    Joins two texts if the end of the first is the start of the second, as with
+    consecutive chunks of a document split with overlap.
+
+    Args:
+        first (str): The text that would come first.
+        second (str): The text that would come second.
+        min_overlap (int): The minimum number of overlapping characters.
+
+    Returns:
+        Optional[str]: The joined text, or None if the texts do not overlap.
+    """
+    probe = second[:min_overlap]
+    if len(probe) < min_overlap:
+        return None
+    # Start where the overlap would be all of the second text, so it is the longest
+    position = first.find(probe, max(len(first) - len(second), 0))
+    while position != -1:
+        overlap = len(first) - position
+        if second.startswith(first[position:]):
+            return first + second[overlap:]
+        position = first.find(probe, position + 1)
+    return None
+
+
+def _get_source_key(document: Document) -> tuple:
+    # Chunks of the same loaded document share every metadata value but their ID
+    return tuple(
+        sorted(
+            (key, str(value))
+            for key, value in document.metadata.items()
+            if key != CHUNK_ID_KEY
+        )
+    )
+
+
+def merge_overlapping_documents(
+    documents: list[Document],
+    min_overlap: int = settings.VECTORSTORE_PACKING_MIN_OVERLAP,
+) -> list[Document]:
+    """
+    Merges chunks of the same document whose text overlaps into a single document,
+    so their shared text is only sent once.
+
+    A merged document takes the place of its highest ranked chunk and joins the
+    IDs of its chunks.
+
+    Args:
+        documents (list[Document]): The documents, most relevant first.
+        min_overlap (int, optional): The minimum number of overlapping characters. Defaults to settings.VECTORSTORE_PACKING_MIN_OVERLAP.
+
+    Returns:
+        list[Document]: The merged documents, in order.
+    """  # noqa
+    merged: list[tuple[int, Document]] = []
+    for rank, document in enumerate(documents):
+        document = Document(
+            page_content=document.page_content, metadata=dict(document.metadata)
+        )
+        source_key = _get_source_key(document)
+        # A merged document may overlap chunks its parts did not, so repeat
+        merging = True
+        while merging:
+            merging = False
+            for index, (other_rank, other) in enumerate(merged):
+                if _get_source_key(other) != source_key:
+                    continue
+                parts = (other, document)
+                text = merge_overlap(
+                    other.page_content, document.page_content, min_overlap
+                )
+                if text is None:
+                    parts = (document, other)
+                    text = merge_overlap(
+                        document.page_content, other.page_content, min_overlap
+                    )
+                if text is None:
+                    continue
+                chunk_ids = [
+                    part.metadata[CHUNK_ID_KEY]
+                    for part in parts
+                    if part.metadata.get(CHUNK_ID_KEY)
+                ]
+                if chunk_ids:
+                    document.metadata[CHUNK_ID_KEY] = "+".join(chunk_ids)
+                document.page_content = text
+                rank = min(rank, other_rank)
+                del merged[index]
+                merging = True
+                break
+        merged.append((rank, document))
+    return [document for _, document in sorted(merged, key=lambda item: item[0])]
+
+
+@timed("context_packing.pack_context")
+def pack_context(
+    query: str,
+    documents: list[Document],
+    max_tokens: int,
+    model: str,
+    max_documents: int = settings.VECTORSTORE_MAX_DOCUMENTS,
+    embeddings: Optional[Embeddings] = None,
+) -> list[Document]:
+    """
+    Packs retrieved documents into the context sent to a model.
+
+    Near-duplicates are dropped, documents are selected for diversity by maximal
+    marginal relevance when embeddings are given, overlapping chunks of the same
+    document are merged, and the result is trimmed to the token budget.
+
+    Args:
+        query (str): The query the documents were retrieved for.
+        documents (list[Document]): The retrieved documents, most relevant first.
+        max_tokens (int): The token budget.
+        model (str): The model whose tokenizer measures documents.
+        max_documents (int, optional): The number of documents to select. Defaults to settings.VECTORSTORE_MAX_DOCUMENTS.
+        embeddings (Optional[Embeddings], optional): The embeddings for diversity selection. Relevance order is kept if not given.
+
+    Returns:
+        list[Document]: The packed documents.
+    """  # noqa
+    unique = drop_near_duplicates(documents)
+    selected = (
+        select_diverse_documents(query, unique, embeddings, max_documents)
+        if embeddings is not None
+        else unique[:max_documents]
+    )
+    merged = merge_overlapping_documents(selected)
+    packed = pack_documents(merged, max_tokens, model)
+    logger.debug(
+        "context_packing.pack",
+        retrieved=len(documents),
+        unique=len(unique),
+        selected=len(selected),
+        merged=len(merged),
+        packed=len(packed),
+    )
+    return packed
@@ -0,0 +1,275 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Coroutine, Optional, TypeVar
+
+import aiohttp
+from langchain.schema.embeddings import Embeddings
+
+from app.core.config import settings
+from app.core.log import logger
+from app.core.tokens import count_tokens
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+T = TypeVar("T")
+
+event_loop: Optional[asyncio.AbstractEventLoop] = None
+event_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Gets the event loop embedding requests run on, started on a background thread
+    the first time it is needed and kept for the life of the process, so HTTP
+    connections are reused across calls.
+
+    Returns:
+        asyncio.AbstractEventLoop: The event loop.
+    """  # noqa
+    global event_loop
+    with event_loop_lock:
+        if event_loop is None:
+            event_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=event_loop.run_forever,
+                name="embedding-scheduler",
+                daemon=True,
+            ).start()
+        return event_loop
+
+
+class EmbeddingRequestError(Exception):
+    """Raised when an embedding request fails and can no longer be retried."""
+
+
+def pack_batches(
+    texts: list[str], model: str, max_tokens: int, max_texts: int
+) -> list[list[int]]:
+    """
+    Packs texts into batches that stay within a token budget.
+
+    Texts are kept in order. A text that is larger than the budget on its own gets
+    a batch of its own.
+
+    Args:
+        texts (list[str]): The texts to pack.
+        model (str): The embedding model, used to count tokens.
+        max_tokens (int): The maximum number of tokens per batch.
+        max_texts (int): The maximum number of texts per batch.
+
+    Returns:
+        list[list[int]]: The indexes of the texts in each batch.
+    """  # noqa
+    batches: list[list[int]] = []
+    batch: list[int] = []
+    batch_tokens = 0
+    for index, text in enumerate(texts):
+        tokens = count_tokens(text, model)
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_texts):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(index)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    OpenAI embeddings that pack texts into token-bounded batches and send several
+    batches concurrently.
+
+    Rate-limited (429) and transient server errors, connection errors and timeouts
+    are retried with exponential backoff, honouring `Retry-After`. A rate limit
+    pauses every in-flight worker, not just the one that hit it, so the scheduler
+    backs off as a whole.
+
+    Requests run on a shared background event loop, through one HTTP session per
+    instance, so connections are kept alive between calls and the synchronous
+    methods can be called from any thread, with or without a running event loop.
+
+    Args:
+        api_key (str): The OpenAI API key.
+        model (str, optional): The embedding model.
+        base_url (str, optional): The base URL of the OpenAI compatible API.
+        max_batch_tokens (int, optional): The maximum number of tokens per request.
+        max_batch_texts (int, optional): The maximum number of texts per request.
+        max_concurrency (int, optional): The maximum number of requests in flight.
+        max_retries (int, optional): The number of retries per request.
+        backoff_seconds (float, optional): The initial backoff, doubled on every retry.
+        timeout_seconds (float, optional): The timeout of each request.
+    """  # noqa
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str = settings.EMBEDDING_MODEL,
+        base_url: str = settings.EMBEDDING_API_BASE,
+        max_batch_tokens: int = settings.EMBEDDING_BATCH_MAX_TOKENS,
+        max_batch_texts: int = settings.EMBEDDING_BATCH_MAX_TEXTS,
+        max_concurrency: int = settings.EMBEDDING_MAX_CONCURRENCY,
+        max_retries: int = settings.EMBEDDING_MAX_RETRIES,
+        backoff_seconds: float = settings.EMBEDDING_BACKOFF_SECONDS,
+        timeout_seconds: float = settings.EMBEDDING_REQUEST_TIMEOUT,
+    ):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_texts = max_batch_texts
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout_seconds = timeout_seconds
+        self._resume_at = 0.0
+        # Created on the event loop, which they are bound to
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _run(self, coroutine: Coroutine[Any, Any, T]) -> "asyncio.Future[T]":
+        return asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(coroutine, get_event_loop())
+        )
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout_seconds)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def _close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def close(self) -> None:
+        """
+        Closes the HTTP session; a new one is opened if the embeddings are used again.
+        """  # noqa
+        asyncio.run_coroutine_threadsafe(self._close(), get_event_loop()).result()
+
+    async def _wait_for_rate_limit(self) -> None:
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _get_backoff(self, attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        backoff = self.backoff_seconds * (2**attempt)
+        return backoff + random.uniform(0, backoff / 2)
+
+    async def _post_batch(
+        self, session: aiohttp.ClientSession, texts: list[str], attempt: int
+    ) -> Optional[list[list[float]]]:
+        # Returns None when the request should be retried
+        async with session.post(
+            f"{self.base_url}/embeddings",
+            json={"model": self.model, "input": texts},
+            headers={"Authorization": f"Bearer {self.api_key}"},
+        ) as response:
+            if response.status == 200:
+                body = await response.json()
+                data = sorted(body["data"], key=lambda item: item["index"])
+                return [item["embedding"] for item in data]
+
+            if response.status not in RETRYABLE_STATUSES or attempt == self.max_retries:
+                raise EmbeddingRequestError(
+                    f"Embedding request failed with status {response.status}: "
+                    f"{await response.text()}"
+                )
+
+            backoff = self._get_backoff(attempt, response.headers.get("Retry-After"))
+            if response.status == 429:
+                # Hold back every worker, not just this one
+                self._resume_at = max(self._resume_at, time.monotonic() + backoff)
+            logger.warning(
+                "embeddings.scheduler.retry",
+                status=response.status,
+                attempt=attempt + 1,
+                backoff=backoff,
+            )
+        await asyncio.sleep(backoff)
+        return None
+
+    async def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        session = self._get_session()
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self._wait_for_rate_limit()
+                try:
+                    vectors = await self._post_batch(session, texts, attempt)
+                except RETRYABLE_ERRORS as e:
+                    if attempt == self.max_retries:
+                        raise EmbeddingRequestError(
+                            f"Embedding request failed: {type(e).__name__} {e}"
+                        ) from e
+                    backoff = self._get_backoff(attempt, None)
+                    logger.warning(
+                        "embeddings.scheduler.retry",
+                        exception=type(e).__name__,
+                        attempt=attempt + 1,
+                        backoff=backoff,
+                    )
+                    await asyncio.sleep(backoff)
+                    continue
+                if vectors is not None:
+                    return vectors
+        raise EmbeddingRequestError("Embedding request failed")
+
+    async def _aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        batches = pack_batches(
+            texts, self.model, self.max_batch_tokens, self.max_batch_texts
+        )
+        started_at = time.perf_counter()
+        results = await asyncio.gather(
+            *[self._embed_batch([texts[i] for i in batch]) for batch in batches]
+        )
+
+        embeddings: list[list[float]] = [[] for _ in texts]
+        for batch, vectors in zip(batches, results):
+            for index, vector in zip(batch, vectors):
+                embeddings[index] = vector
+        logger.debug(
+            "embeddings.scheduler.embed_documents",
+            texts=len(texts),
+            batches=len(batches),
+            duration=time.perf_counter() - started_at,
+        )
+        return embeddings
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embeds texts with concurrent, token-bounded batch requests.
+
+        Args:
+            texts (list[str]): The texts to embed.
+
+        Returns:
+            list[list[float]]: The embeddings, in the same order as the texts.
+        """
+        if not texts:
+            return []
+        return await self._run(self._aembed_documents(texts))
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        return asyncio.run_coroutine_threadsafe(
+            self._aembed_documents(texts), get_event_loop()
+        ).result()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
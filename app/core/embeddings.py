@@ -0,0 +1,222 @@
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain.schema.embeddings import Embeddings
+
+from app.core.config import settings
+from app.core.hashing import hash_text
+from app.core.log import logger, timed
+from app.core.providers import create_provider_embeddings, get_embeddings_cache_model
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes text before it is hashed for the embedding cache, so chunks that
+    only differ in whitespace share an embedding.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The normalized text.
+    """  # noqa
+    return " ".join(text.split())
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an `Embeddings` implementation with a persistent SQLite cache.
+
+    Embeddings are keyed on the embedding model and the hash of the normalized
+    text, and the least recently used entries are evicted once the cache holds
+    more than `max_entries` embeddings.
+
+    Args:
+        embeddings (Embeddings): The embeddings to compute cache misses with.
+        model (str): The name of the embedding model, used as part of the cache key.
+        cache_filepath (str): The path of the SQLite cache file.
+        max_entries (int): The maximum number of embeddings to keep.
+
+    Attributes:
+        hits (int): The number of texts served from the cache.
+        misses (int): The number of texts that had to be embedded.
+    """  # noqa
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model: str,
+        cache_filepath: str = settings.EMBEDDING_CACHE_FILEPATH,
+        max_entries: int = settings.EMBEDDING_CACHE_MAX_ENTRIES,
+    ):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache_filepath = cache_filepath
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(cache_filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(cache_filepath, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access "
+            "ON embeddings (last_access)"
+        )
+        self._connection.commit()
+
+    def _get(self, text_hashes: list[str]) -> dict[str, list[float]]:
+        vectors: dict[str, list[float]] = {}
+        unique_hashes = list(dict.fromkeys(text_hashes))
+        # Stay well below SQLite's limit on the number of bound parameters
+        for start in range(0, len(unique_hashes), 500):
+            end = start + 500
+            batch = unique_hashes[start:end]
+            placeholders = ", ".join("?" * len(batch))
+            rows = self._connection.execute(
+                f"SELECT text_hash, vector FROM embeddings "
+                f"WHERE model = ? AND text_hash IN ({placeholders})",
+                [self.model, *batch],
+            ).fetchall()
+            for text_hash, vector in rows:
+                vectors[text_hash] = array("f", vector).tolist()
+        if vectors:
+            self._connection.executemany(
+                "UPDATE embeddings SET last_access = ? "
+                "WHERE model = ? AND text_hash = ?",
+                [(time.time(), self.model, text_hash) for text_hash in vectors],
+            )
+        return vectors
+
+    def _put(self, vectors: dict[str, list[float]]) -> None:
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_access) "
+            "VALUES (?, ?, ?, ?)",
+            [
+                (self.model, text_hash, array("f", vector).tobytes(), time.time())
+                for text_hash, vector in vectors.items()
+            ],
+        )
+        self._evict()
+
+    def _evict(self) -> None:
+        (count,) = self._connection.execute(
+            "SELECT COUNT(*) FROM embeddings"
+        ).fetchone()
+        if count > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM embeddings WHERE rowid IN ("
+                "SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            logger.debug(
+                "embeddings.cache.evict",
+                model=self.model,
+                evicted=count - self.max_entries,
+            )
+
+    @timed("embeddings.embed_documents")
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embeds a list of texts, only computing embeddings for cache misses.
+
+        Args:
+            texts (list[str]): The texts to embed.
+
+        Returns:
+            list[list[float]]: The embeddings, in the same order as the texts.
+        """
+        text_hashes = [hash_text(normalize_text(text)) for text in texts]
+        with self._lock:
+            cached = self._get(text_hashes)
+            self._connection.commit()
+
+        missing: dict[str, str] = {}
+        for text, text_hash in zip(texts, text_hashes):
+            if text_hash not in cached and text_hash not in missing:
+                missing[text_hash] = text
+
+        computed: list[list[float]] = []
+        if missing:
+            computed = self.embeddings.embed_documents(list(missing.values()))
+            cached.update(zip(missing.keys(), computed))
+
+        with self._lock:
+            if missing:
+                self._put(dict(zip(missing.keys(), computed)))
+                self._connection.commit()
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+            total_hits, total_misses = self.hits, self.misses
+        logger.debug(
+            "embeddings.cache.embed_documents",
+            model=self.model,
+            texts=len(texts),
+            misses=len(missing),
+            total_hits=total_hits,
+            total_misses=total_misses,
+        )
+        return [cached[text_hash] for text_hash in text_hashes]
+
+    @timed("embeddings.embed_query")
+    def embed_query(self, text: str) -> list[float]:
+        """
+        Embeds a query, using the cache when the same text was embedded before.
+
+        Args:
+            text (str): The query to embed.
+
+        Returns:
+            list[float]: The embedding.
+        """
+        text_hash = hash_text(normalize_text(text))
+        with self._lock:
+            cached = self._get([text_hash])
+            self._connection.commit()
+            if text_hash in cached:
+                self.hits += 1
+                return cached[text_hash]
+
+        vector = self.embeddings.embed_query(text)
+        with self._lock:
+            self._put({text_hash: vector})
+            self._connection.commit()
+            self.misses += 1
+        return vector
+
+
+cached_embeddings: dict[str, CachedEmbeddings] = {}
+
+
+def create_embeddings() -> Embeddings:
+    """
+    Creates the embeddings used across the app, from the configured provider and
+    wrapped with the shared embedding cache unless it is disabled in the settings.
+
+    Returns:
+        Embeddings: The embeddings.
+    """  # noqa
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return create_provider_embeddings()
+    model = get_embeddings_cache_model()
+    if model not in cached_embeddings:
+        cached_embeddings[model] = CachedEmbeddings(
+            embeddings=create_provider_embeddings(),
+            model=model,
+        )
+    return cached_embeddings[model]
@@ -0,0 +1,77 @@
+import hashlib
+from typing import Tuple
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_bytes(data: bytes) -> str:
+    """
+    Computes the SHA-256 hex digest of the given bytes.
+
+    Args:
+        data (bytes): The bytes to hash.
+
+    Returns:
+        str: The hex digest.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_text(text: str) -> str:
+    """
+    Computes the SHA-256 hex digest of the given text.
+
+    Args:
+        text (str): The text to hash.
+
+    Returns:
+        str: The hex digest.
+    """
+    return hash_bytes(text.encode("utf-8"))
+
+
+def hash_file(filepath: str, block_size: int = HASH_BLOCK_SIZE) -> str:
+    """
+    Computes the SHA-256 hex digest of a file, reading it in blocks so the whole
+    file never has to be held in memory.
+
+    Args:
+        filepath (str): The path to the file.
+        block_size (int, optional): The number of bytes to read at a time.
+
+    Returns:
+        str: The hex digest.
+    """  # noqa
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def copy_file(
+    source: str, destination: str, block_size: int = HASH_BLOCK_SIZE
+) -> Tuple[int, str]:
+    """
+    Copies a file in blocks, computing its size and SHA-256 hex digest in the same
+    pass so the file is only read once and never held in memory.
+
+    Args:
+        source (str): The path to the file to copy.
+        destination (str): The path to copy the file to.
+        block_size (int, optional): The number of bytes to read at a time.
+
+    Returns:
+        Tuple[int, str]: The size in bytes and the hex digest of the file.
+    """  # noqa
+    digest = hashlib.sha256()
+    size = 0
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        while read := source_file.readinto(buffer):
+            block = view[:read]
+            digest.update(block)
+            destination_file.write(block)
+            size += read
+    return size, digest.hexdigest()
@@ -0,0 +1,298 @@
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional, Tuple
+
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+from langchain.vectorstores.base import VectorStore
+
+from app.core.bm25 import BM25Index, get_bm25_index
+from app.core.config import settings
+from app.core.hashing import hash_file, hash_text
+from app.core.loader import iter_documents
+from app.core.log import logger
+from app.core.splitter import iter_document_chunks
+from app.core.vectorstore import (
+    format_knowledge_base_name,
+    get_persist_directory,
+    get_vectorstore,
+    upsert_documents,
+    vectorstore_registry,
+)
+from app.models import KnowledgeBaseDocument
+
+DOCUMENT_NAME_KEY = "document_name"
+CHUNK_ID_KEY = "chunk_id"
+
+ProgressCallback = Callable[[int, int], None]
+
+
+@dataclass
+class IndexStats:
+    """
+    Counts of the chunks touched by an incremental index run.
+
+    Attributes:
+        skipped (int): Chunks that were already indexed and left untouched.
+        added (int): Chunks that were embedded and added to the vector store.
+        removed (int): Chunks that were deleted from the vector store.
+    """
+
+    skipped: int = 0
+    added: int = 0
+    removed: int = 0
+
+
+def get_chunk_id(document_name: str, chunk: Document) -> str:
+    """
+    Builds a stable ID for a chunk from its document name and content.
+
+    Args:
+        document_name (str): The name of the document the chunk belongs to.
+        chunk (Document): The chunk.
+
+    Returns:
+        str: The chunk ID.
+    """
+    return hash_text(f"{document_name}\x00{chunk.page_content}")
+
+
+def get_indexed_chunk_ids(vectorstore: VectorStore) -> dict[Optional[str], set[str]]:
+    """
+    Groups the IDs of every chunk in the vector store by the document they belong to.
+
+    Chunks that were indexed without a document name are grouped under `None`.
+
+    Args:
+        vectorstore (VectorStore): The vector store to inspect.
+
+    Returns:
+        dict[Optional[str], set[str]]: The chunk IDs keyed by document name.
+    """  # noqa
+    indexed = vectorstore.get(include=["metadatas"])
+    chunk_ids: dict[Optional[str], set[str]] = {}
+    for chunk_id, metadata in zip(indexed["ids"], indexed["metadatas"]):
+        document_name = (metadata or {}).get(DOCUMENT_NAME_KEY)
+        chunk_ids.setdefault(document_name, set()).add(chunk_id)
+    return chunk_ids
+
+
+def chunk_document(
+    document_name: str, documents: list[Document]
+) -> dict[str, Document]:
+    """
+    Splits the loaded documents of a single knowledge base document, tagging each
+    chunk with its ID.
+
+    Args:
+        document_name (str): The name of the knowledge base document.
+        documents (list[Document]): The loaded documents.
+
+    Returns:
+        dict[str, Document]: The chunks keyed by chunk ID, in document order.
+    """  # noqa
+    chunks: dict[str, Document] = {}
+    for chunk in iter_document_chunks(documents):
+        chunk_id = get_chunk_id(document_name, chunk)
+        chunk.metadata[DOCUMENT_NAME_KEY] = document_name
+        chunk.metadata[CHUNK_ID_KEY] = chunk_id
+        chunks.setdefault(chunk_id, chunk)
+    return chunks
+
+
+def backfill_bm25_index(vectorstore: VectorStore, bm25_index: BM25Index) -> None:
+    """
+    Adds every chunk of a vector store to a BM25 index and persists it.
+
+    Args:
+        vectorstore (VectorStore): The vector store to read the chunks from.
+        bm25_index (BM25Index): The index to add the chunks to.
+    """
+    indexed = vectorstore.get(include=["documents", "metadatas"])
+    bm25_index.add_documents(
+        (chunk_id, Document(page_content=page_content, metadata=metadata or {}))
+        for chunk_id, page_content, metadata in zip(
+            indexed["ids"], indexed["documents"], indexed["metadatas"]
+        )
+    )
+    bm25_index.save()
+    logger.debug("indexer.bm25.backfill", documents=len(bm25_index))
+
+
+def get_document_hash(knowledge_base_document: KnowledgeBaseDocument) -> str:
+    """
+    Gets the hash of a document's file. The hash computed on import is reused as
+    long as the file's size and modification time are unchanged, otherwise the file
+    is hashed again.
+
+    Args:
+        knowledge_base_document (KnowledgeBaseDocument): The document.
+
+    Raises:
+        OSError: If the file cannot be read.
+
+    Returns:
+        str: The hex digest of the file.
+    """  # noqa
+    stat = os.stat(knowledge_base_document.Filepath)
+    if (
+        knowledge_base_document.ContentHash
+        and stat.st_size == knowledge_base_document.Size
+        and stat.st_mtime == knowledge_base_document.Modified
+    ):
+        return knowledge_base_document.ContentHash
+    return hash_file(knowledge_base_document.Filepath)
+
+
+def index_knowledge_base(
+    knowledge_base_name: str,
+    knowledge_base_documents: dict[str, KnowledgeBaseDocument],
+    embeddings: Embeddings,
+    persist_directory_root: str = settings.VECTORSTORE_CHROMADB_DIR,
+    batch_size: int = settings.VECTORSTORE_UPSERT_BATCH_SIZE,
+    progress_callback: Optional[ProgressCallback] = None,
+    backend: str = settings.VECTORSTORE_BACKEND,
+) -> IndexStats:
+    """
+    Incrementally syncs the vector store of a knowledge base with its documents.
+
+    Documents whose content hash matches the one recorded on the
+    `KnowledgeBaseDocument` are skipped entirely. Changed documents are streamed
+    through loading and chunking one at a time, and only chunks that are not
+    already in the vector store are embedded, in batches of `batch_size`. Chunks
+    that belong to removed documents, or that no longer exist in a changed
+    document, are deleted. The BM25 keyword index kept alongside the vector store is
+    updated with the same chunks. The `Hash`, `Chunks` and `Indexed` time of every
+    indexed document are updated in place once all of its chunks are stored, so a
+    run that fails part way leaves them as they were; callers are responsible for
+    persisting the knowledge base afterwards.
+
+    Args:
+        knowledge_base_name (str): The name of the knowledge base.
+        knowledge_base_documents (dict[str, KnowledgeBaseDocument]): The documents of the knowledge base.
+        embeddings (Embeddings): The embeddings used for new chunks.
+        persist_directory_root (str, optional): The root directory of the vector stores. Defaults to settings.VECTORSTORE_CHROMADB_DIR.
+        batch_size (int, optional): The number of chunks embedded and added at a time. Defaults to settings.VECTORSTORE_UPSERT_BATCH_SIZE.
+        progress_callback (Optional[ProgressCallback], optional): Called with the number of processed and total documents after each document.
+        backend (str, optional): The vector store backend, "chroma" or "numpy". Defaults to settings.VECTORSTORE_BACKEND.
+
+    Returns:
+        IndexStats: How many chunks were skipped, added and removed.
+    """  # noqa
+    formatted_kb_name = format_knowledge_base_name(knowledge_base_name)
+    persist_directory = get_persist_directory(
+        knowledge_base_name, persist_directory_root, backend
+    )
+    vectorstore = get_vectorstore(
+        knowledge_base_name=formatted_kb_name,
+        embeddings=embeddings,
+        persist_directory=persist_directory,
+        backend=backend,
+    )
+    indexed_chunk_ids = get_indexed_chunk_ids(vectorstore)
+    indexed_count = sum(len(chunk_ids) for chunk_ids in indexed_chunk_ids.values())
+
+    bm25_index = get_bm25_index(persist_directory)
+    if indexed_count and not len(bm25_index):
+        # Vector stores indexed before keyword search existed
+        backfill_bm25_index(vectorstore, bm25_index)
+
+    stats = IndexStats()
+    chunk_ids_to_remove: set[str] = set()
+    total_documents = len(knowledge_base_documents)
+    processed_documents = 0
+
+    def report_progress() -> None:
+        nonlocal processed_documents
+        processed_documents += 1
+        if progress_callback:
+            progress_callback(processed_documents, total_documents)
+
+    stale_documents: dict[str, KnowledgeBaseDocument] = {}
+    stale_hashes: dict[str, str] = {}
+    stale_chunk_ids: dict[str, set[str]] = {}
+    indexed_documents: dict[str, int] = {}
+    for document_name, knowledge_base_document in knowledge_base_documents.items():
+        present_chunk_ids = indexed_chunk_ids.pop(document_name, set())
+        try:
+            document_hash = get_document_hash(knowledge_base_document)
+        except OSError as e:
+            logger.error(
+                "indexer.hash.failure",
+                document_name=document_name,
+                file_path=knowledge_base_document.Filepath,
+                exception=str(e),
+            )
+            chunk_ids_to_remove |= present_chunk_ids
+            report_progress()
+            continue
+
+        if present_chunk_ids and knowledge_base_document.Hash == document_hash:
+            stats.skipped += len(present_chunk_ids)
+            knowledge_base_document.Chunks = len(present_chunk_ids)
+            report_progress()
+            continue
+
+        stale_documents[document_name] = knowledge_base_document
+        stale_hashes[document_name] = document_hash
+        stale_chunk_ids[document_name] = present_chunk_ids
+
+    def iter_chunks_to_add() -> Iterator[Tuple[str, Document]]:
+        nonlocal chunk_ids_to_remove
+        for document_name, documents in iter_documents(stale_documents):
+            present_chunk_ids = stale_chunk_ids.pop(document_name)
+            if documents is None:
+                # Keep what was indexed before, so a failed load is retried next time
+                stats.skipped += len(present_chunk_ids)
+                report_progress()
+                continue
+            chunks = chunk_document(document_name, documents)
+            stats.skipped += len(present_chunk_ids & chunks.keys())
+            chunk_ids_to_remove |= present_chunk_ids - chunks.keys()
+            new_chunks = [
+                (chunk_id, chunk)
+                for chunk_id, chunk in chunks.items()
+                if chunk_id not in present_chunk_ids
+            ]
+            bm25_index.add_documents(new_chunks)
+            yield from new_chunks
+            indexed_documents[document_name] = len(chunks)
+            report_progress()
+
+    stats.added = upsert_documents(vectorstore, iter_chunks_to_add(), batch_size)
+
+    # Whatever is left belongs to documents that are no longer in the knowledge base
+    for chunk_ids in indexed_chunk_ids.values():
+        chunk_ids_to_remove |= chunk_ids
+
+    if chunk_ids_to_remove:
+        vectorstore.delete(ids=list(chunk_ids_to_remove))
+        bm25_index.delete(chunk_ids_to_remove)
+        stats.removed = len(chunk_ids_to_remove)
+
+    # Chunks are only buffered when they are yielded, so documents are marked as
+    # indexed once every batch is in the vector store; a failed run retries them
+    indexed_at = time.time()
+    for document_name, chunk_count in indexed_documents.items():
+        stale_documents[document_name].Hash = stale_hashes[document_name]
+        stale_documents[document_name].Chunks = chunk_count
+        stale_documents[document_name].Indexed = indexed_at
+
+    if stats.added or stats.removed:
+        bm25_index.save()
+
+    vectorstore_registry.set_count(
+        persist_directory,
+        formatted_kb_name,
+        indexed_count - stats.removed + stats.added,
+    )
+    vectorstore_registry.mark_indexed(persist_directory, formatted_kb_name)
+    logger.debug(
+        "indexer.index.success",
+        knowledge_base_name=knowledge_base_name,
+        skipped=stats.skipped,
+        added=stats.added,
+        removed=stats.removed,
+    )
+    return stats
@@ -1,4 +1,10 @@
+import multiprocessing
 import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from multiprocessing.pool import AsyncResult, Pool
+from typing import Iterator, Optional, Tuple
 
 from langchain.document_loaders import (
     PDFPlumberLoader,
@@ -11,7 +17,8 @@ from langchain.document_loaders import (
 from langchain.document_loaders.base import BaseLoader
 from langchain.schema import Document
 
-from app.core.log import logger
+from app.core.config import settings
+from app.core.log import logger, timed
 from app.models import KnowledgeBaseDocument
 
 
@@ -68,19 +75,168 @@ def determine_loader_and_load(
         return []
 
 
+def _get_load_kwargs(knowledge_base_document: KnowledgeBaseDocument) -> dict:
+    return dict(
+        file_name=os.path.basename(knowledge_base_document.Filepath),
+        file_path=knowledge_base_document.Filepath,
+        file_size=knowledge_base_document.Size,
+        file_uri=knowledge_base_document.Uri,
+    )
+
+
+# The app is heavily threaded by the time documents are loaded, and a forked worker
+# could inherit a lock another thread held, so workers are spawned instead
+_context = multiprocessing.get_context("spawn")
+
+
+def _notify_started(started) -> None:
+    started.release()
+
+
+def _create_pool(processes: int) -> Pool:
+    # Spawned workers take a while to import the loaders; wait for them so that
+    # time doesn't count against the deadline of the first documents
+    started = _context.Semaphore(0)
+    pool = _context.Pool(
+        processes=processes, initializer=_notify_started, initargs=(started,)
+    )
+    for _ in range(processes):
+        started.acquire()
+    return pool
+
+
+@dataclass
+class _PendingLoad:
+    document_name: str
+    load_kwargs: dict
+    result: AsyncResult
+    deadline: float
+
+
+def iter_documents(
+    knowledge_base_documents: dict[str, KnowledgeBaseDocument],
+    max_workers: int = settings.LOADER_MAX_WORKERS,
+    timeout: float = settings.LOADER_TIMEOUT,
+) -> Iterator[Tuple[str, Optional[list[Document]]]]:
+    """
+    Lazily loads the documents of a knowledge base, one knowledge base document at
+    a time.
+
+    Parsing is CPU bound, so several documents are loaded in parallel in a process
+    pool. Only a bounded number of documents are parsed ahead of the consumer, so a
+    slow consumer holds back loading instead of letting parsed documents pile up in
+    memory. Documents are yielded in the order of `knowledge_base_documents`
+    regardless of which one finishes first. A document that fails to load, or takes
+    longer than `timeout` seconds from its submission, is logged and yielded as
+    None, so callers can tell it apart from a document without content. A parser
+    can't be interrupted, so on a timeout the worker processes are killed and the
+    documents they were still loading are submitted again. Without a timeout,
+    documents are loaded serially in this process instead.
+
+    Args:
+        knowledge_base_documents (dict[str, KnowledgeBaseDocument]): The documents to load.
+        max_workers (int, optional): The number of worker processes. Defaults to settings.LOADER_MAX_WORKERS.
+        timeout (float, optional): The number of seconds to wait for each document, or 0 for no timeout. Defaults to settings.LOADER_TIMEOUT.
+
+    Yields:
+        Tuple[str, Optional[list[Document]]]: The document name and its loaded documents, or None if it failed to load.
+    """  # noqa
+    items = list(knowledge_base_documents.items())
+    if timeout <= 0:
+        for document_name, knowledge_base_document in items:
+            load_kwargs = _get_load_kwargs(knowledge_base_document)
+            logger.debug("loader.load_documents", file_name=load_kwargs["file_name"])
+            try:
+                yield document_name, determine_loader_and_load(**load_kwargs)
+            except Exception as e:
+                logger.error(
+                    "loader.load_documents.failure",
+                    file_name=load_kwargs["file_name"],
+                    exception=str(e),
+                )
+                yield document_name, None
+        return
+
+    if not items:
+        return
+
+    max_workers = max(min(max_workers, len(items)), 1)
+    pool = _create_pool(max_workers)
+    # No more loads are in flight than there are workers, so each one starts when it
+    # is submitted and its deadline counts from then
+    pending: deque[_PendingLoad] = deque()
+    remaining = iter(items)
+
+    def submit(load_kwargs: dict) -> Tuple[AsyncResult, float]:
+        result = pool.apply_async(determine_loader_and_load, kwds=load_kwargs)
+        return result, time.monotonic() + timeout
+
+    def submit_next() -> None:
+        item = next(remaining, None)
+        if item is None:
+            return
+        document_name, knowledge_base_document = item
+        load_kwargs = _get_load_kwargs(knowledge_base_document)
+        logger.debug("loader.load_documents", file_name=load_kwargs["file_name"])
+        pending.append(_PendingLoad(document_name, load_kwargs, *submit(load_kwargs)))
+
+    try:
+        for _ in range(max_workers):
+            submit_next()
+        while pending:
+            load = pending.popleft()
+            documents: Optional[list[Document]] = None
+            try:
+                documents = load.result.get(
+                    timeout=max(load.deadline - time.monotonic(), 0)
+                )
+            except multiprocessing.TimeoutError:
+                logger.error(
+                    "loader.load_documents.timeout",
+                    file_name=load.load_kwargs["file_name"],
+                    timeout=timeout,
+                )
+                pool.terminate()
+                pool.join()
+                pool = _create_pool(max_workers)
+                for other in pending:
+                    if not other.result.ready():
+                        other.result, other.deadline = submit(other.load_kwargs)
+            except Exception as e:
+                logger.error(
+                    "loader.load_documents.failure",
+                    file_name=load.load_kwargs["file_name"],
+                    exception=str(e),
+                )
+            submit_next()
+            yield load.document_name, documents
+    finally:
+        # Every result was consumed, or the consumer stopped early
+        pool.terminate()
+        pool.join()
+
+
+@timed("loader.load_documents")
 def load_documents(
-    knowledge_base_documents: dict[str, KnowledgeBaseDocument]
+    knowledge_base_documents: dict[str, KnowledgeBaseDocument],
+    max_workers: int = settings.LOADER_MAX_WORKERS,
+    timeout: float = settings.LOADER_TIMEOUT,
 ) -> list[Document]:
-    documents: list[Document] = []
-    for knowledge_base_document in knowledge_base_documents.values():
-        file_name: str = os.path.basename(knowledge_base_document.Filepath)
-        logger.debug("loader.load_documents", file_name=file_name)
-        documents.extend(
-            determine_loader_and_load(
-                file_name=file_name,
-                file_path=knowledge_base_document.Filepath,
-                file_size=knowledge_base_document.Size,
-                file_uri=knowledge_base_document.Uri,
-            )
+    """
+    Loads the documents of a knowledge base, see `iter_documents`.
+
+    Args:
+        knowledge_base_documents (dict[str, KnowledgeBaseDocument]): The documents to load.
+        max_workers (int, optional): The number of worker processes. Defaults to settings.LOADER_MAX_WORKERS.
+        timeout (float, optional): The number of seconds to wait for each document, or 0 for no timeout. Defaults to settings.LOADER_TIMEOUT.
+
+    Returns:
+        list[Document]: The loaded documents.
+    """  # noqa
+    return [
+        document
+        for _, documents in iter_documents(
+            knowledge_base_documents, max_workers=max_workers, timeout=timeout
         )
-    return documents
+        for document in documents or []
+    ]
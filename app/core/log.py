@@ -1,4 +1,10 @@
+import functools
 import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, Optional, TypeVar
 
 import structlog
 from icecream import ic
@@ -42,6 +48,8 @@ DEV_FORMATTER = structlog.stdlib.ProcessorFormatter(
 
 logger: structlog.stdlib.BoundLogger = structlog.get_logger()
 
+F = TypeVar("F", bound=Callable[..., Any])
+
 # Install icecream globally so you don't have to import it everywhere
 ic.configureOutput(includeContext=True)
 install_ic()
@@ -72,3 +80,111 @@ def setup_logging() -> None:
     root_logger = logging.getLogger()
     root_logger.addHandler(handler)
     root_logger.setLevel(getattr(logging, settings.LOG_LEVEL.upper()))
+
+
+@dataclass
+class LatencyStats:
+    """
+    Running latency statistics of a span.
+
+    Attributes:
+        count (int): The number of times the span was recorded.
+        total (float): The total duration, in seconds.
+        last (float): The latest duration, in seconds.
+        max (float): The longest duration, in seconds.
+    """
+
+    count: int = 0
+    total: float = 0.0
+    last: float = 0.0
+    max: float = 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+latency_stats: dict[str, LatencyStats] = {}
+latency_stats_lock = threading.Lock()
+
+
+def record_latency(name: str, duration: float) -> None:
+    """
+    Adds a duration to the latency statistics of a span.
+
+    Args:
+        name (str): The name of the span.
+        duration (float): The duration, in seconds.
+    """
+    with latency_stats_lock:
+        stats = latency_stats.setdefault(name, LatencyStats())
+        stats.count += 1
+        stats.total += duration
+        stats.last = duration
+        stats.max = max(stats.max, duration)
+
+
+def get_latency_stats() -> dict[str, LatencyStats]:
+    """
+    Gets a snapshot of the latency statistics of every span recorded so far.
+
+    Returns:
+        dict[str, LatencyStats]: The statistics, by span name.
+    """
+    with latency_stats_lock:
+        return {
+            name: LatencyStats(stats.count, stats.total, stats.last, stats.max)
+            for name, stats in latency_stats.items()
+        }
+
+
+@contextmanager
+def span(name: str, **fields: Any) -> Iterator[dict[str, Any]]:
+    """
+    Times a block of code, logging `name` at debug level with its duration and
+    recording it in the latency statistics.
+
+    The yielded dict holds the fields of the event, so the block can add to them,
+    e.g. `with span("ai.llm", model=model) as fields: fields["tokens"] = 10`.
+
+    Args:
+        name (str): The name of the span, also the event name.
+        **fields: Extra fields of the event.
+
+    Yields:
+        dict[str, Any]: The fields of the event.
+    """  # noqa
+    started_at = time.perf_counter()
+    try:
+        yield fields
+    except BaseException as e:
+        fields["error"] = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - started_at
+        record_latency(name, duration)
+        logger.debug(name, duration=round(duration, 6), **fields)
+
+
+def timed(name: Optional[str] = None) -> Callable[[F], F]:
+    """
+    Decorates a function to run it in a `span`.
+
+    Args:
+        name (Optional[str], optional): The name of the span. Defaults to the module and name of the function.
+
+    Returns:
+        Callable[[F], F]: The decorator.
+    """  # noqa
+
+    def decorator(func: F) -> F:
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
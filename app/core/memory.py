@@ -0,0 +1,84 @@
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain.schema.messages import BaseMessage
+
+from app.core.config import settings
+from app.core.log import logger
+from app.core.tokens import count_tokens
+
+# Tokens a chat message costs on top of its content, for its role and framing
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def get_memory_token_budget(model: str) -> int:
+    """
+    Gets the number of tokens of conversation history that may be sent to a model.
+
+    Args:
+        model (str): The name of the model.
+
+    Returns:
+        int: The token budget, a share of the model's context window.
+    """  # noqa
+    context_window = settings.LLMS.get(model, {}).get("content_window", 16385)
+    return int(context_window * settings.CHAT_MEMORY_CONTEXT_RATIO)
+
+
+class TokenBudgetMemory(ConversationSummaryBufferMemory):
+    """
+    Conversation memory that keeps the most recent turns within a token budget and
+    folds older turns into a rolling summary.
+
+    Turns are dropped oldest first, a question and its answer at a time, once the
+    history, including its summary, exceeds `max_token_limit` tokens of `model`
+    or holds more than `max_turns` turns. The dropped turns are summarized with
+    `llm`; if that fails they are dropped without a summary rather than failing
+    the request.
+
+    Attributes:
+        model (str): The model whose tokenizer measures the history.
+        max_turns (int): The maximum number of turns kept verbatim.
+    """  # noqa
+
+    model: str = "gpt-3.5-turbo-1106"
+    max_turns: int = settings.CHAT_MEMORY_MAX_TURNS
+
+    def count_tokens(self, messages: list[BaseMessage]) -> int:
+        return sum(
+            count_tokens(message.content, self.model) + MESSAGE_OVERHEAD_TOKENS
+            for message in messages
+        )
+
+    def _is_over_budget(self, buffer: list[BaseMessage]) -> bool:
+        summary_tokens = (
+            count_tokens(self.moving_summary_buffer, self.model)
+            if self.moving_summary_buffer
+            else 0
+        )
+        return (
+            len(buffer) > self.max_turns * 2
+            or self.count_tokens(buffer) + summary_tokens > self.max_token_limit
+        )
+
+    def prune(self) -> None:
+        buffer = self.chat_memory.messages
+        pruned_messages: list[BaseMessage] = []
+        # Always keep the latest turn verbatim
+        while len(buffer) > 2 and self._is_over_budget(buffer):
+            pruned_messages.extend(buffer[:2])
+            del buffer[:2]
+        if not pruned_messages:
+            return
+
+        try:
+            self.moving_summary_buffer = self.predict_new_summary(
+                pruned_messages, self.moving_summary_buffer
+            )
+        except Exception as e:
+            logger.warning("memory.summarize.error", exception=str(e))
+        logger.debug(
+            "memory.prune",
+            pruned=len(pruned_messages),
+            kept=len(buffer),
+            tokens=self.count_tokens(buffer),
+            max_tokens=self.max_token_limit,
+        )
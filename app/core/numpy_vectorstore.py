@@ -0,0 +1,452 @@
+import json
+import os
+import threading
+import uuid
+from typing import Any, Iterable, Optional, Tuple
+
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+from langchain.vectorstores.base import VectorStore
+
+from app.core.config import settings
+from app.core.log import logger
+
+VECTORS_SUFFIX = ".vectors.f32"
+RECORDS_SUFFIX = ".records.jsonl"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpyCollection:
+    """
+    A persisted collection of unit-length float32 vectors and their records.
+
+    The vectors live in a raw float32 file that is memory-mapped for search, and
+    each row's ID, text and metadata live on the matching line of a JSON Lines
+    sidecar. Additions are appended to both files; deletions rewrite them and
+    atomically replace the originals. If an append was interrupted, both files are
+    cut back to the rows they share when the collection is loaded.
+
+    Args:
+        persist_directory (str): The directory the collection is persisted in.
+        collection_name (str): The name of the collection.
+    """  # noqa
+
+    def __init__(self, persist_directory: str, collection_name: str):
+        self.persist_directory = persist_directory
+        self.collection_name = collection_name
+        self.vectors_filepath = os.path.join(
+            persist_directory, f"{collection_name}{VECTORS_SUFFIX}"
+        )
+        self.records_filepath = os.path.join(
+            persist_directory, f"{collection_name}{RECORDS_SUFFIX}"
+        )
+        self.lock = threading.RLock()
+        self.records: list[dict] = []
+        self.positions: dict[str, int] = {}
+        self.dimensions = 0
+        self.vectors: Optional[np.ndarray] = None
+        self._ivf: Optional[Tuple[np.ndarray, list[np.ndarray]]] = None
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.records_filepath):
+            return
+        with open(self.records_filepath, "r") as f:
+            lines = [line for line in f if line.strip()]
+        for line in lines:
+            try:
+                self.records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # The last line of an append that was interrupted
+                break
+        if self.records:
+            self.dimensions = self.records[0]["dimensions"]
+        self._map_vectors()
+        self._repair(len(lines))
+        self.positions = {
+            record["id"]: position for position, record in enumerate(self.records)
+        }
+
+    def _repair(self, lines: int) -> None:
+        # An interrupted append leaves one file ahead of the other. Cut both back to
+        # the rows they share, or later appends would pair records with the wrong
+        # vectors.
+        rows = len(self)
+        if lines > rows:
+            logger.warning(
+                "vectorstore.numpy.repair.records",
+                collection_name=self.collection_name,
+                lines=lines,
+                rows=rows,
+            )
+            self.records = self.records[:rows]
+            temp_records_filepath = f"{self.records_filepath}.tmp"
+            with open(temp_records_filepath, "w") as f:
+                for record in self.records:
+                    f.write(json.dumps(record) + "\n")
+            os.replace(temp_records_filepath, self.records_filepath)
+        size = rows * 4 * self.dimensions
+        if (
+            os.path.exists(self.vectors_filepath)
+            and os.path.getsize(self.vectors_filepath) > size
+        ):
+            logger.warning(
+                "vectorstore.numpy.repair.vectors",
+                collection_name=self.collection_name,
+                rows=rows,
+            )
+            # Release the memory map before truncating the file underneath it
+            self.vectors = None
+            os.truncate(self.vectors_filepath, size)
+            self._map_vectors()
+
+    def _map_vectors(self) -> None:
+        self._ivf = None
+        if not self.dimensions or not os.path.exists(self.vectors_filepath):
+            self.vectors = None
+            return
+        rows = os.path.getsize(self.vectors_filepath) // (4 * self.dimensions)
+        self.vectors = (
+            np.memmap(
+                self.vectors_filepath,
+                dtype=np.float32,
+                mode="r",
+                shape=(rows, self.dimensions),
+            )
+            if rows
+            else None
+        )
+
+    def __len__(self) -> int:
+        if self.vectors is None:
+            return 0
+        return min(len(self.records), self.vectors.shape[0])
+
+    def add(self, ids: list[str], vectors: np.ndarray, records: list[dict]) -> None:
+        """
+        Appends vectors and their records, replacing rows with the same IDs.
+
+        Args:
+            ids (list[str]): The IDs of the rows.
+            vectors (np.ndarray): The vectors, one row per ID.
+            records (list[dict]): The text and metadata of each row.
+        """
+        with self.lock:
+            existing = [id_ for id_ in ids if id_ in self.positions]
+            if existing:
+                self.delete(existing)
+            os.makedirs(self.persist_directory, exist_ok=True)
+            self.dimensions = vectors.shape[1]
+            with open(self.vectors_filepath, "ab") as f:
+                f.write(_normalize(vectors).astype(np.float32).tobytes())
+            with open(self.records_filepath, "a") as f:
+                for id_, record in zip(ids, records):
+                    record = {"id": id_, "dimensions": self.dimensions, **record}
+                    f.write(json.dumps(record) + "\n")
+                    self.positions[id_] = len(self.records)
+                    self.records.append(record)
+            self._map_vectors()
+
+    def delete(self, ids: Iterable[str]) -> None:
+        """
+        Removes rows by ID, compacting the files.
+
+        Args:
+            ids (Iterable[str]): The IDs of the rows to remove.
+        """
+        with self.lock:
+            positions = {self.positions[id_] for id_ in ids if id_ in self.positions}
+            if not positions:
+                return
+            keep = [i for i in range(len(self)) if i not in positions]
+            vectors = np.array(self.vectors[keep]) if self.vectors is not None else None
+            records = [self.records[i] for i in keep]
+
+            temp_vectors_filepath = f"{self.vectors_filepath}.tmp"
+            with open(temp_vectors_filepath, "wb") as f:
+                if vectors is not None:
+                    f.write(vectors.tobytes())
+            temp_records_filepath = f"{self.records_filepath}.tmp"
+            with open(temp_records_filepath, "w") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+            # Release the memory map before replacing the file underneath it
+            self.vectors = None
+            os.replace(temp_vectors_filepath, self.vectors_filepath)
+            os.replace(temp_records_filepath, self.records_filepath)
+
+            self.records = records
+            self.positions = {
+                record["id"]: position for position, record in enumerate(records)
+            }
+            self._map_vectors()
+
+    def _get_ivf(
+        self, lists: int, iterations: int = 10
+    ) -> Tuple[np.ndarray, list[np.ndarray]]:
+        # Coarse k-means quantizer, rebuilt lazily after every change
+        if self._ivf is None:
+            vectors = np.asarray(self.vectors[: len(self)])
+            lists = min(lists or int(np.sqrt(len(vectors))), len(vectors))
+            generator = np.random.default_rng(0)
+            centroids = vectors[generator.choice(len(vectors), lists, replace=False)]
+            for _ in range(iterations):
+                assignments = np.argmax(vectors @ centroids.T, axis=1)
+                for list_index in range(lists):
+                    members = vectors[assignments == list_index]
+                    if len(members):
+                        centroids[list_index] = members.mean(axis=0)
+                centroids = _normalize(centroids)
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            self._ivf = (
+                centroids,
+                [np.flatnonzero(assignments == i) for i in range(lists)],
+            )
+            logger.debug(
+                "vectorstore.numpy.ivf.build",
+                collection_name=self.collection_name,
+                lists=lists,
+                size=len(vectors),
+            )
+        return self._ivf
+
+    def search(
+        self,
+        vector: np.ndarray,
+        k: int,
+        index_type: str = settings.VECTORSTORE_NUMPY_INDEX,
+        ivf_min_size: int = settings.VECTORSTORE_NUMPY_IVF_MIN_SIZE,
+        ivf_lists: int = settings.VECTORSTORE_NUMPY_IVF_LISTS,
+        ivf_probes: int = settings.VECTORSTORE_NUMPY_IVF_PROBES,
+    ) -> list[Tuple[dict, float]]:
+        """
+        Finds the rows most similar to a vector by cosine similarity.
+
+        Searches every row, unless an IVF index is requested and the collection has
+        at least `ivf_min_size` rows, in which case only the rows of the
+        `ivf_probes` nearest lists are searched.
+
+        Args:
+            vector (np.ndarray): The query vector.
+            k (int): The maximum number of rows to return.
+            index_type (str, optional): "flat" or "ivf". Defaults to settings.VECTORSTORE_NUMPY_INDEX.
+            ivf_min_size (int, optional): The minimum number of rows to use the IVF index. Defaults to settings.VECTORSTORE_NUMPY_IVF_MIN_SIZE.
+            ivf_lists (int, optional): The number of IVF lists, or 0 for the square root of the number of rows. Defaults to settings.VECTORSTORE_NUMPY_IVF_LISTS.
+            ivf_probes (int, optional): The number of IVF lists searched. Defaults to settings.VECTORSTORE_NUMPY_IVF_PROBES.
+
+        Returns:
+            list[Tuple[dict, float]]: The records and their similarity, best first.
+        """  # noqa
+        with self.lock:
+            size = len(self)
+            if not size:
+                return []
+            query = _normalize(np.asarray(vector, dtype=np.float32)[None, :])[0]
+            vectors = self.vectors[:size]
+            if index_type == "ivf" and size >= ivf_min_size:
+                centroids, lists = self._get_ivf(ivf_lists)
+                probes = np.argsort(centroids @ query)[::-1][:ivf_probes]
+                candidates = np.concatenate([lists[i] for i in probes])
+                scores = vectors[candidates] @ query
+            else:
+                candidates = None
+                scores = vectors @ query
+
+            k = min(k, len(scores))
+            if not k:
+                return []
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            positions = candidates[best] if candidates is not None else best
+            return [
+                (self.records[position], float(scores[index]))
+                for index, position in zip(best, positions)
+            ]
+
+
+numpy_collections: dict[Tuple[str, str], NumpyCollection] = {}
+numpy_collections_lock = threading.Lock()
+
+
+def get_numpy_collection(
+    persist_directory: str, collection_name: str
+) -> NumpyCollection:
+    """
+    Gets a collection, loading it once per process so every vector store on it
+    shares the same memory map.
+
+    Args:
+        persist_directory (str): The directory the collection is persisted in.
+        collection_name (str): The name of the collection.
+
+    Returns:
+        NumpyCollection: The collection.
+    """  # noqa
+    key = (persist_directory, collection_name)
+    with numpy_collections_lock:
+        if key not in numpy_collections:
+            numpy_collections[key] = NumpyCollection(persist_directory, collection_name)
+        return numpy_collections[key]
+
+
+def delete_numpy_collection(persist_directory: str, collection_name: str) -> None:
+    """
+    Deletes a collection from memory and disk.
+
+    Args:
+        persist_directory (str): The directory the collection is persisted in.
+        collection_name (str): The name of the collection.
+    """
+    with numpy_collections_lock:
+        numpy_collections.pop((persist_directory, collection_name), None)
+    for suffix in (VECTORS_SUFFIX, RECORDS_SUFFIX):
+        filepath = os.path.join(persist_directory, f"{collection_name}{suffix}")
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Vector store backed by a memory-mapped NumPy matrix, searched with vectorized
+    brute-force cosine similarity or an optional IVF index.
+
+    Mirrors the parts of the Chroma interface the app relies on, including
+    `get(include=...)` and `delete(ids=...)`.
+
+    Args:
+        collection_name (str): The name of the collection.
+        embedding_function (Embeddings): The embeddings used for texts and queries.
+        persist_directory (str): The directory the collection is persisted in.
+    """  # noqa
+
+    def __init__(
+        self,
+        collection_name: str,
+        embedding_function: Embeddings,
+        persist_directory: str,
+    ):
+        self.collection_name = collection_name
+        self.embedding_function = embedding_function
+        self.persist_directory = persist_directory
+        self.collection = get_numpy_collection(persist_directory, collection_name)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[list[dict]] = None,
+        ids: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = np.array(
+            self.embedding_function.embed_documents(texts), dtype=np.float32
+        )
+        self.collection.add(
+            ids,
+            vectors,
+            [
+                {"document": text, "metadata": metadata}
+                for text, metadata in zip(texts, metadatas)
+            ],
+        )
+        return ids
+
+    def get(
+        self, ids: Optional[list[str]] = None, include: Optional[list[str]] = None
+    ) -> dict[str, list]:
+        include = include or ["documents", "metadatas"]
+        with self.collection.lock:
+            records = self.collection.records[: len(self.collection)]
+            if ids is not None:
+                wanted = set(ids)
+                records = [record for record in records if record["id"] in wanted]
+        result: dict[str, list] = {"ids": [record["id"] for record in records]}
+        if "documents" in include:
+            result["documents"] = [record["document"] for record in records]
+        if "metadatas" in include:
+            result["metadatas"] = [record["metadata"] for record in records]
+        return result
+
+    def delete(self, ids: Optional[list[str]] = None, **kwargs: Any) -> None:
+        if ids:
+            self.collection.delete(ids)
+
+    def persist(self) -> None:
+        # Every change is written as it happens
+        pass
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: list[float], k: int = 4
+    ) -> list[Tuple[Document, float]]:
+        return [
+            (
+                Document(page_content=record["document"], metadata=record["metadata"]),
+                score,
+            )
+            for record, score in self.collection.search(np.array(embedding), k)
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(
+            self.embedding_function.embed_query(query), k
+        )
+
+    def similarity_search_by_vector(
+        self, embedding: list[float], k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        return [
+            document
+            for document, _ in self.similarity_search_by_vector_with_score(embedding, k)
+        ]
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        return [
+            document
+            for document, _ in self.similarity_search_with_score(query, k, **kwargs)
+        ]
+
+    def _similarity_search_with_relevance_scores(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[Tuple[Document, float]]:
+        # Map cosine similarity from [-1, 1] to [0, 1]
+        return [
+            (document, (score + 1) / 2)
+            for document, score in self.similarity_search_with_score(query, k)
+        ]
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: list[str],
+        embedding: Embeddings,
+        metadatas: Optional[list[dict]] = None,
+        ids: Optional[list[str]] = None,
+        collection_name: str = "langchain",
+        persist_directory: str = settings.VECTORSTORE_CHROMADB_DIR,
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        vectorstore = cls(
+            collection_name=collection_name,
+            embedding_function=embedding,
+            persist_directory=persist_directory,
+        )
+        vectorstore.add_texts(texts, metadatas=metadatas, ids=ids)
+        return vectorstore
@@ -0,0 +1,270 @@
+import hashlib
+import random
+import time
+from typing import Any, Callable, Optional
+
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.chat_models import ChatOpenAI
+from langchain.chat_models.base import BaseChatModel
+from langchain.embeddings import DeterministicFakeEmbedding, OpenAIEmbeddings
+from langchain.schema import ChatGeneration, ChatResult
+from langchain.schema.embeddings import Embeddings
+from langchain.schema.messages import AIMessage, BaseMessage
+
+from app.core.cancellation import CancellationToken
+from app.core.config import settings
+from app.core.embedding_scheduler import ScheduledEmbeddings
+
+ChatModelFactory = Callable[[str, float, bool], BaseChatModel]
+EmbeddingsFactory = Callable[[], Embeddings]
+
+FAKE_WORDS = (
+    "the knight rode north through the storm to reach the keep before dawn and "
+    "the council of mages met in the tower to read the ancient scroll"
+).split()
+
+
+class CancellableChatOpenAI(ChatOpenAI):
+    """
+    ChatOpenAI that attaches its HTTP streams to any `CancellationToken` among the
+    request's callbacks, so cancelling closes the connection right away.
+    """  # noqa
+
+    def completion_with_retry(
+        self, run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any
+    ) -> Any:
+        response = super().completion_with_retry(run_manager=run_manager, **kwargs)
+        stream = getattr(response, "response", None)
+        if kwargs.get("stream") and run_manager and stream is not None:
+            for handler in run_manager.handlers:
+                if isinstance(handler, CancellationToken):
+                    handler.attach(stream.close)
+        return response
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Local stand-in for a chat model, for load testing without an API.
+
+    The response is a deterministic function of the prompt. When streaming, its
+    first token arrives after `latency` seconds and the rest at
+    `tokens_per_second`, through the same callbacks as a real model.
+
+    Attributes:
+        model_name (str): The name of the model it stands in for.
+        streaming (bool): Whether to stream tokens.
+        latency (float): The seconds before the first token.
+        tokens_per_second (float): The streaming rate, or 0 for no delay.
+        response_tokens (int): The number of tokens per response.
+    """
+
+    model_name: str = "fake"
+    streaming: bool = False
+    latency: float = settings.FAKE_LLM_LATENCY_SECONDS
+    tokens_per_second: float = settings.FAKE_LLM_TOKENS_PER_SECOND
+    response_tokens: int = settings.FAKE_LLM_RESPONSE_TOKENS
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def get_response_tokens(self, messages: list[BaseMessage]) -> list[str]:
+        prompt = "\n".join(str(message.content) for message in messages)
+        seed = int.from_bytes(hashlib.sha256(prompt.encode()).digest()[:8], "big")
+        words = random.Random(seed).choices(FAKE_WORDS, k=self.response_tokens)
+        return [f"{word} " for word in words]
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = self.get_response_tokens(messages)
+        time.sleep(self.latency)
+        if self.streaming and run_manager:
+            interval = 1 / self.tokens_per_second if self.tokens_per_second else 0
+            for index, token in enumerate(tokens):
+                if index and interval:
+                    time.sleep(interval)
+                run_manager.on_llm_new_token(token)
+        message = AIMessage(content="".join(tokens).rstrip())
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class FakeEmbeddings(DeterministicFakeEmbedding):
+    """
+    Deterministic local embeddings, for load testing without an API.
+
+    Attributes:
+        latency (float): The seconds each call takes.
+    """
+
+    latency: float = settings.FAKE_EMBEDDING_LATENCY_SECONDS
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(self.latency)
+        return super().embed_query(text)
+
+
+def _create_openai_chat_model(
+    model: str, temperature: float, streaming: bool
+) -> BaseChatModel:
+    return CancellableChatOpenAI(
+        api_key=settings.OPENAI_API_KEY,
+        temperature=temperature,
+        model=model,
+        streaming=streaming,
+        verbose=streaming,
+    )
+
+
+def _create_local_chat_model(
+    model: str, temperature: float, streaming: bool
+) -> BaseChatModel:
+    return CancellableChatOpenAI(
+        api_key=settings.LOCAL_LLM_API_KEY,
+        base_url=settings.LOCAL_LLM_BASE_URL,
+        temperature=temperature,
+        model=model,
+        streaming=streaming,
+        verbose=streaming,
+    )
+
+
+def _create_fake_chat_model(
+    model: str, temperature: float, streaming: bool
+) -> BaseChatModel:
+    return FakeChatModel(
+        model_name=model,
+        streaming=streaming,
+        latency=settings.FAKE_LLM_LATENCY_SECONDS,
+        tokens_per_second=settings.FAKE_LLM_TOKENS_PER_SECOND,
+        response_tokens=settings.FAKE_LLM_RESPONSE_TOKENS,
+    )
+
+
+def _create_openai_embeddings() -> Embeddings:
+    if settings.EMBEDDING_SCHEDULER_ENABLED:
+        return ScheduledEmbeddings(api_key=settings.OPENAI_API_KEY)
+    return OpenAIEmbeddings(
+        api_key=settings.OPENAI_API_KEY, model=settings.EMBEDDING_MODEL
+    )
+
+
+def _create_fake_embeddings() -> Embeddings:
+    return FakeEmbeddings(
+        size=settings.FAKE_EMBEDDING_DIMENSIONS,
+        latency=settings.FAKE_EMBEDDING_LATENCY_SECONDS,
+    )
+
+
+chat_model_providers: dict[str, ChatModelFactory] = {
+    "openai": _create_openai_chat_model,
+    "local": _create_local_chat_model,
+    "fake": _create_fake_chat_model,
+}
+embeddings_providers: dict[str, EmbeddingsFactory] = {
+    "openai": _create_openai_embeddings,
+    "fake": _create_fake_embeddings,
+}
+
+
+def register_chat_model_provider(name: str, factory: ChatModelFactory) -> None:
+    """
+    Registers a chat model provider, selectable with settings.LLM_PROVIDER.
+
+    Args:
+        name (str): The name of the provider.
+        factory (ChatModelFactory): Creates a chat model from the model name, temperature and whether to stream.
+    """  # noqa
+    chat_model_providers[name] = factory
+
+
+def register_embeddings_provider(name: str, factory: EmbeddingsFactory) -> None:
+    """
+    Registers an embeddings provider, selectable with settings.EMBEDDING_PROVIDER.
+
+    Args:
+        name (str): The name of the provider.
+        factory (EmbeddingsFactory): Creates the embeddings.
+    """  # noqa
+    embeddings_providers[name] = factory
+
+
+def _get_provider(providers: dict[str, Any], name: str, kind: str) -> Any:
+    if name not in providers:
+        raise ValueError(
+            f"Unknown {kind} provider {name!r}, expected one of {sorted(providers)}"
+        )
+    return providers[name]
+
+
+def create_chat_model(
+    model: str,
+    temperature: float,
+    streaming: bool = False,
+    provider: Optional[str] = None,
+) -> BaseChatModel:
+    """
+    Creates a chat model with the configured provider.
+
+    Args:
+        model (str): The name of the model.
+        temperature (float): The sampling temperature.
+        streaming (bool, optional): Whether to stream tokens. Defaults to False.
+        provider (Optional[str], optional): The provider. Defaults to settings.LLM_PROVIDER.
+
+    Raises:
+        ValueError: If the provider is not registered.
+
+    Returns:
+        BaseChatModel: The chat model.
+    """  # noqa
+    factory = _get_provider(
+        chat_model_providers, provider or settings.LLM_PROVIDER, "chat model"
+    )
+    return factory(model, temperature, streaming)
+
+
+def create_provider_embeddings(provider: Optional[str] = None) -> Embeddings:
+    """
+    Creates embeddings with the configured provider, without the embedding cache.
+
+    Args:
+        provider (Optional[str], optional): The provider. Defaults to settings.EMBEDDING_PROVIDER.
+
+    Raises:
+        ValueError: If the provider is not registered.
+
+    Returns:
+        Embeddings: The embeddings.
+    """  # noqa
+    factory = _get_provider(
+        embeddings_providers, provider or settings.EMBEDDING_PROVIDER, "embeddings"
+    )
+    return factory()
+
+
+def get_embeddings_cache_model(provider: Optional[str] = None) -> str:
+    """
+    Gets the model name embeddings of a provider are cached under, so fake vectors
+    never mix with real ones.
+
+    Args:
+        provider (Optional[str], optional): The provider. Defaults to settings.EMBEDDING_PROVIDER.
+
+    Returns:
+        str: The model name used as the cache key.
+    """  # noqa
+    provider = provider or settings.EMBEDDING_PROVIDER
+    if provider == "openai":
+        return settings.EMBEDDING_MODEL
+    if provider == "fake":
+        return f"fake-{settings.FAKE_EMBEDDING_DIMENSIONS}"
+    return f"{provider}-{settings.EMBEDDING_MODEL}"
@@ -0,0 +1,283 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+from langchain.schema.messages import BaseMessage
+
+from app.core.config import settings
+from app.core.embeddings import normalize_text
+from app.core.hashing import hash_text
+from app.core.log import logger
+from app.models import KnowledgeBaseDocument
+
+
+@dataclass
+class ResponseCacheKey:
+    """
+    Everything a cached response depends on.
+
+    Attributes:
+        model (str): The name of the chat model.
+        temperature (float): The sampling temperature.
+        knowledge_base_version (str): The version of the knowledge base, empty when it is not used.
+        prompt (str): The user's prompt.
+        chunk_ids (list[str]): The IDs of the chunks retrieved for the prompt.
+        history_version (str): The version of the conversation history the prompt follows, empty when there is none.
+    """  # noqa
+
+    model: str
+    temperature: float
+    knowledge_base_version: str
+    prompt: str
+    chunk_ids: list[str] = field(default_factory=list)
+    history_version: str = ""
+
+    @property
+    def context_hash(self) -> str:
+        # Everything but the prompt, so similar prompts can be matched within it
+        return hash_text(
+            "\x00".join(
+                [
+                    self.model,
+                    str(self.temperature),
+                    self.knowledge_base_version,
+                    self.history_version,
+                    *sorted(self.chunk_ids),
+                ]
+            )
+        )
+
+    @property
+    def prompt_hash(self) -> str:
+        return hash_text(normalize_text(self.prompt).lower())
+
+
+def get_knowledge_base_version(
+    knowledge_base_documents: dict[str, KnowledgeBaseDocument]
+) -> str:
+    """
+    Derives a version of a knowledge base from the content hashes of its documents,
+    so it changes whenever a document is added, removed or re-indexed.
+
+    Args:
+        knowledge_base_documents (dict[str, KnowledgeBaseDocument]): The documents of the knowledge base.
+
+    Returns:
+        str: The version.
+    """  # noqa
+    return hash_text(
+        "\x00".join(
+            f"{document_name}\x01{document.Hash or ''}"
+            for document_name, document in sorted(knowledge_base_documents.items())
+        )
+    )
+
+
+def get_history_version(messages: list[BaseMessage], summary: str = "") -> str:
+    """
+    Derives a version of a conversation history from its summary and messages, so
+    a follow-up prompt is only matched within the same conversation.
+
+    Args:
+        messages (list[BaseMessage]): The messages of the history.
+        summary (str, optional): The summary of older messages. Defaults to "".
+
+    Returns:
+        str: The version, empty when there is no history.
+    """  # noqa
+    if not messages and not summary:
+        return ""
+    return hash_text(
+        "\x00".join(
+            [summary, *(f"{message.type}\x01{message.content}" for message in messages)]
+        )
+    )
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache of chat responses.
+
+    Responses are looked up by the exact normalized prompt within the same model,
+    knowledge base version, conversation history and retrieved chunks. When a
+    similarity threshold is set, a prompt whose embedding is at least that similar
+    to a cached prompt in the same context is a hit too. Entries expire after
+    `ttl_seconds`, and the least recently used entries are evicted once the cache
+    holds more than `max_entries` responses.
+
+    Args:
+        cache_filepath (str): The path of the SQLite cache file.
+        ttl_seconds (float): How long a response stays valid.
+        max_entries (int): The maximum number of responses to keep.
+        similarity_threshold (float): The minimum cosine similarity of a similar prompt, or 0 to only match exact prompts.
+        embeddings (Optional[Embeddings]): The embeddings used to compare prompts, required for similarity lookups.
+
+    Attributes:
+        hits (int): The number of responses served from the cache.
+        misses (int): The number of lookups that found nothing.
+    """  # noqa
+
+    def __init__(
+        self,
+        cache_filepath: str = settings.RESPONSE_CACHE_FILEPATH,
+        ttl_seconds: float = settings.RESPONSE_CACHE_TTL_SECONDS,
+        max_entries: int = settings.RESPONSE_CACHE_MAX_ENTRIES,
+        similarity_threshold: float = settings.RESPONSE_CACHE_SIMILARITY_THRESHOLD,
+        embeddings: Optional[Embeddings] = None,
+    ):
+        self.cache_filepath = cache_filepath
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.embeddings = embeddings
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(cache_filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(cache_filepath, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                context_hash TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                prompt_vector BLOB,
+                response TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (context_hash, prompt_hash)
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access "
+            "ON responses (last_access)"
+        )
+        self._connection.commit()
+
+    @property
+    def uses_similarity(self) -> bool:
+        return self.similarity_threshold > 0 and self.embeddings is not None
+
+    def _find_similar(
+        self, key: ResponseCacheKey, oldest: float
+    ) -> Optional[tuple[str, str, str]]:
+        rows = self._connection.execute(
+            "SELECT prompt_hash, prompt_vector, response, sources FROM responses "
+            "WHERE context_hash = ? AND created >= ? AND prompt_vector IS NOT NULL",
+            (key.context_hash, oldest),
+        ).fetchall()
+        if not rows:
+            return None
+        query = np.array(self.embeddings.embed_query(key.prompt), dtype=np.float32)
+        vectors = np.array(
+            [np.frombuffer(vector, dtype=np.float32) for _, vector, _, _ in rows]
+        )
+        similarities = (vectors @ query) / (
+            np.linalg.norm(vectors, axis=1) * np.linalg.norm(query) or 1.0
+        )
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        prompt_hash, _, response, sources = rows[best]
+        return prompt_hash, response, sources
+
+    def get(self, key: ResponseCacheKey) -> Optional[dict]:
+        """
+        Looks up the cached response for a prompt.
+
+        Args:
+            key (ResponseCacheKey): The prompt and what its response depends on.
+
+        Returns:
+            Optional[dict]: The response, with its sources, or None on a miss.
+        """
+        oldest = time.time() - self.ttl_seconds
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT prompt_hash, response, sources FROM responses "
+                "WHERE context_hash = ? AND prompt_hash = ? AND created >= ?",
+                (key.context_hash, key.prompt_hash, oldest),
+            ).fetchone()
+            if row is None and self.uses_similarity:
+                row = self._find_similar(key, oldest)
+            if row is None:
+                self.misses += 1
+                logger.debug("ai.response_cache.miss", model=key.model)
+                return None
+
+            prompt_hash, response, sources = row
+            self._connection.execute(
+                "UPDATE responses SET last_access = ? "
+                "WHERE context_hash = ? AND prompt_hash = ?",
+                (time.time(), key.context_hash, prompt_hash),
+            )
+            self._connection.commit()
+        self.hits += 1
+        logger.debug("ai.response_cache.hit", model=key.model, total_hits=self.hits)
+        result = {"response": response}
+        sources = json.loads(sources)
+        if sources:
+            result["sources"] = [Document(**source) for source in sources]
+        return result
+
+    def put(self, key: ResponseCacheKey, result: dict) -> None:
+        """
+        Caches the response to a prompt.
+
+        Args:
+            key (ResponseCacheKey): The prompt and what its response depends on.
+            result (dict): The response, with its sources.
+        """
+        prompt_vector = None
+        if self.uses_similarity:
+            prompt_vector = array(
+                "f", self.embeddings.embed_query(key.prompt)
+            ).tobytes()
+        sources = json.dumps(
+            [
+                {"page_content": source.page_content, "metadata": source.metadata}
+                for source in result.get("sources", [])
+            ]
+        )
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (context_hash, prompt_hash, "
+                "prompt_vector, response, sources, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key.context_hash,
+                    key.prompt_hash,
+                    prompt_vector,
+                    result["response"],
+                    sources,
+                    now,
+                    now,
+                ),
+            )
+            self._evict(now)
+            self._connection.commit()
+
+    def _evict(self, now: float) -> None:
+        self._connection.execute(
+            "DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,)
+        )
+        (count,) = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM responses WHERE rowid IN ("
+                "SELECT rowid FROM responses ORDER BY last_access LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            logger.debug("ai.response_cache.evict", evicted=count - self.max_entries)
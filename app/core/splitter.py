@@ -1,25 +1,14 @@
+from typing import Iterable, Iterator, Optional, Tuple
+
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
-from app.core.log import logger
-
-AVE_TOKEN_LENGTH = 5
+from app.core.config import settings
+from app.core.log import logger, timed
+from app.core.tokens import AVE_TOKEN_LENGTH, count_tokens
 
 
-def get_document_chunks(
-    documents: list[Document],
-    chunk_size: int = 1000,
-    chunk_overlap: int = 200,
-    context_window: int = 16385,
-) -> list[Document]:
-    # Return documents if no chunking is needed
-    total_size = sum(
-        [
-            doc.metadata["size"] if doc.metadata.get("size", None) else 0
-            for doc in documents
-        ]
-    )
-
+def get_chunk_size(context_window: int = 16385) -> Tuple[int, int]:
     # Estimate max characters per chunk considering the token limit
     max_characters = context_window * AVE_TOKEN_LENGTH
 
@@ -28,15 +17,144 @@ def get_document_chunks(
     # Set chunk size and overlap
     chunk_size = int(max_characters * 0.10)  # % of max character limit
     chunk_overlap = int(chunk_size * 0.10)  # % of chunk size for overlap
+    return chunk_size, chunk_overlap
+
+
+def get_text_splitter(
+    chunk_size: Optional[int] = None,
+    chunk_overlap: Optional[int] = None,
+    context_window: int = 16385,
+    model: str = settings.EMBEDDING_MODEL,
+    token_aware: bool = settings.SPLITTER_TOKEN_AWARE,
+) -> RecursiveCharacterTextSplitter:
+    """
+    Creates the text splitter used to chunk documents.
+
+    In token-aware mode chunk sizes are measured in tokens of the given model and
+    default to settings.SPLITTER_CHUNK_TOKENS. Otherwise they are measured in
+    characters and, unless given, estimated from the context window.
+
+    Args:
+        chunk_size (Optional[int], optional): The maximum size of a chunk.
+        chunk_overlap (Optional[int], optional): The overlap between consecutive chunks.
+        context_window (int, optional): The context window used to estimate character chunk sizes. Defaults to 16385.
+        model (str, optional): The model whose tokenizer measures chunks. Defaults to settings.EMBEDDING_MODEL.
+        token_aware (bool, optional): Whether to measure chunks in tokens. Defaults to settings.SPLITTER_TOKEN_AWARE.
+
+    Returns:
+        RecursiveCharacterTextSplitter: The text splitter.
+    """  # noqa
+    if token_aware:
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size or settings.SPLITTER_CHUNK_TOKENS,
+            chunk_overlap=(
+                chunk_overlap
+                if chunk_overlap is not None
+                else settings.SPLITTER_CHUNK_OVERLAP_TOKENS
+            ),
+            length_function=lambda text: count_tokens(text, model),
+        )
+
+    estimated_chunk_size, estimated_chunk_overlap = get_chunk_size(context_window)
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size or estimated_chunk_size,
+        chunk_overlap=(
+            chunk_overlap if chunk_overlap is not None else estimated_chunk_overlap
+        ),
+    )
 
-    logger.debug("splitter.size", total_size=total_size, chunk_size=chunk_size)
 
-    if total_size < chunk_size:
-        return documents
+@timed("splitter.get_document_chunks")
+def get_document_chunks(
+    documents: list[Document],
+    chunk_size: Optional[int] = None,
+    chunk_overlap: Optional[int] = None,
+    context_window: int = 16385,
+    token_aware: bool = settings.SPLITTER_TOKEN_AWARE,
+) -> list[Document]:
+    if not token_aware:
+        # Return documents if no chunking is needed
+        total_size = sum(
+            [
+                doc.metadata["size"] if doc.metadata.get("size", None) else 0
+                for doc in documents
+            ]
+        )
+        max_size = chunk_size or get_chunk_size(context_window)[0]
+        logger.debug("splitter.size", total_size=total_size, chunk_size=max_size)
+        if total_size < max_size:
+            return documents
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    text_splitter = get_text_splitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        context_window=context_window,
+        token_aware=token_aware,
     )
     splits = text_splitter.split_documents(documents)
     logger.debug("splitter.split", count=len(splits))
     return splits
+
+
+def iter_document_chunks(
+    documents: Iterable[Document],
+    chunk_size: Optional[int] = None,
+    chunk_overlap: Optional[int] = None,
+    context_window: int = 16385,
+    token_aware: bool = settings.SPLITTER_TOKEN_AWARE,
+) -> Iterator[Document]:
+    """
+    Lazily splits documents into chunks, one document at a time, so only a single
+    document's chunks are held in memory.
+
+    Args:
+        documents (Iterable[Document]): The documents to split.
+        chunk_size (Optional[int], optional): The maximum size of a chunk.
+        chunk_overlap (Optional[int], optional): The overlap between consecutive chunks.
+        context_window (int, optional): The context window used to estimate character chunk sizes. Defaults to 16385.
+        token_aware (bool, optional): Whether to measure chunks in tokens. Defaults to settings.SPLITTER_TOKEN_AWARE.
+
+    Yields:
+        Document: The chunks, in document order.
+    """  # noqa
+    text_splitter = get_text_splitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        context_window=context_window,
+        token_aware=token_aware,
+    )
+    for document in documents:
+        yield from text_splitter.split_documents([document])
+
+
+@timed("splitter.pack_documents")
+def pack_documents(
+    documents: list[Document], max_tokens: int, model: str
+) -> list[Document]:
+    """
+    Keeps documents, in order, skipping any that would exceed the token budget.
+
+    Args:
+        documents (list[Document]): The documents, most relevant first.
+        max_tokens (int): The token budget.
+        model (str): The model whose tokenizer measures documents.
+
+    Returns:
+        list[Document]: The documents that fit the budget.
+    """
+    packed: list[Document] = []
+    total_tokens = 0
+    for document in documents:
+        tokens = count_tokens(document.page_content, model)
+        if total_tokens + tokens > max_tokens:
+            continue
+        packed.append(document)
+        total_tokens += tokens
+    logger.debug(
+        "splitter.pack",
+        documents=len(documents),
+        packed=len(packed),
+        tokens=total_tokens,
+        max_tokens=max_tokens,
+    )
+    return packed
@@ -0,0 +1,157 @@
+import re
+import time
+from typing import Callable
+
+from app.core.config import settings
+from app.core.log import logger, record_latency
+
+# Words with their surrounding whitespace, so joining them rebuilds the text
+WORD_PATTERN = re.compile(r"\s*\S+\s*")
+
+
+def split_words(text: str) -> list[str]:
+    """
+    Splits text into words, keeping the whitespace so they join back into the
+    original text.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        list[str]: The words.
+    """
+    return WORD_PATTERN.findall(text) or ([text] if text else [])
+
+
+def get_animation_frames(
+    text: str,
+    frame_interval: float = settings.CHAT_TEXT_ANIMATION_SPEED,
+    max_duration: float = settings.CHAT_TEXT_ANIMATION_MAX_DURATION,
+) -> list[str]:
+    """
+    Splits text into the frames of a typing animation. Frames hold whole words and
+    there are only as many as fit the maximum duration, so long texts are typed
+    in larger chunks rather than taking longer.
+
+    Args:
+        text (str): The text to animate.
+        frame_interval (float, optional): The seconds between frames. Defaults to settings.CHAT_TEXT_ANIMATION_SPEED.
+        max_duration (float, optional): The longest the animation may take. Defaults to settings.CHAT_TEXT_ANIMATION_MAX_DURATION.
+
+    Returns:
+        list[str]: The text to append in each frame.
+    """  # noqa
+    words = split_words(text)
+    max_frames = int(max_duration / frame_interval) if frame_interval > 0 else 1
+    frame_count = max(1, min(len(words), max_frames))
+    frames: list[str] = []
+    for frame in range(frame_count):
+        start = len(words) * frame // frame_count
+        end = len(words) * (frame + 1) // frame_count
+        frames.append("".join(words[start:end]))
+    return frames
+
+
+class TokenBuffer:
+    """
+    Buffers streamed tokens and hands them to a render callback in batches, so the
+    UI is updated at a bounded rate instead of once per token.
+
+    Buffered text is flushed once at least `1 / max_updates_per_second` seconds
+    have passed since the previous flush, or once `flush_tokens` tokens are
+    buffered. The first token is always flushed right away so the time to first
+    token is unaffected, and whatever is left is flushed on close.
+
+    The buffer is created when the request starts, so on close it records the time
+    to first token, the time spent rendering and the token and update rates.
+
+    Args:
+        render (Callable[[str], None]): Called with the text of each flush.
+        max_updates_per_second (float, optional): The maximum flush rate, or 0 to flush every token. Defaults to settings.CHAT_STREAM_MAX_UPDATES_PER_SECOND.
+        flush_tokens (int, optional): The number of buffered tokens that forces a flush, or 0 for no limit. Defaults to settings.CHAT_STREAM_FLUSH_TOKENS.
+        clock (Callable[[], float], optional): The monotonic clock. Defaults to time.perf_counter.
+
+    Attributes:
+        tokens (int): The number of tokens received.
+        updates (int): The number of flushes, i.e. UI updates.
+        render_seconds (float): The time spent in the render callback.
+    """  # noqa
+
+    def __init__(
+        self,
+        render: Callable[[str], None],
+        max_updates_per_second: float = settings.CHAT_STREAM_MAX_UPDATES_PER_SECOND,
+        flush_tokens: int = settings.CHAT_STREAM_FLUSH_TOKENS,
+        clock: Callable[[], float] = time.perf_counter,
+    ):
+        self.render = render
+        self.min_interval = 1 / max_updates_per_second if max_updates_per_second else 0
+        self.flush_tokens = flush_tokens
+        self.clock = clock
+        self.tokens = 0
+        self.updates = 0
+        self.render_seconds = 0.0
+        self._buffer: list[str] = []
+        self._started_at = clock()
+        self._first_token_at = 0.0
+        self._last_flush_at = 0.0
+
+    def add(self, token: str) -> None:
+        """
+        Buffers a token, flushing if the rate or size limit allows it.
+
+        Args:
+            token (str): The token.
+        """
+        if not token:
+            return
+        now = self.clock()
+        if not self.tokens:
+            self._first_token_at = now
+        self.tokens += 1
+        self._buffer.append(token)
+        if (
+            self.updates == 0
+            or now - self._last_flush_at >= self.min_interval
+            or (self.flush_tokens and len(self._buffer) >= self.flush_tokens)
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Renders the buffered text, if any.
+        """
+        if not self._buffer:
+            return
+        text = "".join(self._buffer)
+        self._buffer.clear()
+        started_at = self.clock()
+        self.render(text)
+        self._last_flush_at = self.clock()
+        self.updates += 1
+        self.render_seconds += self._last_flush_at - started_at
+
+    def close(self) -> dict[str, float]:
+        """
+        Flushes the remaining text and logs the streaming rates.
+
+        Returns:
+            dict[str, float]: The time to first token, the token and UI update counts and rates, and the render time.
+        """  # noqa
+        self.flush()
+        duration = self.clock() - (self._first_token_at or self._started_at)
+        stats = {
+            "ttft": self._first_token_at - self._started_at if self.tokens else 0.0,
+            "tokens": self.tokens,
+            "updates": self.updates,
+            "duration": duration,
+            "tokens_per_second": self.tokens / duration if duration > 0 else 0.0,
+            "updates_per_second": self.updates / duration if duration > 0 else 0.0,
+            "render_seconds": self.render_seconds,
+        }
+        if self.tokens:
+            record_latency("streaming.ttft", stats["ttft"])
+            record_latency("streaming.stream", duration)
+            record_latency("streaming.render", self.render_seconds)
+        logger.debug("streaming.stats", **stats)
+        return stats
@@ -0,0 +1,52 @@
+import math
+from typing import Optional
+
+import tiktoken
+
+from app.core.log import logger
+
+AVE_TOKEN_LENGTH = 5
+DEFAULT_ENCODING = "cl100k_base"
+
+encodings: dict[str, Optional[tiktoken.Encoding]] = {}
+
+
+def get_encoding(model: str) -> Optional[tiktoken.Encoding]:
+    """
+    Gets the tiktoken encoding of a model, falling back to the default encoding for
+    unknown models.
+
+    Args:
+        model (str): The name of the model.
+
+    Returns:
+        Optional[tiktoken.Encoding]: The encoding, or None if it could not be loaded (e.g. offline).
+    """  # noqa
+    if model not in encodings:
+        try:
+            try:
+                encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encodings[model] = tiktoken.get_encoding(DEFAULT_ENCODING)
+        except Exception as e:
+            logger.warning("tokens.encoding.unavailable", model=model, exception=str(e))
+            encodings[model] = None
+    return encodings[model]
+
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    Counts the tokens of a text for a model, estimating from the number of
+    characters when the model's encoding is unavailable.
+
+    Args:
+        text (str): The text.
+        model (str): The name of the model.
+
+    Returns:
+        int: The number of tokens.
+    """  # noqa
+    encoding = get_encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / AVE_TOKEN_LENGTH)
+    return len(encoding.encode(text, disallowed_special=()))
@@ -1,14 +1,187 @@
+import os
+import threading
 from os import path
+from typing import Iterable, Optional, Tuple
 
 import chromadb
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.schema import Document
+from chromadb.api import ClientAPI
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.schema import BaseRetriever, Document
 from langchain.schema.embeddings import Embeddings
-from langchain.vectorstores.base import VectorStoreRetriever
+from langchain.vectorstores.base import VectorStore
 from langchain.vectorstores.chroma import Chroma
 
+from app.core.bm25 import BM25Retriever, delete_bm25_index, get_bm25_index
 from app.core.config import settings
-from app.core.log import logger
+from app.core.context_packing import pack_context
+from app.core.log import logger, timed
+from app.core.numpy_vectorstore import (
+    NumpyVectorStore,
+    delete_numpy_collection,
+    get_numpy_collection,
+)
+from app.core.providers import get_embeddings_cache_model
+from app.core.splitter import pack_documents
+
+# The embedding model of vector stores persisted before they were kept per model
+LEGACY_EMBEDDINGS_MODEL = "text-embedding-ada-002"
+CHROMA_DATABASE_FILENAME = "chroma.sqlite3"
+
+
+class VectorstoreRegistry:
+    """
+    Process-wide registry of ChromaDB clients and collection state, for every
+    vector store backend.
+
+    Holds one client per persist directory and memoizes the number of chunks in
+    each collection, so checking whether a vector store exists never has to touch
+    disk once it is known. Collections indexed in this process are remembered
+    apart from their count, so a knowledge base whose documents yield no chunks is
+    not indexed again on every lookup. The registry must be kept up to date
+    whenever collections are created, changed or deleted.
+    """  # noqa
+
+    def __init__(self):
+        self._clients: dict[str, ClientAPI] = {}
+        self._counts: dict[tuple[str, str], int] = {}
+        self._indexed: set[tuple[str, str]] = set()
+        self._lock = threading.Lock()
+
+    def get_client(self, persist_directory: str) -> ClientAPI:
+        """
+        Gets or creates the client for a persist directory.
+
+        Args:
+            persist_directory (str): The directory the collection is persisted in.
+
+        Returns:
+            ClientAPI: The ChromaDB client.
+        """
+        with self._lock:
+            if persist_directory not in self._clients:
+                self._clients[persist_directory] = chromadb.PersistentClient(
+                    path=persist_directory
+                )
+            return self._clients[persist_directory]
+
+    def count(
+        self,
+        persist_directory: str,
+        collection_name: str,
+        backend: str = settings.VECTORSTORE_BACKEND,
+    ) -> int:
+        """
+        Gets the number of chunks in a collection, probing the backend only the first
+        time the collection is looked up.
+
+        Args:
+            persist_directory (str): The directory the collection is persisted in.
+            collection_name (str): The name of the collection.
+            backend (str, optional): The vector store backend, "chroma" or "numpy". Defaults to settings.VECTORSTORE_BACKEND.
+
+        Returns:
+            int: The number of chunks, or 0 if the collection does not exist.
+        """  # noqa
+        key = (persist_directory, collection_name)
+        with self._lock:
+            if key in self._counts:
+                return self._counts[key]
+        # Probed without the lock, which creating the client takes
+        count = 0
+        if backend == "numpy":
+            count = len(get_numpy_collection(persist_directory, collection_name))
+        else:
+            try:
+                count = (
+                    self.get_client(persist_directory)
+                    .get_collection(name=collection_name)
+                    .count()
+                )
+            except ValueError:
+                pass
+        with self._lock:
+            # A count recorded by an indexing run in the meantime is more recent
+            return self._counts.setdefault(key, count)
+
+    def set_count(self, persist_directory: str, collection_name: str, count: int):
+        """
+        Records the number of chunks in a collection.
+
+        Args:
+            persist_directory (str): The directory the collection is persisted in.
+            collection_name (str): The name of the collection.
+            count (int): The number of chunks.
+        """
+        with self._lock:
+            self._counts[(persist_directory, collection_name)] = count
+
+    def mark_indexed(self, persist_directory: str, collection_name: str):
+        """
+        Records that a collection was indexed, even if it holds no chunks.
+
+        Args:
+            persist_directory (str): The directory the collection is persisted in.
+            collection_name (str): The name of the collection.
+        """
+        with self._lock:
+            self._indexed.add((persist_directory, collection_name))
+
+    def is_indexed(self, persist_directory: str, collection_name: str) -> bool:
+        """
+        Checks whether a collection was indexed in this process.
+
+        Args:
+            persist_directory (str): The directory the collection is persisted in.
+            collection_name (str): The name of the collection.
+
+        Returns:
+            bool: True if the collection was indexed.
+        """
+        with self._lock:
+            return (persist_directory, collection_name) in self._indexed
+
+    def invalidate(self, persist_directory: str, collection_name: str):
+        """
+        Forgets the memoized state of a collection, so it is probed again on the next
+        lookup.
+
+        Args:
+            persist_directory (str): The directory the collection is persisted in.
+            collection_name (str): The name of the collection.
+        """  # noqa
+        with self._lock:
+            self._counts.pop((persist_directory, collection_name), None)
+            self._indexed.discard((persist_directory, collection_name))
+
+    def delete_collection(
+        self,
+        persist_directory: str,
+        collection_name: str,
+        backend: str = settings.VECTORSTORE_BACKEND,
+    ):
+        """
+        Deletes a collection if it exists and records it as empty.
+
+        Args:
+            persist_directory (str): The directory the collection is persisted in.
+            collection_name (str): The name of the collection.
+            backend (str, optional): The vector store backend, "chroma" or "numpy". Defaults to settings.VECTORSTORE_BACKEND.
+        """  # noqa
+        if backend == "numpy":
+            delete_numpy_collection(persist_directory, collection_name)
+        else:
+            try:
+                self.get_client(persist_directory).delete_collection(
+                    name=collection_name
+                )
+            except ValueError:
+                pass
+        self.set_count(persist_directory, collection_name, 0)
+        with self._lock:
+            self._indexed.discard((persist_directory, collection_name))
+
+
+vectorstore_registry = VectorstoreRegistry()
 
 
 def format_knowledge_base_name(knowledge_base_name: str) -> str:
@@ -24,24 +197,111 @@ def format_knowledge_base_name(knowledge_base_name: str) -> str:
     return knowledge_base_name.replace(" ", "_")
 
 
-def delete_vectorstore(knowledge_base_name: str) -> None:
+def get_persist_directory(
+    knowledge_base_name: str,
+    persist_directory_root: str = settings.VECTORSTORE_CHROMADB_DIR,
+    backend: str = settings.VECTORSTORE_BACKEND,
+    embeddings_model: Optional[str] = None,
+) -> str:
     """
-    Deletes the vector store directory and its metadata for a given knowledge base name.
+    Gets the directory the vector store of a knowledge base is persisted in.
+
+    Vectors of different embedding models cannot be compared, so each model has
+    its own vector store. Those of the model knowledge bases were first indexed
+    with stay where they always were, so they are not embedded again.
 
     Args:
         knowledge_base_name (str): The name of the knowledge base.
+        persist_directory_root (str, optional): The root directory of the vector stores. Defaults to settings.VECTORSTORE_CHROMADB_DIR.
+        backend (str, optional): The vector store backend, "chroma" or "numpy". Defaults to settings.VECTORSTORE_BACKEND.
+        embeddings_model (Optional[str], optional): The embedding model of the vector store. Defaults to that of settings.EMBEDDING_PROVIDER.
 
-    Raises:
-        FileNotFoundError: If the vector store directory does not exist.
+    Returns:
+        str: The persist directory.
+    """  # noqa
+    persist_directory = path.join(
+        persist_directory_root, format_knowledge_base_name(knowledge_base_name)
+    )
+    embeddings_model = embeddings_model or get_embeddings_cache_model()
+    if embeddings_model != LEGACY_EMBEDDINGS_MODEL:
+        persist_directory = path.join(persist_directory, embeddings_model)
+    if backend == "numpy":
+        # Keep each backend's collection, and the BM25 index next to it, apart
+        persist_directory = path.join(persist_directory, "numpy")
+    return persist_directory
+
+
+def delete_vectorstore(
+    knowledge_base_name: str,
+    persist_directory_root: str = settings.VECTORSTORE_CHROMADB_DIR,
+    backend: str = settings.VECTORSTORE_BACKEND,
+) -> None:
     """
-    formatted_kb_name = format_knowledge_base_name(knowledge_base_name)
-    persist_directory = path.join(settings.VECTORSTORE_CHROMADB_DIR, formatted_kb_name)
+    Deletes the vector store collection, and its BM25 index, for a given knowledge
+    base name.
 
-    Chroma(
-        collection_name=formatted_kb_name,
-        embedding_function=OpenAIEmbeddings(api_key=settings.OPENAI_API_KEY),
+    Args:
+        knowledge_base_name (str): The name of the knowledge base.
+        persist_directory_root (str, optional): The root directory of the vector stores. Defaults to settings.VECTORSTORE_CHROMADB_DIR.
+        backend (str, optional): The vector store backend, "chroma" or "numpy". Defaults to settings.VECTORSTORE_BACKEND.
+    """  # noqa
+    persist_directory = get_persist_directory(
+        knowledge_base_name, persist_directory_root, backend
+    )
+    vectorstore_registry.delete_collection(
         persist_directory=persist_directory,
-    ).delete_collection()
+        collection_name=format_knowledge_base_name(knowledge_base_name),
+        backend=backend,
+    )
+    delete_bm25_index(persist_directory)
+
+
+def delete_knowledge_base_vectorstores(
+    knowledge_base_name: str,
+    persist_directory_root: str = settings.VECTORSTORE_CHROMADB_DIR,
+) -> None:
+    """
+    Deletes the vector store collections, and their BM25 indexes, of a knowledge
+    base for every embedding model and backend, so none of them reappear if a
+    knowledge base of the same name is created again.
+
+    Args:
+        knowledge_base_name (str): The name of the knowledge base.
+        persist_directory_root (str, optional): The root directory of the vector stores. Defaults to settings.VECTORSTORE_CHROMADB_DIR.
+    """  # noqa
+    collection_name = format_knowledge_base_name(knowledge_base_name)
+    knowledge_base_directory = path.join(persist_directory_root, collection_name)
+    if not path.isdir(knowledge_base_directory):
+        return
+    # The stores of the legacy model, then those of every other model, which sit
+    # among ChromaDB's own segment directories
+    model_directories = [knowledge_base_directory] + [
+        path.join(knowledge_base_directory, entry)
+        for entry in sorted(os.listdir(knowledge_base_directory))
+        if path.isdir(path.join(knowledge_base_directory, entry))
+    ]
+    for model_directory in model_directories:
+        for persist_directory, backend in (
+            (model_directory, "chroma"),
+            (path.join(model_directory, "numpy"), "numpy"),
+        ):
+            if backend == "chroma" and not path.exists(
+                path.join(persist_directory, CHROMA_DATABASE_FILENAME)
+            ):
+                continue
+            if backend == "numpy" and not path.isdir(persist_directory):
+                continue
+            vectorstore_registry.delete_collection(
+                persist_directory=persist_directory,
+                collection_name=collection_name,
+                backend=backend,
+            )
+            vectorstore_registry.invalidate(persist_directory, collection_name)
+            delete_bm25_index(persist_directory)
+    logger.debug(
+        "vectorstore.delete_knowledge_base",
+        knowledge_base_name=knowledge_base_name,
+    )
 
 
 def create_vectorstore(
@@ -49,7 +309,8 @@ def create_vectorstore(
     embeddings: Embeddings,
     knowledge_base_name: str,
     persist_directory_root: str = settings.VECTORSTORE_CHROMADB_DIR,
-) -> Chroma:
+    backend: str = settings.VECTORSTORE_BACKEND,
+) -> VectorStore:
     """
     Create a vector store using the given documents, embeddings, knowledge base name, and persist directory.
 
@@ -58,24 +319,38 @@ def create_vectorstore(
         embeddings (Embeddings): The embeddings to use for creating the vector store.
         knowledge_base_name (str): The name of the knowledge base for the vector store.
         persist_directory_root (str, optional): The root directory for persisting the vector store. Defaults to settings.VECTORSTORE_CHROMADB_DIR.
+        backend (str, optional): The vector store backend, "chroma" or "numpy". Defaults to settings.VECTORSTORE_BACKEND.
 
     Returns:
-        Chroma: The vector store object.
+        VectorStore: The vector store object.
     """  # noqa
     knowledge_base_name = format_knowledge_base_name(knowledge_base_name)
-    persist_directory = path.join(persist_directory_root, knowledge_base_name)
+    persist_directory = get_persist_directory(
+        knowledge_base_name, persist_directory_root, backend
+    )
     logger.debug(
         "vectorstore.chroma.create",
         persist_directory=persist_directory,
         knowledge_base_name=knowledge_base_name,
         embeddings=embeddings,
     )
-    vectorstore = Chroma.from_documents(
-        collection_name=knowledge_base_name,
-        documents=documents,
-        embedding=embeddings,
-        persist_directory=persist_directory,
-    )
+    if backend == "numpy":
+        vectorstore = NumpyVectorStore.from_documents(
+            collection_name=knowledge_base_name,
+            documents=documents,
+            embedding=embeddings,
+            persist_directory=persist_directory,
+        )
+    else:
+        vectorstore = Chroma.from_documents(
+            collection_name=knowledge_base_name,
+            documents=documents,
+            embedding=embeddings,
+            persist_directory=persist_directory,
+            client=vectorstore_registry.get_client(persist_directory),
+        )
+    # The documents may have been added to an existing collection
+    vectorstore_registry.invalidate(persist_directory, knowledge_base_name)
     if persist_directory:
         vectorstore.persist()
         logger.debug(
@@ -86,11 +361,54 @@ def create_vectorstore(
     return vectorstore
 
 
+def upsert_documents(
+    vectorstore: VectorStore,
+    documents: Iterable[Tuple[str, Document]],
+    batch_size: int = settings.VECTORSTORE_UPSERT_BATCH_SIZE,
+) -> int:
+    """
+    Embeds and adds documents to a vector store in fixed-size batches.
+
+    The documents are pulled lazily, so a generator feeding this function only runs
+    ahead of the vector store by a single batch.
+
+    Args:
+        vectorstore (VectorStore): The vector store to add the documents to.
+        documents (Iterable[Tuple[str, Document]]): The IDs and documents to add.
+        batch_size (int, optional): The number of documents per batch. Defaults to settings.VECTORSTORE_UPSERT_BATCH_SIZE.
+
+    Returns:
+        int: The number of documents added.
+    """  # noqa
+    added = 0
+    batch: list[Tuple[str, Document]] = []
+
+    def flush() -> None:
+        nonlocal added
+        vectorstore.add_documents(
+            documents=[document for _, document in batch],
+            ids=[document_id for document_id, _ in batch],
+        )
+        added += len(batch)
+        logger.debug("vectorstore.upsert.batch", size=len(batch), added=added)
+        batch.clear()
+
+    for document_id, document in documents:
+        batch.append((document_id, document))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return added
+
+
+@timed("vectorstore.load")
 def get_vectorstore(
     knowledge_base_name: str,
     embeddings: Embeddings,
     persist_directory: str,
-) -> Chroma:
+    backend: str = settings.VECTORSTORE_BACKEND,
+) -> VectorStore:
     """
     Get a vector store for a given knowledge base.
 
@@ -98,43 +416,58 @@ def get_vectorstore(
         knowledge_base_name (str): The name of the knowledge base.
         embeddings (Embeddings): The embeddings to use for vectorization.
         persist_directory (str): The directory to persist the vector store.
+        backend (str, optional): The vector store backend, "chroma" or "numpy". Defaults to settings.VECTORSTORE_BACKEND.
 
     Returns:
-        Chroma: The vector store object.
-    """
+        VectorStore: The vector store object.
+    """  # noqa
     logger.debug(
         "vectorstore.chroma.load",
         persist_directory=persist_directory,
         knowledge_base_name=knowledge_base_name,
     )
+    if backend == "numpy":
+        return NumpyVectorStore(
+            collection_name=knowledge_base_name,
+            embedding_function=embeddings,
+            persist_directory=persist_directory,
+        )
     return Chroma(
         collection_name=knowledge_base_name,
         embedding_function=embeddings,
         persist_directory=persist_directory,
+        client=vectorstore_registry.get_client(persist_directory),
     )
 
 
-def vectorstore_exists(knowledge_base_name: str) -> bool:
+@timed("vectorstore.exists")
+def vectorstore_exists(
+    knowledge_base_name: str,
+    persist_directory_root: str = settings.VECTORSTORE_CHROMADB_DIR,
+    backend: str = settings.VECTORSTORE_BACKEND,
+) -> bool:
     """
-    Check if the vector store for a given knowledge base exists.
+    Check if the vector store for a given knowledge base holds chunks or was
+    indexed in this process, even if its documents yielded none.
+
+    The answer comes from the vector store registry, so only the first lookup of a
+    knowledge base touches disk.
 
     Args:
         knowledge_base_name (str): The name of the knowledge base.
+        persist_directory_root (str, optional): The root directory of the vector stores. Defaults to settings.VECTORSTORE_CHROMADB_DIR.
+        backend (str, optional): The vector store backend, "chroma" or "numpy". Defaults to settings.VECTORSTORE_BACKEND.
 
     Returns:
         bool: True if the vector store exists, False otherwise.
-    """
-    formatted_kb_name = format_knowledge_base_name(knowledge_base_name)
-    persist_directory = path.join(settings.VECTORSTORE_CHROMADB_DIR, formatted_kb_name)
-
-    vectorstore_exists = False
-    try:
-        chromadb.PersistentClient(path=persist_directory).get_collection(
-            name=formatted_kb_name
-        )
-        vectorstore_exists = True
-    except ValueError:
-        pass
+    """  # noqa
+    persist_directory = get_persist_directory(
+        knowledge_base_name, persist_directory_root, backend
+    )
+    collection_name = format_knowledge_base_name(knowledge_base_name)
+    vectorstore_exists = vectorstore_registry.count(
+        persist_directory, collection_name, backend
+    ) > 0 or vectorstore_registry.is_indexed(persist_directory, collection_name)
 
     logger.debug(
         "vectorstore.chroma.exists",
@@ -145,15 +478,102 @@ def vectorstore_exists(knowledge_base_name: str) -> bool:
     return vectorstore_exists
 
 
+class TokenBudgetRetriever(BaseRetriever):
+    """
+    Wraps a retriever and trims what it returns to a token budget, so fewer
+    irrelevant tokens are sent with each request.
+
+    With context packing, near-duplicates are dropped, `max_documents` are selected
+    for diversity and overlapping chunks are merged before trimming, see
+    `pack_context`.
+
+    Attributes:
+        retriever (BaseRetriever): The wrapped retriever.
+        max_tokens (int): The token budget of the retrieved documents.
+        model (str): The model whose tokenizer measures the documents.
+        context_packing (bool): Whether to pack the documents before trimming.
+        max_documents (int): The number of documents to select when packing.
+        embeddings (Optional[Embeddings]): The embeddings for diversity selection when packing.
+    """  # noqa
+
+    retriever: BaseRetriever
+    max_tokens: int
+    model: str
+    context_packing: bool = False
+    max_documents: int = settings.VECTORSTORE_MAX_DOCUMENTS
+    embeddings: Optional[Embeddings] = None
+
+    @timed("vectorstore.retrieve.pack")
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        documents = self.retriever.get_relevant_documents(
+            query, callbacks=run_manager.get_child()
+        )
+        if self.context_packing:
+            return pack_context(
+                query=query,
+                documents=documents,
+                max_tokens=self.max_tokens,
+                model=self.model,
+                max_documents=self.max_documents,
+                embeddings=self.embeddings,
+            )
+        return pack_documents(documents, self.max_tokens, self.model)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuses the rankings of several retrievers with weighted reciprocal rank fusion.
+
+    A document scores `weight / (rrf_k + rank)` in every ranking it appears in, so
+    documents ranked highly by either the dense or the keyword retriever surface,
+    and documents found by both rise to the top.
+
+    Attributes:
+        retrievers (list[BaseRetriever]): The retrievers whose rankings are fused.
+        weights (list[float]): The weight of each retriever.
+        k (int): The number of documents to return.
+        rrf_k (int): Dampens the influence of the top ranks.
+    """  # noqa
+
+    retrievers: list[BaseRetriever]
+    weights: list[float]
+    k: int = settings.VECTORSTORE_MAX_DOCUMENTS
+    rrf_k: int = settings.VECTORSTORE_RRF_K
+
+    @timed("vectorstore.retrieve.hybrid")
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        scores: dict[str, float] = {}
+        documents: dict[str, Document] = {}
+        for retriever, weight in zip(self.retrievers, self.weights):
+            ranking = retriever.get_relevant_documents(
+                query, callbacks=run_manager.get_child()
+            )
+            for rank, document in enumerate(ranking, start=1):
+                key = document.metadata.get("chunk_id") or document.page_content
+                documents.setdefault(key, document)
+                scores[key] = scores.get(key, 0.0) + weight / (self.rrf_k + rank)
+        ranked = sorted(scores, key=scores.__getitem__, reverse=True)
+        return [documents[key] for key in ranked[: self.k]]
+
+
 def get_vectorstore_retriever(
     documents: list[Document],
     embeddings: Embeddings,
     knowledge_base_name: str,
     max_documents: int = settings.VECTORSTORE_MAX_DOCUMENTS,
     persist_directory_root: str = settings.VECTORSTORE_CHROMADB_DIR,
-) -> VectorStoreRetriever:
+    max_tokens: Optional[int] = None,
+    model: str = settings.EMBEDDING_MODEL,
+    retrieval_mode: str = settings.VECTORSTORE_RETRIEVAL_MODE,
+    backend: str = settings.VECTORSTORE_BACKEND,
+    context_packing: bool = settings.VECTORSTORE_CONTEXT_PACKING,
+) -> BaseRetriever:
     """
-    Retrieves a VectorStoreRetriever object for a given set of documents and embeddings.
+    Retrieves a retriever for a given set of documents and embeddings.
 
     Args:
         documents (list[Document]): The list of documents to be used for creating the vector store.
@@ -161,20 +581,28 @@ def get_vectorstore_retriever(
         knowledge_base_name (str, optional): The name of the knowledge base. Defaults to "illiana".
         max_documents (int, optional): The maximum number of documents to retrieve. Defaults to 5.
         persist_directory_root (str, optional): The root directory for persisting the vector store. Defaults to settings.VECTORSTORE_CHROMADB_DIR.
+        max_tokens (Optional[int], optional): The token budget of the retrieved documents. Unlimited if not given.
+        model (str, optional): The model whose tokenizer measures the token budget. Defaults to settings.EMBEDDING_MODEL.
+        retrieval_mode (str, optional): "dense" for vector search only, or "hybrid" to fuse it with BM25 keyword search. Defaults to settings.VECTORSTORE_RETRIEVAL_MODE.
+        backend (str, optional): The vector store backend, "chroma" or "numpy". Defaults to settings.VECTORSTORE_BACKEND.
+        context_packing (bool, optional): Whether to pack the retrieved documents within the token budget, from more candidates. Defaults to settings.VECTORSTORE_CONTEXT_PACKING.
 
     Returns:
-        VectorStoreRetriever: The VectorStoreRetriever object.
+        BaseRetriever: The retriever.
 
     """  # noqa
     # ChromaDB does not support spaces in the knowledge base name
     knowledge_base_name = format_knowledge_base_name(knowledge_base_name)
-    persist_directory = path.join(persist_directory_root, knowledge_base_name)
-    vectorstore: Chroma = None
+    persist_directory = get_persist_directory(
+        knowledge_base_name, persist_directory_root, backend
+    )
+    vectorstore: VectorStore = None
     if not documents:
         vectorstore = get_vectorstore(
             knowledge_base_name=knowledge_base_name,
             embeddings=embeddings,
             persist_directory=persist_directory,
+            backend=backend,
         )
     else:
         vectorstore = create_vectorstore(
@@ -182,6 +610,41 @@ def get_vectorstore_retriever(
             embeddings=embeddings,
             knowledge_base_name=knowledge_base_name,
             persist_directory_root=persist_directory_root,
+            backend=backend,
         )
 
-    return vectorstore.as_retriever(search_kwargs={"k": max_documents})
+    context_packing = context_packing and max_tokens is not None
+    # Packing selects among more candidates than it keeps
+    candidates = (
+        max(max_documents, settings.VECTORSTORE_PACKING_FETCH_K)
+        if context_packing
+        else max_documents
+    )
+    bm25_index = (
+        get_bm25_index(persist_directory) if retrieval_mode == "hybrid" else None
+    )
+    if bm25_index is not None and len(bm25_index) > 0:
+        fetch_k = max(candidates, settings.VECTORSTORE_HYBRID_FETCH_K)
+        retriever = HybridRetriever(
+            retrievers=[
+                vectorstore.as_retriever(search_kwargs={"k": fetch_k}),
+                BM25Retriever(index=bm25_index, k=fetch_k),
+            ],
+            weights=[
+                settings.VECTORSTORE_HYBRID_DENSE_WEIGHT,
+                settings.VECTORSTORE_HYBRID_SPARSE_WEIGHT,
+            ],
+            k=candidates,
+        )
+    else:
+        retriever = vectorstore.as_retriever(search_kwargs={"k": candidates})
+    if max_tokens is None:
+        return retriever
+    return TokenBudgetRetriever(
+        retriever=retriever,
+        max_tokens=max_tokens,
+        model=model,
+        context_packing=context_packing,
+        max_documents=max_documents,
+        embeddings=embeddings,
+    )
@@ -1,7 +1,13 @@
 from .attributes import Attribute, Attributes  # noqa
 from .game_data import GameData  # noqa
 from .knowledge_base import (  # noqa
+    DocumentData,
     KnowledgeBase,
+    KnowledgeBaseData,
     KnowledgeBaseDocument,
     KnowledgeBaseHelper,
 )
+from .knowledge_base_catalog import (  # noqa
+    KnowledgeBaseCatalog,
+    load_knowledge_base,
+)
@@ -1,21 +1,54 @@
 import json
+import mmap
 import os
 import shutil
-from typing import Optional
-
-from pydantic import BaseModel, RootModel, StrictBool, StrictInt, StrictStr
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator, Mapping, Optional, Tuple
+
+from pydantic import (
+    BaseModel,
+    PrivateAttr,
+    RootModel,
+    StrictBool,
+    StrictFloat,
+    StrictInt,
+    StrictStr,
+)
 
 from app.core.config import settings
+from app.core.hashing import copy_file
 from app.core.log import logger
-from app.core.vectorstore import delete_vectorstore
+from app.core.vectorstore import delete_knowledge_base_vectorstores
 
 
 class KnowledgeBaseDocument(BaseModel):
+    """
+    A document of a knowledge base.
+
+    Attributes:
+        Type (str): The type of the document.
+        Filepath (str): The path to the copy of the document in the knowledge base directory.
+        Size (int): The size of the file in bytes.
+        Loaded (bool): Whether the document has been loaded.
+        Uri (Optional[str]): The URI the document was imported from.
+        Hash (Optional[str]): The hash of the file when it was last indexed, to tell whether it changed since.
+        ContentHash (Optional[str]): The hash of the file computed while importing it, which saves hashing it again as long as it is unchanged.
+        Modified (Optional[float]): The modification time of the file when ContentHash was computed.
+        Chunks (Optional[int]): The number of chunks the document was split into when it was last indexed.
+        Indexed (Optional[float]): When the document was last indexed.
+    """  # noqa
+
     Type: StrictStr
     Filepath: StrictStr
     Size: StrictInt
     Loaded: StrictBool
     Uri: Optional[StrictStr] = None
+    Hash: Optional[StrictStr] = None
+    ContentHash: Optional[StrictStr] = None
+    Modified: Optional[StrictFloat] = None
+    Chunks: Optional[StrictInt] = None
+    Indexed: Optional[StrictFloat] = None
 
 
 class KnowledgeBase(RootModel):
@@ -29,6 +62,9 @@ class KnowledgeBase(RootModel):
 
     root: dict[str, dict[str, KnowledgeBaseDocument]]
 
+    _batch_depth: int = PrivateAttr(default=0)
+    _dirty: bool = PrivateAttr(default=False)
+
     @classmethod
     def load(cls, file_path: str = settings.KNOWLEDGE_BASE_FILEPATH) -> "KnowledgeBase":
         """
@@ -48,11 +84,112 @@ class KnowledgeBase(RootModel):
         """
         Dump the knowledge base to a file.
 
+        The knowledge base is written to a temporary file next to the target, which
+        then atomically replaces it, so a crash mid-write never leaves a truncated
+        file behind.
+
         Args:
             file_path (str): The file path to dump the knowledge base. Defaults to the value specified in the settings.
         """  # noqa
-        with open(file_path, "w") as f:
+        temp_file_path = f"{file_path}.tmp"
+        with open(temp_file_path, "w") as f:
             json.dump(self.model_dump(), f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file_path, file_path)
+        self._dirty = False
+
+    def save(self) -> None:
+        """
+        Persist the knowledge base, deferring the write until the outermost batch
+        exits when called inside `batch()`.
+        """
+        if self._batch_depth:
+            self._dirty = True
+        else:
+            self.dump()
+
+    @contextmanager
+    def batch(self) -> Iterator["KnowledgeBase"]:
+        """
+        Groups several mutations into a single write of the knowledge base file.
+
+        Batches can be nested; the knowledge base is written once, when the
+        outermost batch exits, and only if it was changed. It is written even if the
+        batch raises, so mutations made before the error are not lost.
+
+        Yields:
+            KnowledgeBase: The knowledge base.
+        """  # noqa
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._dirty:
+                self.dump()
+
+    def get_knowledge_base_names(self) -> list[str]:
+        """
+        Get the names of the knowledge bases.
+
+        Returns:
+            list[str]: The knowledge base names.
+        """
+        return list(self.root.keys())
+
+    def has_knowledge_base(self, knowledge_base_name: str) -> bool:
+        """
+        Check whether a knowledge base exists.
+
+        Args:
+            knowledge_base_name (str): The name of the knowledge base.
+
+        Returns:
+            bool: Whether the knowledge base exists.
+        """
+        return knowledge_base_name in self.root
+
+    def get_documents(
+        self, knowledge_base_name: str
+    ) -> dict[str, KnowledgeBaseDocument]:
+        """
+        Get the documents of a knowledge base.
+
+        Args:
+            knowledge_base_name (str): The name of the knowledge base.
+
+        Returns:
+            dict[str, KnowledgeBaseDocument]: The documents keyed by document name.
+
+        Raises:
+            KeyError: If the knowledge base does not exist.
+        """
+        return self.root[knowledge_base_name]
+
+    def add_knowledge_base(self, knowledge_base_name: str) -> None:
+        """
+        Add an empty knowledge base, if it does not exist yet.
+
+        Args:
+            knowledge_base_name (str): The name of the knowledge base.
+        """
+        if knowledge_base_name not in self.root:
+            self.root[knowledge_base_name] = {}
+            self.save()
+
+    def delete_knowledge_base(self, knowledge_base_name: str) -> None:
+        """
+        Delete a knowledge base along with its documents.
+
+        Args:
+            knowledge_base_name (str): The name of the knowledge base.
+
+        Raises:
+            KeyError: If the knowledge base does not exist.
+        """
+        del self.root[knowledge_base_name]
+        self.save()
 
     def add(
         self,
@@ -71,7 +208,7 @@ class KnowledgeBase(RootModel):
         if knowledge_base_name not in self.root:
             self.root[knowledge_base_name] = {}
         self.root[knowledge_base_name][document_name] = document
-        self.dump()
+        self.save()
 
     def update(
         self,
@@ -92,7 +229,7 @@ class KnowledgeBase(RootModel):
         """
         if document_name in self.root[knowledge_base_name]:
             self.root[knowledge_base_name][document_name] = document
-            self.dump()
+            self.save()
         else:
             raise KeyError(f"No attribute found with key: {document_name}")
 
@@ -106,7 +243,96 @@ class KnowledgeBase(RootModel):
         """
         if knowledge_base_name in self.root:
             self.root[knowledge_base_name].pop(document_name)
-            self.dump()
+            self.save()
+
+
+class DocumentData(Mapping[str, bytes]):
+    """
+    Read-only view of the raw bytes of the documents of a single knowledge base.
+
+    Only the document metadata is held in memory; a document's bytes are read from
+    disk when it is accessed, so membership checks and iteration only check that
+    the files exist. Documents whose file is missing are left out of the view.
+
+    Args:
+        documents (dict[str, KnowledgeBaseDocument]): The documents of the knowledge base.
+    """  # noqa
+
+    def __init__(self, documents: dict[str, KnowledgeBaseDocument]):
+        self.documents = documents
+
+    def __getitem__(self, document_name: str) -> bytes:
+        with self.open(document_name) as data:
+            return bytes(data)
+
+    def __iter__(self) -> Iterator[str]:
+        return (name for name in self.documents if name in self)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __contains__(self, document_name: object) -> bool:
+        document = self.documents.get(document_name)
+        return document is not None and os.path.isfile(document.Filepath)
+
+    @contextmanager
+    def open(self, document_name: str) -> Iterator[memoryview]:
+        """
+        Memory-maps a document so it can be read without loading it into memory.
+
+        Args:
+            document_name (str): The name of the document.
+
+        Yields:
+            memoryview: A read-only view of the document's bytes.
+
+        Raises:
+            KeyError: If the document is not in the knowledge base or its file is missing.
+        """  # noqa
+        if document_name not in self:
+            raise KeyError(document_name)
+        try:
+            file = open(self.documents[document_name].Filepath, "rb")
+        except FileNotFoundError:
+            raise KeyError(document_name)
+        with file:
+            if os.fstat(file.fileno()).st_size == 0:
+                # Empty files cannot be memory-mapped
+                yield memoryview(b"")
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+
+class KnowledgeBaseData(Mapping[str, DocumentData]):
+    """
+    Read-only view of the raw bytes of every document, keyed by knowledge base name.
+
+    The view reflects the knowledge base as it changes, so it never needs to be
+    reloaded or kept in sync.
+
+    Args:
+        knowledge_base (KnowledgeBase | KnowledgeBaseCatalog): The knowledge base object.
+    """  # noqa
+
+    def __init__(self, knowledge_base: KnowledgeBase):
+        self.knowledge_base = knowledge_base
+
+    def __getitem__(self, knowledge_base_name: str) -> DocumentData:
+        return DocumentData(self.knowledge_base.get_documents(knowledge_base_name))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.knowledge_base.get_knowledge_base_names())
+
+    def __len__(self) -> int:
+        return len(self.knowledge_base.get_knowledge_base_names())
+
+    def __contains__(self, knowledge_base_name: object) -> bool:
+        return self.knowledge_base.has_knowledge_base(knowledge_base_name)
 
 
 class KnowledgeBaseHelper:
@@ -114,43 +340,25 @@ class KnowledgeBaseHelper:
     Helper class for managing knowledge base operations.
 
     Args:
-        knowledge_base (KnowledgeBase): The knowledge base object.
+        knowledge_base (KnowledgeBase | KnowledgeBaseCatalog): The knowledge base object, backed by the JSON file or the SQLite catalog.
 
     Attributes:
-        knowledge_base (KnowledgeBase): The knowledge base object.
-        document_data (dict[str, dict[str, bytes]]): A dictionary containing the loaded document data.
+        knowledge_base (KnowledgeBase | KnowledgeBaseCatalog): The knowledge base object.
+        document_data (KnowledgeBaseData): A lazy view of the document data, read from disk on access.
 
     Methods:
-        _load_document_data(): Loads the document data from the knowledge base.
         add_new_knowledge_base(knowledge_base_name: str): Adds a new knowledge base.
         add_document(knowledge_base_name: str, document_name: str, incoming_filename: str, outgoing_filename: str): Adds a document to the knowledge base.
+        add_documents(knowledge_base_name: str, documents: list[Tuple[str, str, str]]): Adds several documents to the knowledge base concurrently.
         delete_document(knowledge_base_name: str, document_name: str): Deletes a document from the knowledge base.
         _delete_document_from_disk(filepath: str): Deletes a document file from disk.
     """  # noqa
 
     def __init__(self, knowledge_base: KnowledgeBase):
         self.knowledge_base = knowledge_base
-        self.document_data: dict[str, dict[str, bytes]] = self._load_document_data()
+        self.document_data = KnowledgeBaseData(knowledge_base)
 
-    def _load_document_data(self) -> dict[str, dict[str, bytes]]:
-        """
-        Loads the document data from the knowledge base.
-
-        Returns:
-            dict[str, dict[str, bytes]]: A dictionary containing the loaded document data.
-        """
-        document_data: dict[str, dict[str, bytes]] = {}
-        for knowledge_base_name, documents in self.knowledge_base.root.items():
-            document_data[knowledge_base_name] = {}
-            for document_name, document in documents.items():
-                try:
-                    with open(document.Filepath, "rb") as file:
-                        document_data[knowledge_base_name][document_name] = file.read()
-                except Exception as e:
-                    logger.error(f"Error loading document '{document_name}': {str(e)}")
-        return document_data
-
-    def get_document_data(self, knowledge_base_name: str) -> dict[str, bytes]:
+    def get_document_data(self, knowledge_base_name: str) -> DocumentData:
         """
         Retrieves the document data for a given knowledge base.
 
@@ -158,7 +366,7 @@ class KnowledgeBaseHelper:
             knowledge_base_name (str): The name of the knowledge base.
 
         Returns:
-            dict[str, bytes]: The document data.
+            DocumentData: The document data, read from disk on access.
         """
         return self.document_data[knowledge_base_name]
 
@@ -172,67 +380,113 @@ class KnowledgeBaseHelper:
         Returns:
             None
         """
-        if knowledge_base_name not in self.knowledge_base.root:
-            self.knowledge_base.root[knowledge_base_name] = {}
-            self.knowledge_base.dump()
+        self.knowledge_base.add_knowledge_base(knowledge_base_name)
 
-    def add_document(
+    def _import_document(
         self,
-        knowledge_base_name: str,
         document_name: str,
         incoming_filename: str,
         outgoing_filename: str,
-    ):
+    ) -> Optional[KnowledgeBaseDocument]:
         """
-        Adds a document to the knowledge base.
+        Copies a document into the knowledge base directory, without registering it.
 
         Args:
-            knowledge_base_name (str): The name of the knowledge base.
             document_name (str): The name of the document.
             incoming_filename (str): The path to the incoming file.
             outgoing_filename (str): The path to the outgoing file.
 
         Returns:
-            None
-        """
+            Optional[KnowledgeBaseDocument]: The imported document, or None if the copy failed.
+        """  # noqa
         try:
             os.makedirs(os.path.dirname(outgoing_filename), exist_ok=True)
-            with open(incoming_filename, "rb") as incoming_file:
-                with open(outgoing_filename, "wb") as outgoing_file:
-                    file_bytes: bytes = incoming_file.read()
-                    outgoing_file.write(file_bytes)
-                    document = KnowledgeBaseDocument(
-                        Type="Document",
-                        Filepath=outgoing_filename,
-                        Size=len(file_bytes),
-                        Loaded=False,
-                    )
-                    self.knowledge_base.add(
-                        knowledge_base_name, document_name, document
-                    )
-                    if knowledge_base_name not in self.document_data:
-                        self.document_data[knowledge_base_name] = {}
-                    self.document_data[knowledge_base_name][document_name] = file_bytes
-                    logger.debug(
-                        "knowledge.add_document.success",
-                        knowledge_base_name=knowledge_base_name,
-                        document_name=document_name,
-                        document=document,
-                    )
-        except FileNotFoundError as e:
-            logger.error(
-                "knowledge.add_document.failure",
-                file_path=outgoing_filename,
-                document_name=document_name,
-                exception=e,
-            )
+            # Stream the copy so large documents are never held in memory
+            size, content_hash = copy_file(incoming_filename, outgoing_filename)
+            modified = os.stat(outgoing_filename).st_mtime
         except IOError as e:
             logger.error(
                 "knowledge.add_document.failure",
                 file_path=outgoing_filename,
-                exception=e,
                 document_name=document_name,
+                exception=str(e),
             )
+            return None
+        return KnowledgeBaseDocument(
+            Type="Document",
+            Filepath=outgoing_filename,
+            Size=size,
+            Loaded=False,
+            ContentHash=content_hash,
+            Modified=modified,
+        )
+
+    def add_document(
+        self,
+        knowledge_base_name: str,
+        document_name: str,
+        incoming_filename: str,
+        outgoing_filename: str,
+    ):
+        """
+        Adds a document to the knowledge base.
+
+        Args:
+            knowledge_base_name (str): The name of the knowledge base.
+            document_name (str): The name of the document.
+            incoming_filename (str): The path to the incoming file.
+            outgoing_filename (str): The path to the outgoing file.
+
+        Returns:
+            None
+        """
+        self.add_documents(
+            knowledge_base_name,
+            [(document_name, incoming_filename, outgoing_filename)],
+            max_workers=1,
+        )
+
+    def add_documents(
+        self,
+        knowledge_base_name: str,
+        documents: list[Tuple[str, str, str]],
+        max_workers: int = settings.KNOWLEDGE_BASE_IMPORT_MAX_WORKERS,
+    ) -> None:
+        """
+        Adds several documents to the knowledge base, copying them concurrently.
+
+        The copies run in a thread pool, while the documents are registered with the
+        knowledge base one at a time, in the given order, once their copy is done.
+
+        Args:
+            knowledge_base_name (str): The name of the knowledge base.
+            documents (list[Tuple[str, str, str]]): The document name, incoming path and outgoing path of each document.
+            max_workers (int, optional): The number of concurrent copies. Defaults to settings.KNOWLEDGE_BASE_IMPORT_MAX_WORKERS.
+
+        Returns:
+            None
+        """  # noqa
+        if max_workers <= 1 or len(documents) <= 1:
+            imported = [self._import_document(*document) for document in documents]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                imported = list(
+                    executor.map(
+                        lambda document: self._import_document(*document), documents
+                    )
+                )
+
+        with self.knowledge_base.batch():
+            for (document_name, _, _), document in zip(documents, imported):
+                if document is None:
+                    continue
+                self.knowledge_base.add(knowledge_base_name, document_name, document)
+                logger.debug(
+                    "knowledge.add_document.success",
+                    knowledge_base_name=knowledge_base_name,
+                    document_name=document_name,
+                    document=document,
+                )
 
     def delete_document(self, knowledge_base_name: str, document_name: str) -> None:
         """
@@ -245,11 +499,11 @@ class KnowledgeBaseHelper:
         Returns:
             None
         """
-        if document_name in self.knowledge_base.root[knowledge_base_name]:
-            document = self.knowledge_base.root[knowledge_base_name][document_name]
+        documents = self.knowledge_base.get_documents(knowledge_base_name)
+        if document_name in documents:
+            document = documents[document_name]
             self._delete_document_from_disk(document.Filepath)
             self.knowledge_base.remove(knowledge_base_name, document_name)
-            self.document_data[knowledge_base_name].pop(document_name, None)
         else:
             logger.warning(
                 "knowledge.delete_document.no_file",
@@ -272,8 +526,8 @@ class KnowledgeBaseHelper:
         Raises:
             KeyError: If the knowledge base does not exist.
         """  # noqa
-        if knowledge_base_name in self.knowledge_base.root:
-            return self.knowledge_base.root[knowledge_base_name]
+        if self.knowledge_base.has_knowledge_base(knowledge_base_name):
+            return self.knowledge_base.get_documents(knowledge_base_name)
         else:
             raise KeyError(f"Knowledge base '{knowledge_base_name}' does not exist")
 
@@ -306,19 +560,17 @@ class KnowledgeBaseHelper:
         Raises:
             KeyError: If the knowledge base does not exist.
         """
-        if knowledge_base_name in self.knowledge_base.root:
-            document_names = list(self.knowledge_base.root[knowledge_base_name].keys())
-            for document_name in document_names:
-                self.delete_document(knowledge_base_name, document_name)
-
-            # Remove the knowledge base from the root
-            del self.knowledge_base.root[knowledge_base_name]
-
-            # Update the stored file
-            self.knowledge_base.dump()
-
-            # Remove the knowledge base from the document data
-            self.document_data.pop(knowledge_base_name, None)
+        if self.knowledge_base.has_knowledge_base(knowledge_base_name):
+            # Write the knowledge base once, rather than once per document
+            with self.knowledge_base.batch():
+                document_names = list(
+                    self.knowledge_base.get_documents(knowledge_base_name).keys()
+                )
+                for document_name in document_names:
+                    self.delete_document(knowledge_base_name, document_name)
+
+                # Remove the knowledge base itself
+                self.knowledge_base.delete_knowledge_base(knowledge_base_name)
 
             # Determine the root directory for the documents
             document_root_directory = os.path.join(
@@ -330,8 +582,8 @@ class KnowledgeBaseHelper:
             if os.path.exists(document_root_directory):
                 shutil.rmtree(document_root_directory)
 
-            # Remove the vector store from disk
-            delete_vectorstore(knowledge_base_name)
+            # Remove the vector stores of every embedding model from disk
+            delete_knowledge_base_vectorstores(knowledge_base_name)
 
             logger.debug(
                 "knowledge_base.delete.success", knowledge_base_name=knowledge_base_name
@@ -349,11 +601,15 @@ class KnowledgeBaseHelper:
         Returns:
             None
         """
-        if knowledge_base_name in self.knowledge_base.root:
-            documents = self.knowledge_base.root[knowledge_base_name]
-            for document in documents.values():
-                document.Loaded = True
-        self.knowledge_base.dump()
+        if self.knowledge_base.has_knowledge_base(knowledge_base_name):
+            documents = self.knowledge_base.get_documents(knowledge_base_name)
+            # Persist each document, including what indexing recorded on it
+            with self.knowledge_base.batch():
+                for document_name, document in documents.items():
+                    document.Loaded = True
+                    self.knowledge_base.update(
+                        knowledge_base_name, document_name, document
+                    )
 
     def get_documents(
         self, knowledge_base_name: str
@@ -367,7 +623,7 @@ class KnowledgeBaseHelper:
         Returns:
             dict[str, KnowledgeBaseDocument]: The documents within the specified knowledge base.
         """  # noqa
-        return self.knowledge_base.root[knowledge_base_name]
+        return self.knowledge_base.get_documents(knowledge_base_name)
 
     def get_knowledge_base_names(self) -> list[str]:
         """
@@ -376,4 +632,4 @@ class KnowledgeBaseHelper:
         Returns:
             list[str]: The knowledge base names.
         """
-        return sorted(list(self.knowledge_base.root.keys()))
+        return sorted(self.knowledge_base.get_knowledge_base_names())
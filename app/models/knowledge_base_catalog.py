@@ -0,0 +1,367 @@
+import os
+from contextlib import contextmanager
+from typing import Iterator, Optional, Union
+
+from sqlalchemy import UniqueConstraint
+from sqlmodel import Field, Session, SQLModel, create_engine, delete, select
+
+from app.core.config import settings
+from app.core.log import logger
+from app.models.knowledge_base import KnowledgeBase, KnowledgeBaseDocument
+
+
+class KnowledgeBaseRecord(SQLModel, table=True):
+    __tablename__ = "knowledge_base"
+
+    name: str = Field(primary_key=True)
+
+
+class DocumentRecord(SQLModel, table=True):
+    __tablename__ = "document"
+    __table_args__ = (UniqueConstraint("knowledge_base_name", "name"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    knowledge_base_name: str = Field(foreign_key="knowledge_base.name", index=True)
+    name: str
+    type: str
+    filepath: str
+    size: int
+    loaded: bool
+    uri: Optional[str] = None
+    hash: Optional[str] = None
+    content_hash: Optional[str] = None
+    modified: Optional[float] = None
+    chunks: Optional[int] = None
+    indexed: Optional[float] = None
+
+
+def _to_document(record: DocumentRecord) -> KnowledgeBaseDocument:
+    return KnowledgeBaseDocument(
+        Type=record.type,
+        Filepath=record.filepath,
+        Size=record.size,
+        Loaded=record.loaded,
+        Uri=record.uri,
+        Hash=record.hash,
+        ContentHash=record.content_hash,
+        Modified=record.modified,
+        Chunks=record.chunks,
+        Indexed=record.indexed,
+    )
+
+
+def _update_record(record: DocumentRecord, document: KnowledgeBaseDocument) -> None:
+    record.type = document.Type
+    record.filepath = document.Filepath
+    record.size = document.Size
+    record.loaded = document.Loaded
+    record.uri = document.Uri
+    record.hash = document.Hash
+    record.content_hash = document.ContentHash
+    record.modified = document.Modified
+    record.chunks = document.Chunks
+    record.indexed = document.Indexed
+
+
+class KnowledgeBaseCatalog:
+    """
+    SQLite catalog of knowledge bases and their documents.
+
+    Offers the same interface as `KnowledgeBase`, so it can back a
+    `KnowledgeBaseHelper`, but documents are looked up through an index instead of
+    parsing the whole catalog. Only the knowledge bases that are accessed are
+    loaded, and each is loaded once: `get_documents` keeps returning the same
+    objects, so changes made to them in place are persisted by `update`.
+
+    Args:
+        filepath (str, optional): The path to the SQLite database. Defaults to settings.KNOWLEDGE_BASE_CATALOG_FILEPATH.
+    """  # noqa
+
+    def __init__(self, filepath: str = settings.KNOWLEDGE_BASE_CATALOG_FILEPATH):
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.filepath = filepath
+        self.engine = create_engine(
+            f"sqlite:///{filepath}", connect_args={"check_same_thread": False}
+        )
+        SQLModel.metadata.create_all(
+            self.engine,
+            tables=[KnowledgeBaseRecord.__table__, DocumentRecord.__table__],
+        )
+        self._documents: dict[str, dict[str, KnowledgeBaseDocument]] = {}
+        self._session: Optional[Session] = None
+
+    @contextmanager
+    def _get_session(self) -> Iterator[Session]:
+        if self._session is not None:
+            yield self._session
+            return
+        with Session(self.engine) as session:
+            yield session
+            session.commit()
+
+    @contextmanager
+    def batch(self) -> Iterator["KnowledgeBaseCatalog"]:
+        """
+        Groups several mutations into a single transaction.
+
+        Batches can be nested; the transaction is committed when the outermost batch
+        exits. It is committed even if the batch raises, so mutations made before the
+        error are not lost, just like `KnowledgeBase.batch`.
+
+        Yields:
+            KnowledgeBaseCatalog: The catalog.
+        """  # noqa
+        if self._session is not None:
+            yield self
+            return
+        with Session(self.engine) as session:
+            self._session = session
+            try:
+                yield self
+            finally:
+                self._session = None
+                session.commit()
+
+    def save(self) -> None:
+        """
+        Kept for compatibility with `KnowledgeBase`; every mutation is already
+        persisted.
+        """
+
+    def get_knowledge_base_names(self) -> list[str]:
+        """
+        Get the names of the knowledge bases.
+
+        Returns:
+            list[str]: The knowledge base names.
+        """
+        with self._get_session() as session:
+            return list(session.exec(select(KnowledgeBaseRecord.name)).all())
+
+    def has_knowledge_base(self, knowledge_base_name: str) -> bool:
+        """
+        Check whether a knowledge base exists.
+
+        Args:
+            knowledge_base_name (str): The name of the knowledge base.
+
+        Returns:
+            bool: Whether the knowledge base exists.
+        """
+        if knowledge_base_name in self._documents:
+            return True
+        with self._get_session() as session:
+            return session.get(KnowledgeBaseRecord, knowledge_base_name) is not None
+
+    def get_documents(
+        self, knowledge_base_name: str
+    ) -> dict[str, KnowledgeBaseDocument]:
+        """
+        Get the documents of a knowledge base, loading them on first access.
+
+        Args:
+            knowledge_base_name (str): The name of the knowledge base.
+
+        Returns:
+            dict[str, KnowledgeBaseDocument]: The documents keyed by document name.
+
+        Raises:
+            KeyError: If the knowledge base does not exist.
+        """
+        if knowledge_base_name not in self._documents:
+            if not self.has_knowledge_base(knowledge_base_name):
+                raise KeyError(knowledge_base_name)
+            with self._get_session() as session:
+                records = session.exec(
+                    select(DocumentRecord)
+                    .where(DocumentRecord.knowledge_base_name == knowledge_base_name)
+                    .order_by(DocumentRecord.id)
+                ).all()
+                self._documents[knowledge_base_name] = {
+                    record.name: _to_document(record) for record in records
+                }
+        return self._documents[knowledge_base_name]
+
+    def add_knowledge_base(self, knowledge_base_name: str) -> None:
+        """
+        Add an empty knowledge base, if it does not exist yet.
+
+        Args:
+            knowledge_base_name (str): The name of the knowledge base.
+        """
+        if self.has_knowledge_base(knowledge_base_name):
+            return
+        with self._get_session() as session:
+            session.add(KnowledgeBaseRecord(name=knowledge_base_name))
+            session.flush()
+        self._documents[knowledge_base_name] = {}
+
+    def delete_knowledge_base(self, knowledge_base_name: str) -> None:
+        """
+        Delete a knowledge base along with its documents.
+
+        Args:
+            knowledge_base_name (str): The name of the knowledge base.
+
+        Raises:
+            KeyError: If the knowledge base does not exist.
+        """
+        if not self.has_knowledge_base(knowledge_base_name):
+            raise KeyError(knowledge_base_name)
+        with self._get_session() as session:
+            session.exec(
+                delete(DocumentRecord).where(
+                    DocumentRecord.knowledge_base_name == knowledge_base_name
+                )
+            )
+            session.exec(
+                delete(KnowledgeBaseRecord).where(
+                    KnowledgeBaseRecord.name == knowledge_base_name
+                )
+            )
+        self._documents.pop(knowledge_base_name, None)
+
+    def _get_record(
+        self, session: Session, knowledge_base_name: str, document_name: str
+    ) -> Optional[DocumentRecord]:
+        return session.exec(
+            select(DocumentRecord).where(
+                DocumentRecord.knowledge_base_name == knowledge_base_name,
+                DocumentRecord.name == document_name,
+            )
+        ).first()
+
+    def add(
+        self,
+        knowledge_base_name: str,
+        document_name: str,
+        document: KnowledgeBaseDocument,
+    ):
+        """
+        Add a document to the knowledge base, replacing any document of the same name.
+
+        Args:
+            knowledge_base_name (str): The name of the knowledge base.
+            document_name (str): The name of the document.
+            document (KnowledgeBaseDocument): The document to add.
+        """  # noqa
+        self.add_knowledge_base(knowledge_base_name)
+        with self._get_session() as session:
+            record = self._get_record(session, knowledge_base_name, document_name)
+            if record is None:
+                record = DocumentRecord(
+                    knowledge_base_name=knowledge_base_name,
+                    name=document_name,
+                    type=document.Type,
+                    filepath=document.Filepath,
+                    size=document.Size,
+                    loaded=document.Loaded,
+                )
+            _update_record(record, document)
+            session.add(record)
+            session.flush()
+        if knowledge_base_name in self._documents:
+            self._documents[knowledge_base_name][document_name] = document
+
+    def update(
+        self,
+        knowledge_base_name: str,
+        document_name: str,
+        document: KnowledgeBaseDocument,
+    ):
+        """
+        Update a document in the knowledge base.
+
+        Args:
+            knowledge_base_name (str): The name of the knowledge base.
+            document_name (str): The name of the document.
+            document (KnowledgeBaseDocument): The updated document.
+
+        Raises:
+            KeyError: If no document is found with the specified document name.
+        """
+        with self._get_session() as session:
+            record = self._get_record(session, knowledge_base_name, document_name)
+            if record is None:
+                raise KeyError(f"No attribute found with key: {document_name}")
+            _update_record(record, document)
+            session.add(record)
+            session.flush()
+        if knowledge_base_name in self._documents:
+            self._documents[knowledge_base_name][document_name] = document
+
+    def remove(self, knowledge_base_name: str, document_name: str):
+        """
+        Remove a document from the knowledge base.
+
+        Args:
+            knowledge_base_name (str): The name of the knowledge base.
+            document_name (str): The name of the document.
+        """
+        with self._get_session() as session:
+            record = self._get_record(session, knowledge_base_name, document_name)
+            if record is not None:
+                session.delete(record)
+                session.flush()
+        if knowledge_base_name in self._documents:
+            self._documents[knowledge_base_name].pop(document_name, None)
+
+    def migrate(self, knowledge_base: KnowledgeBase) -> None:
+        """
+        Copies every knowledge base and document of a JSON knowledge base into the
+        catalog, in a single transaction.
+
+        Args:
+            knowledge_base (KnowledgeBase): The knowledge base to copy.
+        """
+        with self.batch():
+            for knowledge_base_name in knowledge_base.get_knowledge_base_names():
+                self.add_knowledge_base(knowledge_base_name)
+                documents = knowledge_base.get_documents(knowledge_base_name)
+                for document_name, document in documents.items():
+                    self.add(knowledge_base_name, document_name, document)
+        logger.info(
+            "knowledge_base.catalog.migrate.success",
+            filepath=self.filepath,
+            knowledge_bases=len(knowledge_base.root),
+        )
+
+
+def load_knowledge_base(
+    backend: str = settings.KNOWLEDGE_BASE_BACKEND,
+    file_path: str = settings.KNOWLEDGE_BASE_FILEPATH,
+    catalog_filepath: str = settings.KNOWLEDGE_BASE_CATALOG_FILEPATH,
+) -> Union[KnowledgeBase, KnowledgeBaseCatalog]:
+    """
+    Loads the knowledge base from the configured backend.
+
+    The first time the SQLite catalog is used, the JSON knowledge base file, if any,
+    is migrated into it. The migration is written to a temporary database that only
+    replaces the catalog once it completes, so a failed migration is retried the
+    next time. The JSON file is left in place but no longer used.
+
+    Args:
+        backend (str, optional): Either "sqlite" or "json". Defaults to settings.KNOWLEDGE_BASE_BACKEND.
+        file_path (str, optional): The path to the JSON knowledge base file. Defaults to settings.KNOWLEDGE_BASE_FILEPATH.
+        catalog_filepath (str, optional): The path to the SQLite catalog. Defaults to settings.KNOWLEDGE_BASE_CATALOG_FILEPATH.
+
+    Returns:
+        Union[KnowledgeBase, KnowledgeBaseCatalog]: The knowledge base.
+    """  # noqa
+    if backend == "json":
+        return KnowledgeBase.load(file_path)
+
+    if not os.path.exists(catalog_filepath) and os.path.exists(file_path):
+        temp_filepath = f"{catalog_filepath}.tmp"
+        # Left behind by a migration that failed
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+        temp_catalog = KnowledgeBaseCatalog(temp_filepath)
+        try:
+            temp_catalog.migrate(KnowledgeBase.load(file_path))
+        finally:
+            temp_catalog.engine.dispose()
+        os.replace(temp_filepath, catalog_filepath)
+    return KnowledgeBaseCatalog(catalog_filepath)
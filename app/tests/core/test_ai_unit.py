@@ -0,0 +1,121 @@
+import pytest
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.schema import BaseRetriever, Document
+
+from app.core import ai
+from app.core.config import settings
+from app.core.log import get_latency_stats
+from app.core.providers import FakeChatModel
+
+
+@pytest.fixture
+def routing(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_ROUTING_ENABLED", True)
+    monkeypatch.setattr(settings, "LLM_PROVIDER", "fake")
+    monkeypatch.setattr(settings, "LLM_ROUTER_LOCAL_PROVIDER", "fake")
+    monkeypatch.setattr(settings, "LLM_ROUTER_LOCAL_MAX_TOKENS", 50)
+    monkeypatch.setattr(settings, "LLM_ROUTER_HEAVY_MIN_TOKENS", 1000)
+    monkeypatch.setattr(settings, "FAKE_LLM_LATENCY_SECONDS", 0.0)
+    monkeypatch.setattr(settings, "FAKE_LLM_TOKENS_PER_SECOND", 0.0)
+    monkeypatch.setattr(settings, "FAKE_LLM_RESPONSE_TOKENS", 5)
+    monkeypatch.setattr(ai, "conversation_chains", {})
+    monkeypatch.setattr(ai, "conversation_memories", {})
+    monkeypatch.setattr(ai, "summary_llms", {})
+
+
+@pytest.mark.parametrize(
+    "prompt_tokens, use_knowledge_base, model, reason",
+    [
+        (10, False, "local", "short"),
+        (10, True, "gpt-4", "selected"),
+        (500, False, "gpt-4", "selected"),
+        (5000, True, "gpt-4-1106-preview", "long"),
+    ],
+)
+def test_route_llm_by_prompt_tokens_and_knowledge_base(
+    routing, prompt_tokens, use_knowledge_base, model, reason
+):
+    route = ai.route_llm(prompt_tokens, "gpt-4", use_knowledge_base)
+
+    assert (route.model, route.reason) == (model, reason)
+
+
+def test_route_llm_keeps_the_selected_model_when_disabled(routing, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_ROUTING_ENABLED", False)
+
+    route = ai.route_llm(10, "gpt-4", use_knowledge_base=False)
+
+    assert (route.model, route.reason) == ("gpt-4", "selected")
+
+
+def test_long_conversations_move_off_the_local_model(routing):
+    first = ai.get_llm_route("Hi", "", "", "gpt-4", use_knowledge_base=False)
+    ai.stream_chat_with_llm(user_input="Hi", knowledge_base_name="", model="gpt-4")
+    memory = ai._get_memory("", "", "gpt-4")
+    memory.save_context({"question": "Tell me more " * 50}, {"text": "More " * 50})
+    second = ai.get_llm_route("Go on", "", "", "gpt-4", use_knowledge_base=False)
+
+    assert first.model == settings.LOCAL_LLM_MODEL
+    assert second.model == "gpt-4"
+    assert ("", "fake", settings.LOCAL_LLM_MODEL) == next(iter(ai.conversation_chains))[
+        :3
+    ]
+    assert get_latency_stats()["ai.llm.fake"].count
+
+
+@pytest.fixture
+def response_cache(routing, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(
+        settings, "RESPONSE_CACHE_FILEPATH", str(tmp_path / "cache.sqlite3")
+    )
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_SIMILARITY_THRESHOLD", 0.0)
+    monkeypatch.setattr(ai, "response_caches", {})
+
+
+def test_response_cache_is_keyed_on_the_conversation(response_cache):
+    def chat(user_input: str, session_id: str) -> bool:
+        response, _ = ai.stream_chat_with_llm(
+            user_input=user_input,
+            knowledge_base_name="",
+            model="gpt-4",
+            session_id=session_id,
+        )
+        return response.get("cached", False)
+
+    assert not chat("Who rode north?", "a")
+    assert not chat("Why?", "a")
+    # The same follow-up in another conversation is answered afresh
+    assert not chat("Why?", "b")
+    assert chat("Who rode north?", "c")
+
+
+class CountingRetriever(BaseRetriever):
+    calls: int = 0
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        self.calls += 1
+        return [Document(page_content="The knight.", metadata={"chunk_id": "1"})]
+
+
+def test_chain_answers_from_the_chunks_of_the_cache_key(routing):
+    retriever = CountingRetriever()
+    memory = ai._get_memory("kb", "", "gpt-4")
+    memory.output_key = "answer"
+    chain = ai.PrefetchedRetrievalChain.from_llm(
+        llm=FakeChatModel(latency=0.0, tokens_per_second=0.0, response_tokens=3),
+        retriever=retriever,
+        memory=memory,
+        return_source_documents=True,
+    )
+
+    cache_key, documents = ai.get_response_cache_key(
+        chain, "Who rode north?", "gpt-4", 0.0, {}, use_knowledge_base=True
+    )
+    response = chain({"question": "Who rode north?", ai.RETRIEVED_DOCUMENTS: documents})
+
+    assert cache_key.chunk_ids == ["1"]
+    assert response["source_documents"] == documents
+    assert retriever.calls == 1
@@ -0,0 +1,88 @@
+import os
+
+from langchain.embeddings import DeterministicFakeEmbedding
+from langchain.schema import Document
+
+from app.core.bm25 import BM25Index, BM25Retriever, get_bm25_index
+from app.core.indexer import index_knowledge_base
+from app.core.vectorstore import (
+    HybridRetriever,
+    get_persist_directory,
+    get_vectorstore_retriever,
+)
+from app.models import KnowledgeBaseDocument
+
+
+def test_bm25_index_ranks_exact_identifiers(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25.json"))
+    index.add_documents(
+        [
+            ("1", Document(page_content="The sword of the north is heavy.")),
+            ("2", Document(page_content="Aramus wields the sword of the north.")),
+            ("3", Document(page_content="A quiet village by the sea.")),
+        ]
+    )
+
+    assert [doc.page_content[:6] for doc, _ in index.search("aramus", 3)] == ["Aramus"]
+
+    index.delete(["2"])
+    index.save()
+    reloaded = BM25Index.load(index.filepath)
+    assert len(reloaded) == 2
+    assert reloaded.search("aramus", 3) == []
+    assert reloaded.search("sword", 3)[0][0].page_content.startswith("The sword")
+
+
+def test_hybrid_retriever_fuses_rankings(tmp_path):
+    dense = BM25Index(str(tmp_path / "dense.json"))
+    sparse = BM25Index(str(tmp_path / "sparse.json"))
+    shared = Document(page_content="alpha beta", metadata={"chunk_id": "shared"})
+    dense.add_documents(
+        [("a", Document(page_content="alpha", metadata={"chunk_id": "a"}))]
+    )
+    dense.add_documents([("shared", shared)])
+    sparse.add_documents(
+        [("b", Document(page_content="beta beta", metadata={"chunk_id": "b"}))]
+    )
+    sparse.add_documents([("shared", shared)])
+
+    retriever = HybridRetriever(
+        retrievers=[BM25Retriever(index=dense), BM25Retriever(index=sparse)],
+        weights=[1.0, 1.0],
+        k=2,
+    )
+    documents = retriever.get_relevant_documents("alpha beta")
+
+    # Found by both retrievers, so it ranks first
+    assert documents[0].metadata["chunk_id"] == "shared"
+    assert len(documents) == 2
+
+
+def test_index_knowledge_base_builds_bm25_index(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    persist_directory_root = str(tmp_path / "chromadb")
+    file_path = os.path.join(tmp_path, "units.txt")
+    with open(file_path, "w") as f:
+        f.write("Aramus is a knight.")
+    documents = {
+        "units.txt": KnowledgeBaseDocument(
+            Type="Document", Filepath=file_path, Size=19, Loaded=False
+        )
+    }
+
+    index_knowledge_base("kb 3", documents, embeddings, persist_directory_root)
+    persist_directory = get_persist_directory("kb 3", persist_directory_root)
+    assert len(get_bm25_index(persist_directory)) == 1
+    assert os.path.exists(os.path.join(persist_directory, "bm25.json"))
+
+    retriever = get_vectorstore_retriever(
+        documents=[],
+        embeddings=embeddings,
+        knowledge_base_name="kb 3",
+        persist_directory_root=persist_directory_root,
+        retrieval_mode="hybrid",
+    )
+    assert isinstance(retriever, HybridRetriever)
+    assert retriever.get_relevant_documents("aramus")[0].page_content.startswith(
+        "Aramus"
+    )
@@ -0,0 +1,125 @@
+from typing import Any, Optional
+
+import pytest
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.callbacks.manager import (
+    CallbackManagerForLLMRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain.chains import LLMChain
+from langchain.chat_models.base import BaseChatModel
+from langchain.memory import ConversationBufferMemory
+from langchain.prompts import ChatPromptTemplate
+from langchain.schema import BaseRetriever, ChatGeneration, ChatResult, Document
+from langchain.schema.messages import AIMessage, BaseMessage
+
+from app.core import ai
+from app.core.ai import get_cancelled_response
+from app.core.cancellation import ANSWER_TAG, CancellationToken, ChatCancelledError
+from app.core.config import settings
+
+
+class StreamingChatModel(BaseChatModel):
+    response: str
+
+    @property
+    def _llm_type(self) -> str:
+        return "streaming-fake"
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        for token in self.response.split(" "):
+            run_manager.on_llm_new_token(f"{token} ")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=""))])
+
+
+class CancelAfter(BaseCallbackHandler):
+    def __init__(self, cancellation_token: CancellationToken, tokens: int):
+        self.cancellation_token = cancellation_token
+        self.tokens = tokens
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.tokens -= 1
+        if not self.tokens:
+            self.cancellation_token.cancel()
+
+
+def test_cancellation_token_closes_attached_streams():
+    closed: list[str] = []
+    cancellation_token = CancellationToken()
+    cancellation_token.attach(lambda: closed.append("first"))
+
+    cancellation_token.cancel()
+    cancellation_token.cancel()
+    cancellation_token.attach(lambda: closed.append("late"))
+
+    assert closed == ["first", "late"]
+    assert cancellation_token.wait(0)
+
+
+def test_cancelled_request_keeps_partial_output():
+    memory = ConversationBufferMemory(input_key="question", output_key="text")
+    chain = LLMChain(
+        llm=StreamingChatModel(response="one two three four five"),
+        prompt=ChatPromptTemplate.from_template("{question}"),
+        memory=memory,
+        tags=[ANSWER_TAG],
+    )
+    cancellation_token = CancellationToken()
+
+    with pytest.raises(ChatCancelledError):
+        chain(
+            {"question": "count"},
+            callbacks=[CancelAfter(cancellation_token, 2), cancellation_token],
+        )
+    response = get_cancelled_response(chain, "count", cancellation_token)
+
+    assert response == {
+        "response": "one ",
+        "cancelled": True,
+        "max_tokens_saved": settings.LLM_MAX_OUTPUT_TOKENS - 1,
+    }
+    assert memory.buffer == "Human: count\nAI: one "
+
+
+class StaticRetriever(BaseRetriever):
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        return [Document(page_content="The knight rode north.")]
+
+
+def test_cancelled_follow_up_keeps_only_the_answer(monkeypatch):
+    monkeypatch.setattr(ai, "get_vectorstore_retriever", lambda **_: StaticRetriever())
+    monkeypatch.setattr(ai, "create_embeddings", lambda: None)
+    memory = ConversationBufferMemory(
+        memory_key="chat_history",
+        input_key="question",
+        output_key="answer",
+        return_messages=True,
+    )
+    memory.save_context({"question": "Who rode?"}, {"answer": "The knight."})
+    chain, _ = ai.configure_chain(
+        llm=StreamingChatModel(response="one two three four five"),
+        memory=memory,
+        prompt=None,
+        use_knowledge_base=True,
+        knowledge_base_name="kb",
+        model="gpt-4",
+    )
+    cancellation_token = CancellationToken()
+
+    # The question is rephrased in five tokens before the answer starts
+    with pytest.raises(ChatCancelledError):
+        chain(
+            {"question": "Where?"},
+            callbacks=[CancelAfter(cancellation_token, 7), cancellation_token],
+        )
+
+    assert cancellation_token.partial_output == "one "
+    assert cancellation_token.tokens == 1
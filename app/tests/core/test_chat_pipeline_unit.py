@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+from app.core.chat_pipeline import ChatJob, ChatPipeline, ChatQueueFullError
+
+
+def test_chat_pipeline_answers_queued_prompts_in_order():
+    answered: list[str] = []
+    done = threading.Event()
+
+    def handler(job: ChatJob) -> None:
+        answered.append(job.prompt)
+        if len(answered) == 3:
+            done.set()
+
+    pipeline = ChatPipeline(handler)
+    for prompt in ["one", "two", "three"]:
+        pipeline.submit(prompt)
+
+    assert done.wait(5)
+    assert answered == ["one", "two", "three"]
+    pipeline.close(timeout=5)
+
+
+def test_chat_pipeline_cancels_current_and_queued_jobs():
+    started = threading.Event()
+    answered: list[str] = []
+
+    def handler(job: ChatJob) -> None:
+        started.set()
+        job.cancellation_token.wait(5)
+        answered.append(job.prompt)
+
+    pipeline = ChatPipeline(handler, max_queued=1)
+    current = pipeline.submit("slow")
+    assert started.wait(5)
+    queued = pipeline.submit("queued")
+    with pytest.raises(ChatQueueFullError):
+        pipeline.submit("overflow")
+
+    assert pipeline.cancel() == 2
+    pipeline.close(timeout=5)
+
+    assert current.is_cancelled and queued.is_cancelled
+    assert answered == ["slow"]
+    assert not pipeline.busy
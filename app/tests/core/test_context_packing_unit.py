@@ -0,0 +1,75 @@
+from langchain.embeddings import DeterministicFakeEmbedding
+from langchain.schema import Document
+
+from app.core.context_packing import (
+    drop_near_duplicates,
+    merge_overlap,
+    merge_overlapping_documents,
+    pack_context,
+)
+from app.core.splitter import get_document_chunks
+
+MODEL = "text-embedding-ada-002"
+TEXT = " ".join(f"word{i}" for i in range(400))
+
+
+def test_merge_overlap_joins_on_the_shared_text():
+    assert merge_overlap("one two three four", "three four five", 5) == (
+        "one two three four five"
+    )
+    assert merge_overlap("one two three", "four five", 4) is None
+
+
+def test_overlapping_chunks_of_a_document_are_merged():
+    chunks = get_document_chunks(
+        [Document(page_content=TEXT, metadata={"source": "a.txt"})],
+        chunk_size=100,
+        chunk_overlap=20,
+        token_aware=True,
+    )
+    for index, chunk in enumerate(chunks):
+        chunk.metadata["chunk_id"] = f"chunk{index}"
+    other = Document(page_content="unrelated", metadata={"source": "b.txt"})
+
+    merged = merge_overlapping_documents([chunks[1], other, chunks[0], chunks[2]])
+
+    assert [document.metadata["source"] for document in merged] == ["a.txt", "b.txt"]
+    assert merged[0].page_content.startswith("word0 ")
+    assert merged[0].page_content.endswith(chunks[2].page_content)
+    assert merged[0].page_content in TEXT
+    assert merged[0].metadata["chunk_id"] == "chunk0+chunk1+chunk2"
+
+
+def test_near_duplicates_are_dropped():
+    documents = [
+        Document(page_content=TEXT),
+        Document(page_content=TEXT + " word400"),
+        Document(page_content="something else entirely"),
+    ]
+
+    assert drop_near_duplicates(documents, threshold=0.9) == [
+        documents[0],
+        documents[2],
+    ]
+
+
+def test_pack_context_selects_within_budget():
+    documents = [
+        Document(page_content=f"{TEXT} {i}", metadata={"source": f"{i}.txt"})
+        for i in range(6)
+    ] + [
+        Document(page_content=f"topic {i}", metadata={"source": "t.txt"})
+        for i in range(6)
+    ]
+
+    packed = pack_context(
+        query="topic",
+        documents=documents,
+        max_tokens=1000,
+        model=MODEL,
+        max_documents=4,
+        embeddings=DeterministicFakeEmbedding(size=16),
+    )
+
+    assert len(packed) <= 4
+    assert sum(document.page_content.startswith("word0") for document in packed) <= 1
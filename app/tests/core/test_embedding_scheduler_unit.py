@@ -0,0 +1,148 @@
+import asyncio
+import threading
+
+import pytest
+from aiohttp import web
+
+from app.core.embedding_scheduler import (
+    EmbeddingRequestError,
+    ScheduledEmbeddings,
+    pack_batches,
+)
+
+
+class StubEmbeddingServer:
+    """
+    A local OpenAI-style embeddings endpoint that simulates latency, rate limits,
+    dropped connections and hung requests.
+    """
+
+    def __init__(
+        self,
+        rate_limited_requests: int = 0,
+        latency: float = 0.01,
+        dropped_requests: int = 0,
+        hung_requests: int = 0,
+    ):
+        self.rate_limited_requests = rate_limited_requests
+        self.latency = latency
+        self.dropped_requests = dropped_requests
+        self.hung_requests = hung_requests
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.requests <= self.rate_limited_requests:
+            return web.json_response(
+                {"error": "rate limited"}, status=429, headers={"Retry-After": "0.01"}
+            )
+        if self.dropped_requests:
+            self.dropped_requests -= 1
+            request.transport.close()
+            return web.Response()
+        if self.hung_requests:
+            self.hung_requests -= 1
+            await asyncio.sleep(1)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.latency)
+        self.in_flight -= 1
+        body = await request.json()
+        data = [
+            {"index": index, "embedding": [float(len(text)), float(index)]}
+            for index, text in enumerate(body["input"])
+        ]
+        # Return out of order to make sure the client sorts by index
+        return web.json_response({"data": list(reversed(data))})
+
+    async def _start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/v1/embeddings", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        return f"http://127.0.0.1:{port}/v1"
+
+    def __enter__(self) -> str:
+        self.thread.start()
+        return asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+
+    def __exit__(self, *args):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def test_pack_batches_respects_token_and_text_limits():
+    texts = ["a " * 10, "b " * 10, "c " * 10, "d " * 100]
+    batches = pack_batches(texts, "text-embedding-ada-002", max_tokens=25, max_texts=2)
+    # Every text is kept, in order, and the oversized one gets its own batch
+    assert [index for batch in batches for index in batch] == [0, 1, 2, 3]
+    assert batches[-1] == [3]
+    assert all(len(batch) <= 2 for batch in batches)
+
+
+def test_scheduled_embeddings_batches_concurrently_and_retries():
+    server = StubEmbeddingServer(rate_limited_requests=2)
+    texts = [f"text {i}" * (i + 1) for i in range(20)]
+    with server as base_url:
+        embeddings = ScheduledEmbeddings(
+            api_key="test",
+            base_url=base_url,
+            max_batch_tokens=10000,
+            max_batch_texts=2,
+            max_concurrency=3,
+            backoff_seconds=0.01,
+        )
+        vectors = embeddings.embed_documents(texts)
+
+    assert vectors == [[float(len(text)), float(i % 2)] for i, text in enumerate(texts)]
+    # 10 batches plus the 2 rate limited attempts
+    assert server.requests == 12
+    assert 1 < server.max_in_flight <= 3
+
+
+def test_scheduled_embeddings_gives_up_after_max_retries():
+    with StubEmbeddingServer(rate_limited_requests=10) as base_url:
+        embeddings = ScheduledEmbeddings(
+            api_key="test", base_url=base_url, max_retries=1, backoff_seconds=0.01
+        )
+        with pytest.raises(EmbeddingRequestError):
+            embeddings.embed_documents(["text"])
+
+
+def test_scheduled_embeddings_retries_connection_errors_and_timeouts():
+    with StubEmbeddingServer(dropped_requests=1, hung_requests=1) as base_url:
+        embeddings = ScheduledEmbeddings(
+            api_key="test",
+            base_url=base_url,
+            backoff_seconds=0.01,
+            timeout_seconds=0.2,
+        )
+        vectors = embeddings.embed_documents(["text"])
+        embeddings.close()
+
+    assert vectors == [[4.0, 0.0]]
+
+
+def test_scheduled_embeddings_reuses_its_session_from_any_thread():
+    with StubEmbeddingServer() as base_url:
+        embeddings = ScheduledEmbeddings(api_key="test", base_url=base_url)
+        embeddings.embed_query("one")
+        session = embeddings._session
+
+        async def embed_in_running_loop():
+            return embeddings.embed_query("two"), await embeddings.aembed_query("3")
+
+        vectors = asyncio.run(embed_in_running_loop())
+        reused = embeddings._session is session
+        embeddings.close()
+
+    assert vectors == ([3.0, 0.0], [1.0, 0.0])
+    assert reused
@@ -0,0 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain.embeddings import DeterministicFakeEmbedding
+
+from app.core.embeddings import CachedEmbeddings
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    calls: int = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls += len(texts)
+        return super().embed_documents(texts)
+
+
+def test_cached_embeddings_hits_and_misses(tmp_path):
+    embeddings = CountingEmbeddings(size=8)
+    cached = CachedEmbeddings(
+        embeddings=embeddings,
+        model="fake",
+        cache_filepath=str(tmp_path / "cache.sqlite3"),
+    )
+
+    vectors = cached.embed_documents(["alpha", "beta", "alpha"])
+    assert embeddings.calls == 2
+    assert (cached.hits, cached.misses) == (1, 2)
+    assert vectors[0] == vectors[2]
+    assert vectors[0] == embeddings.embed_query("alpha")
+
+    # Whitespace differences share the same cache entry
+    cached.embed_documents(["  alpha\n", "beta"])
+    assert embeddings.calls == 2
+    assert (cached.hits, cached.misses) == (3, 2)
+
+
+def test_cached_embeddings_count_every_lookup_across_threads(tmp_path):
+    cached = CachedEmbeddings(
+        embeddings=DeterministicFakeEmbedding(size=8),
+        model="fake",
+        cache_filepath=str(tmp_path / "cache.sqlite3"),
+    )
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda i: cached.embed_query(str(i % 10)), range(400)))
+        list(executor.map(lambda i: cached.embed_documents([str(i)]), range(400)))
+
+    assert cached.hits + cached.misses == 800
+
+
+def test_cached_embeddings_persist_and_are_keyed_by_model(tmp_path):
+    cache_filepath = str(tmp_path / "cache.sqlite3")
+    embeddings = CountingEmbeddings(size=8)
+    CachedEmbeddings(embeddings, "fake", cache_filepath).embed_documents(["alpha"])
+
+    reopened = CachedEmbeddings(embeddings, "fake", cache_filepath)
+    reopened.embed_documents(["alpha"])
+    assert (reopened.hits, reopened.misses) == (1, 0)
+
+    other_model = CachedEmbeddings(embeddings, "other", cache_filepath)
+    other_model.embed_documents(["alpha"])
+    assert (other_model.hits, other_model.misses) == (0, 1)
+
+
+def test_cached_embeddings_evicts_least_recently_used(tmp_path):
+    cached = CachedEmbeddings(
+        embeddings=CountingEmbeddings(size=8),
+        model="fake",
+        cache_filepath=str(tmp_path / "cache.sqlite3"),
+        max_entries=2,
+    )
+    cached.embed_documents(["alpha"])
+    cached.embed_documents(["beta"])
+    cached.embed_documents(["alpha"])
+    cached.embed_documents(["gamma"])
+
+    # "beta" was the least recently used entry, so it was evicted
+    cached.embed_documents(["alpha", "gamma", "beta"])
+    assert cached.misses == 4
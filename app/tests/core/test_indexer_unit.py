@@ -0,0 +1,154 @@
+import os
+
+import pytest
+from langchain.embeddings import DeterministicFakeEmbedding
+
+from app.core import indexer
+from app.core.hashing import hash_file
+from app.core.indexer import index_knowledge_base
+from app.core.vectorstore import delete_vectorstore, vectorstore_exists
+from app.models import KnowledgeBaseDocument
+
+
+def _write_document(directory, name: str, content: str) -> KnowledgeBaseDocument:
+    file_path = os.path.join(directory, name)
+    with open(file_path, "w") as f:
+        f.write(content)
+    return KnowledgeBaseDocument(
+        Type="Document",
+        Filepath=file_path,
+        Size=len(content),
+        Loaded=False,
+    )
+
+
+def test_index_knowledge_base_is_incremental(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    persist_directory_root = str(tmp_path / "chromadb")
+    documents = {
+        "doc1.txt": _write_document(tmp_path, "doc1.txt", "The first document."),
+        "doc2.txt": _write_document(tmp_path, "doc2.txt", "The second document."),
+    }
+
+    # Everything is new on the first run
+    stats = index_knowledge_base("kb 1", documents, embeddings, persist_directory_root)
+    assert (stats.skipped, stats.added, stats.removed) == (0, 2, 0)
+    assert documents["doc1.txt"].Hash is not None
+
+    # Nothing changed, so nothing is embedded
+    stats = index_knowledge_base("kb 1", documents, embeddings, persist_directory_root)
+    assert (stats.skipped, stats.added, stats.removed) == (2, 0, 0)
+
+    # A changed document replaces its chunk and a removed one drops its chunk
+    documents["doc1.txt"] = _write_document(tmp_path, "doc1.txt", "Edited.")
+    documents["doc1.txt"].Hash = "stale"
+    del documents["doc2.txt"]
+    stats = index_knowledge_base("kb 1", documents, embeddings, persist_directory_root)
+    assert (stats.skipped, stats.added, stats.removed) == (0, 1, 2)
+
+
+def test_index_knowledge_base_updates_vectorstore_registry(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    persist_directory_root = str(tmp_path / "chromadb")
+    documents = {"doc1.txt": _write_document(tmp_path, "doc1.txt", "A document.")}
+
+    assert not vectorstore_exists("kb 2", persist_directory_root)
+    index_knowledge_base("kb 2", documents, embeddings, persist_directory_root)
+    assert vectorstore_exists("kb 2", persist_directory_root)
+
+    delete_vectorstore("kb 2", persist_directory_root)
+    assert not vectorstore_exists("kb 2", persist_directory_root)
+
+
+def test_knowledge_base_without_chunks_is_only_indexed_once(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    persist_directory_root = str(tmp_path / "chromadb")
+    documents = {"empty.txt": _write_document(tmp_path, "empty.txt", "")}
+
+    stats = index_knowledge_base("kb 5", documents, embeddings, persist_directory_root)
+
+    assert stats.added == 0
+    assert vectorstore_exists("kb 5", persist_directory_root)
+
+
+def test_index_knowledge_base_streams_batches_and_reports_progress(tmp_path):
+    documents = {
+        f"doc{i}.txt": _write_document(tmp_path, f"doc{i}.txt", f"Document {i}.")
+        for i in range(5)
+    }
+    progress = []
+
+    stats = index_knowledge_base(
+        "kb 3",
+        documents,
+        DeterministicFakeEmbedding(size=16),
+        str(tmp_path / "chromadb"),
+        batch_size=2,
+        progress_callback=lambda processed, total: progress.append((processed, total)),
+    )
+
+    assert stats.added == 5
+    assert progress == [(i, 5) for i in range(1, 6)]
+
+
+def test_failed_load_keeps_indexed_chunks(tmp_path, monkeypatch):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    persist_directory_root = str(tmp_path / "chromadb")
+    documents = {"doc1.txt": _write_document(tmp_path, "doc1.txt", "A document.")}
+    index_knowledge_base("kb 6", documents, embeddings, persist_directory_root)
+
+    documents["doc1.txt"] = _write_document(tmp_path, "doc1.txt", "Edited.")
+    documents["doc1.txt"].Hash = "stale"
+    monkeypatch.setattr(
+        indexer, "iter_documents", lambda stale: ((name, None) for name in stale)
+    )
+    stats = index_knowledge_base("kb 6", documents, embeddings, persist_directory_root)
+
+    assert (stats.skipped, stats.added, stats.removed) == (1, 0, 0)
+    assert documents["doc1.txt"].Hash == "stale"
+    assert documents["doc1.txt"].Indexed is None
+
+
+class FailingEmbeddings(DeterministicFakeEmbedding):
+    calls: int = 0
+    fail_on_call: int = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls += 1
+        if self.calls == self.fail_on_call:
+            raise RuntimeError("Rate limited")
+        return super().embed_documents(texts)
+
+
+def test_documents_are_only_marked_indexed_once_stored(tmp_path):
+    embeddings = FailingEmbeddings(size=16, fail_on_call=2)
+    persist_directory_root = str(tmp_path / "chromadb")
+    documents = {
+        f"doc{i}.txt": _write_document(tmp_path, f"doc{i}.txt", f"Document {i}.")
+        for i in range(2)
+    }
+
+    with pytest.raises(RuntimeError):
+        index_knowledge_base(
+            "kb 7", documents, embeddings, persist_directory_root, batch_size=1
+        )
+    assert [document.Hash for document in documents.values()] == [None, None]
+
+    stats = index_knowledge_base(
+        "kb 7", documents, embeddings, persist_directory_root, batch_size=1
+    )
+    assert (stats.skipped, stats.added, stats.removed) == (1, 1, 0)
+    assert all(document.Hash for document in documents.values())
+
+
+def test_content_hash_is_only_reused_for_unchanged_files(tmp_path):
+    document = _write_document(tmp_path, "doc.txt", "Original.")
+    document.ContentHash = "imported"
+    document.Modified = os.stat(document.Filepath).st_mtime
+    assert indexer.get_document_hash(document) == "imported"
+
+    # Same size, but edited since it was imported
+    with open(document.Filepath, "w") as f:
+        f.write("Replaced.")
+    os.utime(document.Filepath, (0, document.Modified + 1))
+    assert indexer.get_document_hash(document) == hash_file(document.Filepath)
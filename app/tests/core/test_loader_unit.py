@@ -0,0 +1,76 @@
+import os
+import time
+
+from langchain.schema import Document
+
+from app.core import loader
+from app.core.loader import iter_documents, load_documents
+from app.models import KnowledgeBaseDocument
+
+
+def _document(file_path: str, size: int = 0) -> KnowledgeBaseDocument:
+    return KnowledgeBaseDocument(
+        Type="Document", Filepath=file_path, Size=size, Loaded=False
+    )
+
+
+def test_load_documents_in_parallel_keeps_order_and_isolates_errors(tmp_path):
+    documents = {}
+    for i in range(4):
+        file_path = os.path.join(tmp_path, f"doc{i}.txt")
+        with open(file_path, "w") as f:
+            f.write(f"Document {i}")
+        documents[f"doc{i}.txt"] = _document(file_path)
+    # A missing file fails to load but doesn't abort the others
+    documents["missing.txt"] = _document(os.path.join(tmp_path, "missing.txt"))
+    documents["doc4.txt"] = documents.pop("doc3.txt")
+
+    loaded = load_documents(documents, max_workers=2)
+
+    assert [document.page_content for document in loaded] == [
+        "Document 0",
+        "Document 1",
+        "Document 2",
+        "Document 3",
+    ]
+    assert [document.metadata["source"] for document in loaded] == [
+        "doc0.txt",
+        "doc1.txt",
+        "doc2.txt",
+        "doc3.txt",
+    ]
+
+
+def _load_or_hang(file_name: str, **kwargs):
+    if file_name.startswith("hang"):
+        time.sleep(60)
+    return [Document(page_content=file_name)]
+
+
+def test_timed_out_parsers_are_killed(tmp_path, monkeypatch):
+    monkeypatch.setattr(loader, "determine_loader_and_load", _load_or_hang)
+    documents = {
+        name: _document(os.path.join(tmp_path, name))
+        for name in ["hang1.txt", "doc1.txt", "hang2.txt", "doc2.txt", "doc3.txt"]
+    }
+
+    started_at = time.monotonic()
+    loaded = load_documents(documents, max_workers=2, timeout=1)
+
+    assert [document.page_content for document in loaded] == [
+        "doc1.txt",
+        "doc2.txt",
+        "doc3.txt",
+    ]
+    assert time.monotonic() - started_at < 45
+
+
+def test_single_hanging_document_times_out(tmp_path, monkeypatch):
+    monkeypatch.setattr(loader, "determine_loader_and_load", _load_or_hang)
+    documents = {"hang.txt": _document(os.path.join(tmp_path, "hang.txt"))}
+
+    started_at = time.monotonic()
+    loaded = list(iter_documents(documents, timeout=1))
+
+    assert loaded == [("hang.txt", None)]
+    assert time.monotonic() - started_at < 20
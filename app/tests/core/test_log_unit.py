@@ -0,0 +1,28 @@
+import pytest
+
+from app.core.log import get_latency_stats, span, timed
+
+
+def test_span_records_latency_and_fields():
+    with span("test.span", stage="retrieve") as fields:
+        fields["documents"] = 3
+
+    assert fields == {"stage": "retrieve", "documents": 3}
+    stats = get_latency_stats()["test.span"]
+    assert stats.count >= 1
+    assert stats.max >= stats.last >= 0
+
+
+def test_timed_records_failures():
+    @timed("test.timed")
+    def fail():
+        raise ValueError("boom")
+
+    before = get_latency_stats().get("test.timed")
+    with pytest.raises(ValueError):
+        fail()
+
+    assert (
+        get_latency_stats()["test.timed"].count == (before.count if before else 0) + 1
+    )
+    assert fail.__name__ == "fail"
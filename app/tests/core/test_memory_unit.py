@@ -0,0 +1,45 @@
+from langchain.llms.fake import FakeListLLM
+
+from app.core.memory import TokenBudgetMemory, get_memory_token_budget
+
+
+def make_memory(**kwargs) -> TokenBudgetMemory:
+    return TokenBudgetMemory(
+        llm=FakeListLLM(responses=["They talked about numbers."]),
+        model="gpt-4",
+        input_key="question",
+        output_key="answer",
+        return_messages=True,
+        **kwargs,
+    )
+
+
+def test_memory_stays_within_token_budget():
+    memory = make_memory(max_token_limit=200)
+
+    for turn in range(20):
+        memory.save_context(
+            {"question": f"Question {turn} " * 10}, {"answer": f"Answer {turn} " * 10}
+        )
+
+    history = memory.load_memory_variables({})["history"]
+    assert memory.moving_summary_buffer == "They talked about numbers."
+    assert history[0].content == "They talked about numbers."
+    assert history[-1].content.startswith("Answer 19")
+    assert len(memory.buffer) % 2 == 0
+    assert memory.count_tokens(memory.buffer) <= 200
+
+
+def test_memory_keeps_a_sliding_window_of_turns():
+    memory = make_memory(max_token_limit=100000, max_turns=2)
+
+    for turn in range(5):
+        memory.save_context({"question": f"Q{turn}"}, {"answer": f"A{turn}"})
+
+    assert [message.content for message in memory.buffer] == ["Q3", "A3", "Q4", "A4"]
+
+
+def test_memory_token_budget_follows_the_context_window():
+    assert get_memory_token_budget("gpt-4-1106-preview") > get_memory_token_budget(
+        "gpt-4"
+    )
@@ -0,0 +1,133 @@
+import os
+
+import numpy as np
+from langchain.embeddings import DeterministicFakeEmbedding
+from langchain.schema import Document
+
+from app.core.indexer import index_knowledge_base
+from app.core.numpy_vectorstore import (
+    NumpyCollection,
+    NumpyVectorStore,
+    numpy_collections,
+)
+from app.core.vectorstore import (
+    delete_vectorstore,
+    get_vectorstore_retriever,
+    vectorstore_exists,
+)
+from app.models import KnowledgeBaseDocument
+
+
+def test_numpy_vectorstore_add_search_delete(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    vectorstore = NumpyVectorStore(
+        collection_name="kb",
+        embedding_function=embeddings,
+        persist_directory=str(tmp_path),
+    )
+    vectorstore.add_documents(
+        [
+            Document(page_content="alpha", metadata={"n": 1}),
+            Document(page_content="beta", metadata={"n": 2}),
+            Document(page_content="gamma", metadata={"n": 3}),
+        ],
+        ids=["a", "b", "c"],
+    )
+
+    # Identical text embeds identically, so it is the closest match
+    document, score = vectorstore.similarity_search_with_score("beta", k=1)[0]
+    assert document.metadata == {"n": 2}
+    assert np.isclose(score, 1.0)
+
+    vectorstore.delete(ids=["b"])
+    assert vectorstore.get(include=["metadatas"]) == {
+        "ids": ["a", "c"],
+        "metadatas": [{"n": 1}, {"n": 3}],
+    }
+
+    # Reloaded from disk, not from the in-process collection
+    numpy_collections.clear()
+    reloaded = NumpyCollection(str(tmp_path), "kb")
+    assert len(reloaded) == 2
+    assert [record["id"] for record in reloaded.records] == ["a", "c"]
+
+
+def test_numpy_collection_ivf_finds_nearest(tmp_path):
+    generator = np.random.default_rng(1)
+    vectors = generator.normal(size=(500, 8)).astype(np.float32)
+    collection = NumpyCollection(str(tmp_path), "ivf")
+    collection.add(
+        [str(i) for i in range(len(vectors))],
+        vectors,
+        [{"document": str(i), "metadata": {}} for i in range(len(vectors))],
+    )
+
+    for i in (0, 123, 499):
+        flat = collection.search(vectors[i], 1, index_type="flat")
+        ivf = collection.search(
+            vectors[i], 1, index_type="ivf", ivf_min_size=100, ivf_probes=4
+        )
+        assert flat[0][0]["id"] == ivf[0][0]["id"] == str(i)
+
+
+def test_numpy_collection_repairs_interrupted_append(tmp_path):
+    vectors = np.eye(4, dtype=np.float32)
+    collection = NumpyCollection(str(tmp_path), "kb")
+    collection.add(
+        ["a", "b"],
+        vectors[:2],
+        [{"document": name, "metadata": {}} for name in ("a", "b")],
+    )
+    # The vector of a third row was written, but not its record
+    with open(collection.vectors_filepath, "ab") as f:
+        f.write(vectors[2].tobytes())
+
+    reloaded = NumpyCollection(str(tmp_path), "kb")
+    assert len(reloaded) == 2
+    reloaded.add(["d"], vectors[3:], [{"document": "d", "metadata": {}}])
+
+    reloaded = NumpyCollection(str(tmp_path), "kb")
+    assert len(reloaded) == 3
+    assert reloaded.search(vectors[3], 1)[0][0]["document"] == "d"
+
+    # The record of a row was torn part way through
+    with open(reloaded.records_filepath, "a") as f:
+        f.write('{"id": "e", "dimen')
+    reloaded = NumpyCollection(str(tmp_path), "kb")
+    assert [record["id"] for record in reloaded.records] == ["a", "b", "d"]
+    reloaded.add(["e"], vectors[2:3], [{"document": "e", "metadata": {}}])
+    assert len(NumpyCollection(str(tmp_path), "kb")) == 4
+
+
+def test_index_knowledge_base_with_numpy_backend(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    persist_directory_root = str(tmp_path / "vectorstore")
+    file_path = os.path.join(tmp_path, "doc1.txt")
+    with open(file_path, "w") as f:
+        f.write("A document.")
+    documents = {
+        "doc1.txt": KnowledgeBaseDocument(
+            Type="Document", Filepath=file_path, Size=11, Loaded=False
+        )
+    }
+
+    stats = index_knowledge_base(
+        "kb 4", documents, embeddings, persist_directory_root, backend="numpy"
+    )
+    assert stats.added == 1
+    assert vectorstore_exists("kb 4", persist_directory_root, backend="numpy")
+    assert not vectorstore_exists("kb 4", persist_directory_root, backend="chroma")
+
+    retriever = get_vectorstore_retriever(
+        documents=[],
+        embeddings=embeddings,
+        knowledge_base_name="kb 4",
+        persist_directory_root=persist_directory_root,
+        backend="numpy",
+    )
+    assert retriever.get_relevant_documents("A document.")[0].page_content == (
+        "A document."
+    )
+
+    delete_vectorstore("kb 4", persist_directory_root, backend="numpy")
+    assert not vectorstore_exists("kb 4", persist_directory_root, backend="numpy")
@@ -0,0 +1,121 @@
+import os
+
+import pytest
+from langchain.callbacks.base import BaseCallbackHandler
+
+from app.core import ai
+from app.core.config import settings
+from app.core.providers import (
+    FakeChatModel,
+    create_chat_model,
+    create_provider_embeddings,
+)
+from app.core.indexer import index_knowledge_base
+from app.core.vectorstore import (
+    delete_knowledge_base_vectorstores,
+    get_persist_directory,
+    vectorstore_exists,
+)
+from app.models import KnowledgeBaseDocument
+
+
+class TokenCollector(BaseCallbackHandler):
+    def __init__(self):
+        self.tokens: list[str] = []
+
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.tokens.append(token)
+
+
+@pytest.fixture
+def fake_providers(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_PROVIDER", "fake")
+    monkeypatch.setattr(settings, "EMBEDDING_PROVIDER", "fake")
+    monkeypatch.setattr(settings, "FAKE_LLM_LATENCY_SECONDS", 0.0)
+    monkeypatch.setattr(settings, "FAKE_LLM_TOKENS_PER_SECOND", 0.0)
+    monkeypatch.setattr(settings, "FAKE_LLM_RESPONSE_TOKENS", 12)
+    monkeypatch.setattr(ai, "conversation_chains", {})
+    monkeypatch.setattr(ai, "conversation_memories", {})
+    monkeypatch.setattr(ai, "summary_llms", {})
+
+
+def test_fake_chat_model_streams_a_deterministic_response(fake_providers):
+    model = create_chat_model("gpt-4", temperature=0.0, streaming=True)
+    assert isinstance(model, FakeChatModel)
+
+    first, second = TokenCollector(), TokenCollector()
+    response = model.predict("Who rode north?", callbacks=[first])
+    model.predict("Who rode north?", callbacks=[second])
+
+    assert len(first.tokens) == 12
+    assert first.tokens == second.tokens
+    assert response == "".join(first.tokens).rstrip()
+
+
+def test_stream_chat_with_llm_runs_on_the_fake_provider(fake_providers, monkeypatch):
+    collector = TokenCollector()
+
+    response, refreshed_vectorstore = ai.stream_chat_with_llm(
+        user_input="Who rode north?",
+        knowledge_base_name="",
+        model="gpt-4",
+        streaming_callback_handler=collector,
+        session_id="load-test",
+    )
+
+    assert not refreshed_vectorstore
+    assert collector.tokens
+    assert response["response"] == "".join(collector.tokens).rstrip()
+
+
+def test_fake_embeddings_use_the_configured_dimensions(fake_providers, monkeypatch):
+    monkeypatch.setattr(settings, "FAKE_EMBEDDING_DIMENSIONS", 8)
+
+    embeddings = create_provider_embeddings()
+
+    assert len(embeddings.embed_query("north")) == 8
+    assert embeddings.embed_query("north") == embeddings.embed_query("north")
+
+
+def test_unknown_provider_is_rejected():
+    with pytest.raises(ValueError, match="Unknown chat model provider"):
+        create_chat_model("gpt-4", temperature=0.0, provider="missing")
+
+
+def test_vector_stores_are_kept_per_embedding_model(fake_providers, monkeypatch):
+    fake_directory = get_persist_directory("kb 1", "root")
+    monkeypatch.setattr(settings, "EMBEDDING_PROVIDER", "openai")
+    openai_directory = get_persist_directory("kb 1", "root")
+    monkeypatch.setattr(settings, "EMBEDDING_MODEL", "text-embedding-3-small")
+
+    assert openai_directory == os.path.join("root", "kb_1")
+    assert fake_directory == os.path.join("root", "kb_1", "fake-1536")
+    assert get_persist_directory("kb 1", "root", "numpy") == os.path.join(
+        "root", "kb_1", "text-embedding-3-small", "numpy"
+    )
+
+
+def test_deleting_a_knowledge_base_drops_every_models_store(
+    fake_providers, monkeypatch, tmp_path
+):
+    root = str(tmp_path / "chromadb")
+    file_path = tmp_path / "doc.txt"
+    file_path.write_text("The knight rode north.")
+    documents = {
+        "doc.txt": KnowledgeBaseDocument(
+            Type="Document", Filepath=str(file_path), Size=22, Loaded=False
+        )
+    }
+    embeddings = create_provider_embeddings()
+    for backend in ("chroma", "numpy"):
+        index_knowledge_base("kb 1", documents, embeddings, root, backend=backend)
+        documents["doc.txt"].Hash = None
+    monkeypatch.setattr(settings, "EMBEDDING_PROVIDER", "openai")
+    index_knowledge_base("kb 1", documents, embeddings, root)
+
+    delete_knowledge_base_vectorstores("kb 1", root)
+
+    assert not vectorstore_exists("kb 1", root)
+    monkeypatch.setattr(settings, "EMBEDDING_PROVIDER", "fake")
+    assert not vectorstore_exists("kb 1", root)
+    assert not vectorstore_exists("kb 1", root, backend="numpy")
@@ -0,0 +1,81 @@
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+
+from app.core.response_cache import (
+    ResponseCache,
+    ResponseCacheKey,
+    get_knowledge_base_version,
+)
+from app.models import KnowledgeBaseDocument
+
+
+class LetterEmbeddings(Embeddings):
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return [
+            float(text.lower().count(letter)) for letter in "abcdefghijklmnopqrstuvwxyz"
+        ]
+
+
+def make_key(prompt: str, chunk_ids: list[str] = ["1", "2"]) -> ResponseCacheKey:
+    return ResponseCacheKey(
+        model="gpt-4",
+        temperature=0.0,
+        knowledge_base_version="v1",
+        prompt=prompt,
+        chunk_ids=chunk_ids,
+    )
+
+
+def test_response_cache_matches_normalized_prompts(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    source = Document(page_content="chunk", metadata={"source": "a.txt"})
+    cache.put(
+        make_key("Who is Aramus?"), {"response": "A knight.", "sources": [source]}
+    )
+
+    result = cache.get(make_key("  who is   aramus? ", chunk_ids=["2", "1"]))
+    assert result == {"response": "A knight.", "sources": [source]}
+    assert cache.get(make_key("Who is Aramus?", chunk_ids=["3"])) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_response_cache_similarity_lookup(tmp_path):
+    cache = ResponseCache(
+        str(tmp_path / "cache.sqlite3"),
+        similarity_threshold=0.95,
+        embeddings=LetterEmbeddings(),
+    )
+    cache.put(make_key("Who is Aramus?"), {"response": "A knight."})
+
+    assert cache.get(make_key("Who's Aramus?"))["response"] == "A knight."
+    assert cache.get(make_key("Where is the northern keep?")) is None
+
+
+def test_response_cache_expires_and_evicts(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    for prompt in ["one", "two", "three"]:
+        cache.put(make_key(prompt), {"response": prompt})
+
+    assert cache.get(make_key("one")) is None
+    assert cache.get(make_key("three"))["response"] == "three"
+
+    cache.ttl_seconds = -1
+    assert cache.get(make_key("three")) is None
+
+
+def make_document(hash: str) -> KnowledgeBaseDocument:
+    return KnowledgeBaseDocument(
+        Type="txt", Filepath="a.txt", Size=1, Loaded=True, Hash=hash
+    )
+
+
+def test_knowledge_base_version_changes_with_hashes():
+    documents = {"a.txt": make_document("1")}
+    version = get_knowledge_base_version(documents)
+
+    assert get_knowledge_base_version(dict(documents)) == version
+    documents["a.txt"] = make_document("2")
+    assert get_knowledge_base_version(documents) != version
@@ -0,0 +1,30 @@
+from langchain.schema import Document
+
+from app.core.splitter import get_document_chunks, pack_documents
+from app.core.tokens import count_tokens
+
+MODEL = "text-embedding-ada-002"
+
+
+def test_token_aware_chunks_fit_chunk_size():
+    document = Document(page_content=" ".join(f"word{i}" for i in range(2000)))
+
+    chunks = get_document_chunks(
+        [document], chunk_size=100, chunk_overlap=10, token_aware=True
+    )
+
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk.page_content, MODEL) <= 100 for chunk in chunks)
+
+
+def test_pack_documents_keeps_order_within_budget():
+    documents = [
+        Document(page_content="a" * 50),
+        Document(page_content="b" * 5000),
+        Document(page_content="c" * 50),
+    ]
+    budget = count_tokens(documents[0].page_content, MODEL) * 2
+
+    packed = pack_documents(documents, budget, MODEL)
+
+    assert [document.page_content[0] for document in packed] == ["a", "c"]
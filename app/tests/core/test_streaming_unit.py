@@ -0,0 +1,75 @@
+from app.core.streaming import TokenBuffer, get_animation_frames
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_buffer_limits_update_rate():
+    clock = FakeClock()
+    rendered: list[str] = []
+    token_buffer = TokenBuffer(rendered.append, max_updates_per_second=10, clock=clock)
+
+    for index in range(100):
+        clock.now = index * 0.01
+        token_buffer.add(f"{index} ")
+    stats = token_buffer.close()
+
+    assert "".join(rendered) == "".join(f"{index} " for index in range(100))
+    assert rendered[0] == "0 "
+    assert stats["tokens"] == 100
+    assert stats["updates"] == len(rendered) == 11
+
+
+def test_token_buffer_flushes_every_k_tokens():
+    rendered: list[str] = []
+    token_buffer = TokenBuffer(
+        rendered.append, max_updates_per_second=0.001, flush_tokens=4, clock=FakeClock()
+    )
+
+    for token in "abcdefghij":
+        token_buffer.add(token)
+    token_buffer.add("")
+    token_buffer.close()
+
+    assert rendered == ["a", "bcde", "fghi", "j"]
+
+
+def test_token_buffer_renders_every_token_without_limits():
+    rendered: list[str] = []
+    token_buffer = TokenBuffer(rendered.append, max_updates_per_second=0)
+
+    for token in "abc":
+        token_buffer.add(token)
+
+    assert rendered == ["a", "b", "c"]
+
+
+def test_animation_frames_fit_the_duration():
+    text = " ".join(f"word{index}" for index in range(4000))
+
+    frames = get_animation_frames(text, frame_interval=0.05, max_duration=0.5)
+
+    assert len(frames) == 10
+    assert "".join(frames) == text
+    assert all(frame.strip() for frame in frames)
+    assert get_animation_frames("Hi there", frame_interval=0.05) == ["Hi ", "there"]
+    assert get_animation_frames("") == [""]
+
+
+def test_token_buffer_reports_time_to_first_token():
+    clock = FakeClock()
+    token_buffer = TokenBuffer(lambda text: None, clock=clock)
+
+    clock.now = 1.5
+    token_buffer.add("a")
+    clock.now = 2.5
+    token_buffer.add("b")
+    stats = token_buffer.close()
+
+    assert stats["ttft"] == 1.5
+    assert stats["tokens_per_second"] == 2.0
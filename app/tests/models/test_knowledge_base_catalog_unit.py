@@ -0,0 +1,114 @@
+import os
+import tempfile
+
+import pytest
+
+from app.models import (
+    KnowledgeBase,
+    KnowledgeBaseCatalog,
+    KnowledgeBaseDocument,
+    KnowledgeBaseHelper,
+    load_knowledge_base,
+)
+
+
+def make_document(filepath: str, size: int = 1024) -> KnowledgeBaseDocument:
+    return KnowledgeBaseDocument(
+        Type="Document", Filepath=filepath, Size=size, Loaded=False
+    )
+
+
+def test_knowledge_base_catalog_persists_documents():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filepath = os.path.join(temp_dir, "knowledge_base.sqlite3")
+        catalog = KnowledgeBaseCatalog(filepath)
+        catalog.add_knowledge_base("kb2")
+        catalog.add("kb1", "doc1", make_document("/path/to/doc1"))
+        catalog.add("kb1", "doc2", make_document("/path/to/doc2"))
+
+        # Changes made in place are persisted by update
+        document = catalog.get_documents("kb1")["doc1"]
+        document.Hash = "abc"
+        document.Chunks = 3
+        catalog.update("kb1", "doc1", document)
+        catalog.remove("kb1", "doc2")
+
+        reopened = KnowledgeBaseCatalog(filepath)
+        assert sorted(reopened.get_knowledge_base_names()) == ["kb1", "kb2"]
+        assert list(reopened.get_documents("kb1")) == ["doc1"]
+        assert reopened.get_documents("kb1")["doc1"].Hash == "abc"
+        assert reopened.get_documents("kb1")["doc1"].Chunks == 3
+        assert reopened.get_documents("kb2") == {}
+        with pytest.raises(KeyError):
+            reopened.get_documents("kb3")
+        with pytest.raises(KeyError):
+            reopened.update("kb1", "doc2", make_document("/path/to/doc2"))
+
+        reopened.delete_knowledge_base("kb1")
+        assert not KnowledgeBaseCatalog(filepath).has_knowledge_base("kb1")
+
+
+def test_knowledge_base_catalog_backs_helper():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        catalog = KnowledgeBaseCatalog(os.path.join(temp_dir, "kb.sqlite3"))
+        kb_helper = KnowledgeBaseHelper(catalog)
+        incoming_filename = os.path.join(temp_dir, "incoming.txt")
+        with open(incoming_filename, "wb") as incoming_file:
+            incoming_file.write(b"Test content")
+
+        kb_helper.add_new_knowledge_base("kb1")
+        kb_helper.add_document(
+            "kb1",
+            "temp_doc",
+            incoming_filename=incoming_filename,
+            outgoing_filename=os.path.join(temp_dir, "kb1", "temp_doc.txt"),
+        )
+        kb_helper.refesh("kb1")
+
+        assert kb_helper.get_knowledge_base_names() == ["kb1"]
+        assert kb_helper.document_data["kb1"]["temp_doc"] == b"Test content"
+        assert kb_helper.get_documents("kb1")["temp_doc"].Loaded is True
+
+        kb_helper.delete_document("kb1", "temp_doc")
+        assert "temp_doc" not in kb_helper.document_data["kb1"]
+
+
+def test_load_knowledge_base_migrates_json_once():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = os.path.join(temp_dir, "knowledge_base.json")
+        catalog_filepath = os.path.join(temp_dir, "knowledge_base.sqlite3")
+        KnowledgeBase(
+            root={"kb1": {"doc1": make_document("/path/to/doc1", size=2048)}}
+        ).dump(file_path)
+
+        catalog = load_knowledge_base("sqlite", file_path, catalog_filepath)
+        assert catalog.get_documents("kb1")["doc1"].Size == 2048
+
+        # Later changes to the JSON file are no longer picked up
+        KnowledgeBase(root={}).dump(file_path)
+        catalog = load_knowledge_base("sqlite", file_path, catalog_filepath)
+        assert catalog.get_knowledge_base_names() == ["kb1"]
+
+
+def test_load_knowledge_base_retries_failed_migration(monkeypatch):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = os.path.join(temp_dir, "knowledge_base.json")
+        catalog_filepath = os.path.join(temp_dir, "knowledge_base.sqlite3")
+        KnowledgeBase(
+            root={"kb1": {"doc1": make_document("/path/to/doc1", size=2048)}}
+        ).dump(file_path)
+        migrate = KnowledgeBaseCatalog.migrate
+
+        def fail_migration(self, knowledge_base):
+            self.add_knowledge_base("partial")
+            raise RuntimeError("Migration failed")
+
+        monkeypatch.setattr(KnowledgeBaseCatalog, "migrate", fail_migration)
+        with pytest.raises(RuntimeError):
+            load_knowledge_base("sqlite", file_path, catalog_filepath)
+        assert not os.path.exists(catalog_filepath)
+
+        monkeypatch.setattr(KnowledgeBaseCatalog, "migrate", migrate)
+        catalog = load_knowledge_base("sqlite", file_path, catalog_filepath)
+        assert catalog.get_knowledge_base_names() == ["kb1"]
+        assert catalog.get_documents("kb1")["doc1"].Size == 2048
@@ -3,7 +3,13 @@ import tempfile
 
 import pytest
 
-from app.models import KnowledgeBase, KnowledgeBaseDocument, KnowledgeBaseHelper
+from app.core.hashing import hash_bytes
+from app.models import (
+    DocumentData,
+    KnowledgeBase,
+    KnowledgeBaseDocument,
+    KnowledgeBaseHelper,
+)
 
 
 def test_knowledge_base_document_creation():
@@ -344,3 +350,131 @@ def test_knowledge_base_helper_get_knowledge_base_names():
     kb_helper_empty = KnowledgeBaseHelper(kb_empty)
     kb_names_empty = kb_helper_empty.get_knowledge_base_names()
     assert kb_names_empty == []
+
+
+def test_knowledge_base_helper_document_data_is_lazy():
+    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+        temp_file_name = temp_file.name
+        temp_file.write(b"Lazy content")
+
+    kb = KnowledgeBase(
+        root={
+            "kb1": {
+                "doc1": KnowledgeBaseDocument(
+                    Type="Document", Filepath=temp_file_name, Size=12, Loaded=True
+                ),
+                "missing": KnowledgeBaseDocument(
+                    Type="Document", Filepath="/path/to/missing", Size=1, Loaded=True
+                ),
+            }
+        }
+    )
+    # Files are not read until they are accessed, and missing ones are left out
+    kb_helper = KnowledgeBaseHelper(kb)
+    document_data = kb_helper.get_document_data("kb1")
+
+    assert set(document_data) == {"doc1"}
+    with document_data.open("doc1") as data:
+        assert data[:4] == b"Lazy"
+    assert document_data["doc1"] == b"Lazy content"
+    with pytest.raises(KeyError):
+        document_data["missing"]
+
+    os.remove(temp_file_name)
+
+
+def test_knowledge_base_helper_add_documents():
+    kb = KnowledgeBase(root={})
+    kb_helper = KnowledgeBaseHelper(kb)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        documents = []
+        for i in range(5):
+            incoming_file_name = os.path.join(temp_dir, f"incoming{i}.txt")
+            with open(incoming_file_name, "wb") as incoming_file:
+                incoming_file.write(f"Test content {i}".encode() * (i + 1))
+            documents.append(
+                (
+                    f"doc{i}",
+                    incoming_file_name,
+                    os.path.join(temp_dir, "kb1", f"doc{i}.txt"),
+                )
+            )
+        documents.append(
+            ("missing", "/path/to/missing", os.path.join(temp_dir, "kb1", "missing"))
+        )
+
+        kb_helper.add_documents("kb1", documents, max_workers=3)
+
+        # Documents are registered in order and failed copies are skipped
+        assert list(kb.root["kb1"]) == [f"doc{i}" for i in range(5)]
+        for i in range(5):
+            content = f"Test content {i}".encode() * (i + 1)
+            document = kb.root["kb1"][f"doc{i}"]
+            assert document.Size == len(content)
+            assert document.ContentHash == hash_bytes(content)
+            assert kb_helper.document_data["kb1"][f"doc{i}"] == content
+
+
+def test_knowledge_base_batch_writes_once(monkeypatch):
+    kb = KnowledgeBase(root={})
+    dumps = []
+    monkeypatch.setattr(
+        KnowledgeBase, "dump", lambda self: dumps.append(len(self.root["kb1"]))
+    )
+    doc = KnowledgeBaseDocument(
+        Type="Document", Filepath="/path/to/doc", Size=1024, Loaded=True
+    )
+
+    with kb.batch():
+        for i in range(3):
+            kb.add("kb1", f"doc{i}", doc)
+        with kb.batch():
+            kb.remove("kb1", "doc0")
+        assert dumps == []
+
+    assert dumps == [2]
+
+
+def test_knowledge_base_dump_replaces_file_atomically():
+    kb = KnowledgeBase(
+        root={
+            "kb1": {
+                "doc1": KnowledgeBaseDocument(
+                    Type="Document", Filepath="/path/to/doc1", Size=1024, Loaded=True
+                )
+            }
+        }
+    )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = os.path.join(temp_dir, "knowledge_base.json")
+        kb.dump(file_path)
+
+        assert os.listdir(temp_dir) == ["knowledge_base.json"]
+        assert KnowledgeBase.load(file_path).root["kb1"]["doc1"].Size == 1024
+
+
+def test_document_data_leaves_out_missing_files(tmp_path):
+    present = tmp_path / "present.txt"
+    present.write_bytes(b"Present")
+    document_data = DocumentData(
+        {
+            "present": KnowledgeBaseDocument(
+                Type="Document", Filepath=str(present), Size=7, Loaded=False
+            ),
+            "missing": KnowledgeBaseDocument(
+                Type="Document",
+                Filepath=str(tmp_path / "missing.txt"),
+                Size=7,
+                Loaded=False,
+            ),
+        }
+    )
+
+    assert list(document_data) == ["present"]
+    assert "missing" not in document_data
+    assert document_data.get("missing") is None
+    assert document_data["present"] == b"Present"
+    with pytest.raises(KeyError):
+        with document_data.open("missing"):
+            pass
@@ -14,6 +14,9 @@ class IllianaView(BaseView):
         self.chat_view = ChatView(chat_config=self.chat_config, page=page)
         user_input_field = UserInputField(chat_view=self.chat_view)
         divider = ft.Divider(height=0.2, color="transparent")
+        side_controls: list[ft.Control] = [self.chat_config]
+        if self.chat_view.latency_panel is not None:
+            side_controls.append(self.chat_view.latency_panel)
         super().__init__(
             page=page,
             route=ILLIANA_ROUTE,
@@ -56,9 +59,7 @@ class IllianaView(BaseView):
                         horizontal_alignment=ft.CrossAxisAlignment.START,
                     ),
                     ft.Column(
-                        controls=[
-                            self.chat_config,
-                        ],
+                        controls=side_controls,
                         horizontal_alignment=ft.CrossAxisAlignment.START,
                     ),
                 ],
@@ -0,0 +1,176 @@
+"""
+Drives simulated conversations through the chat pipeline with fake providers.
+
+Every conversation runs in its own thread and session, sending its turns one after
+another through `stream_chat_with_llm`, as the chat view does. The chat model and
+embeddings are deterministic local stand-ins with configurable latency, so the
+results measure the app's own overhead on top of a model of known speed: the
+time to first token, the turn latency, and the overhead beyond the simulated
+model time. Results are written as JSON, like the pipeline benchmark.
+
+Usage:
+    python -m benchmarks.chat_load_test --conversations 200 --turns 5
+    python -m benchmarks.chat_load_test --tokens-per-second 0 --output load.json
+"""  # noqa
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import numpy as np
+from icecream import ic
+from langchain.callbacks.base import BaseCallbackHandler
+
+from app.core import ai
+from app.core.config import settings
+from benchmarks.pipeline_benchmark import WORDS, _get_environment
+
+
+class TurnTimer(BaseCallbackHandler):
+    """
+    Records when a turn's first token arrives and how many tokens it streams.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.first_token_at = 0.0
+        self.tokens = 0
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if not self.tokens:
+            self.first_token_at = time.perf_counter()
+        self.tokens += 1
+
+
+def _percentiles(values: list[float]) -> dict[str, float]:
+    return {
+        "p50_ms": float(np.percentile(values, 50) * 1000),
+        "p95_ms": float(np.percentile(values, 95) * 1000),
+        "max_ms": float(np.max(values) * 1000),
+    }
+
+
+def _converse(conversation: int, turns: int, model: str) -> list[dict[str, float]]:
+    measurements = []
+    for turn in range(turns):
+        words = [
+            WORDS[(conversation * 7 + turn * 3 + i) % len(WORDS)] for i in range(8)
+        ]
+        timer = TurnTimer()
+        ai.stream_chat_with_llm(
+            user_input=" ".join(words),
+            knowledge_base_name="",
+            model=model,
+            streaming_callback_handler=timer,
+            session_id=f"load-test-{conversation}",
+        )
+        measurements.append(
+            {
+                "latency": time.perf_counter() - timer.started_at,
+                "ttft": timer.first_token_at - timer.started_at,
+                "tokens": timer.tokens,
+            }
+        )
+    return measurements
+
+
+def run(
+    conversations: int = 100,
+    turns: int = 5,
+    concurrency: int = 20,
+    latency: float = 0.2,
+    tokens_per_second: float = 50.0,
+    response_tokens: int = 100,
+    model: str = "gpt-3.5-turbo-1106",
+) -> dict[str, Any]:
+    """
+    Runs simulated conversations against the fake chat model.
+
+    Args:
+        conversations (int, optional): The number of conversations. Defaults to 100.
+        turns (int, optional): The number of turns per conversation. Defaults to 5.
+        concurrency (int, optional): The number of conversations at once. Defaults to 20.
+        latency (float, optional): The simulated seconds to the first token. Defaults to 0.2.
+        tokens_per_second (float, optional): The simulated streaming rate, or 0 for no delay. Defaults to 50.
+        response_tokens (int, optional): The number of tokens per response. Defaults to 100.
+        model (str, optional): The model whose tokenizer and context window are used. Defaults to "gpt-3.5-turbo-1106".
+
+    Returns:
+        dict[str, Any]: The configuration and the latency percentiles.
+    """  # noqa
+    config = {
+        "conversations": conversations,
+        "turns": turns,
+        "concurrency": concurrency,
+        "latency": latency,
+        "tokens_per_second": tokens_per_second,
+        "response_tokens": response_tokens,
+        "model": model,
+    }
+    # Debug printing inspects the caller's source, which fails across threads
+    ic.disable()
+    settings.LLM_PROVIDER = "fake"
+    settings.EMBEDDING_PROVIDER = "fake"
+    settings.RESPONSE_CACHE_ENABLED = False
+    settings.FAKE_LLM_LATENCY_SECONDS = latency
+    settings.FAKE_LLM_TOKENS_PER_SECOND = tokens_per_second
+    settings.FAKE_LLM_RESPONSE_TOKENS = response_tokens
+    simulated_seconds = latency + (
+        (response_tokens - 1) / tokens_per_second if tokens_per_second else 0
+    )
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(_converse, conversation, turns, model)
+            for conversation in range(conversations)
+        ]
+        measurements = [
+            measurement for future in futures for measurement in future.result()
+        ]
+    seconds = time.perf_counter() - started_at
+
+    latencies = [measurement["latency"] for measurement in measurements]
+    results = {
+        "turns": {"count": len(measurements), "seconds": seconds},
+        "latency": _percentiles(latencies),
+        "ttft": _percentiles([measurement["ttft"] for measurement in measurements]),
+        "overhead": _percentiles(
+            [max(value - simulated_seconds, 0.0) for value in latencies]
+        ),
+        "throughput": {"turns_per_second": len(measurements) / seconds},
+    }
+    return {"environment": _get_environment(), "config": config, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--response-tokens", type=int, default=100)
+    parser.add_argument("--model", default="gpt-3.5-turbo-1106")
+    parser.add_argument("--output", help="Writes the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(
+        conversations=args.conversations,
+        turns=args.turns,
+        concurrency=args.concurrency,
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        model=args.model,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+Benchmarks the ingestion and retrieval pipeline offline, on a synthetic corpus.
+
+Times document loading, chunking, vector store creation, re-indexing, loading
+and querying, a retrieval chat turn with a stub LLM, and knowledge base startup.
+Embeddings are deterministic fakes, so no API key or network is needed and runs
+are reproducible. Results are written as JSON so they can be diffed across
+commits; pass a previous result with --baseline to print the change per metric.
+
+Usage:
+    python -m benchmarks.pipeline_benchmark --documents 200 --output results.json
+    python -m benchmarks.pipeline_benchmark --baseline results.json
+"""  # noqa
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Any, Callable, Optional
+
+import numpy as np
+from langchain.chains import ConversationalRetrievalChain
+from langchain.embeddings import DeterministicFakeEmbedding
+from langchain.llms.fake import FakeListLLM
+from langchain.memory import ConversationBufferMemory
+
+from app.core.bm25 import bm25_indexes
+from app.core.indexer import index_knowledge_base
+from app.core.loader import load_documents
+from app.core.numpy_vectorstore import numpy_collections
+from app.core.splitter import get_document_chunks
+from app.core.vectorstore import get_vectorstore_retriever
+from app.models import KnowledgeBase, KnowledgeBaseDocument, KnowledgeBaseHelper
+from app.models.knowledge_base_catalog import KnowledgeBaseCatalog
+
+KNOWLEDGE_BASE_NAME = "benchmark"
+DOCUMENT_TYPES = ["txt", "py", "json"]
+
+WORDS = (
+    "aramus illiana knight keep north sword village sea storm rose eternity "
+    "ancient guild mage council river forest tower shadow dawn oath banner "
+    "battle siege harbor crown scroll relic dragon winter ember journey"
+).split()
+
+
+def _write_document(filepath: str, document_type: str, words: list[str]) -> None:
+    with open(filepath, "w") as f:
+        if document_type == "py":
+            for start in range(0, len(words), 8):
+                end = start + 8
+                line = " ".join(words[start:end])
+                f.write(f"def function_{start}():\n    return {line!r}\n\n")
+        elif document_type == "json":
+            json.dump({"entries": [" ".join(words[i::10]) for i in range(10)]}, f)
+        else:
+            for start in range(0, len(words), 120):
+                end = start + 120
+                f.write(" ".join(words[start:end]) + "\n\n")
+
+
+def generate_corpus(
+    directory: str,
+    documents: int,
+    words_per_document: int,
+    document_types: list[str],
+    seed: int = 0,
+) -> dict[str, KnowledgeBaseDocument]:
+    """
+    Writes a synthetic corpus of text, Python and JSON documents.
+
+    Args:
+        directory (str): The directory to write the documents to.
+        documents (int): The number of documents.
+        words_per_document (int): The number of words per document.
+        document_types (list[str]): The file types to cycle through.
+        seed (int, optional): Seeds the generated text. Defaults to 0.
+
+    Returns:
+        dict[str, KnowledgeBaseDocument]: The documents, as a knowledge base would hold them.
+    """  # noqa
+    generator = random.Random(seed)
+    knowledge_base_documents: dict[str, KnowledgeBaseDocument] = {}
+    for index in range(documents):
+        document_type = document_types[index % len(document_types)]
+        document_name = f"document_{index}.{document_type}"
+        filepath = os.path.join(directory, document_name)
+        words = generator.choices(WORDS, k=words_per_document)
+        _write_document(filepath, document_type, words)
+        knowledge_base_documents[document_name] = KnowledgeBaseDocument(
+            Type="Document",
+            Filepath=filepath,
+            Size=os.path.getsize(filepath),
+            Loaded=False,
+        )
+    return knowledge_base_documents
+
+
+def _time(func: Callable[[], Any]) -> tuple[float, Any]:
+    started_at = time.perf_counter()
+    result = func()
+    return time.perf_counter() - started_at, result
+
+
+def _latencies(func: Callable[[str], Any], queries: list[str]) -> dict[str, float]:
+    latencies = []
+    for query in queries:
+        duration, _ = _time(lambda: func(query))
+        latencies.append(duration)
+    return {
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+    }
+
+
+def benchmark_knowledge_base_startup(
+    directory: str,
+    knowledge_base_documents: dict[str, KnowledgeBaseDocument],
+    backend: str,
+) -> dict[str, float]:
+    """
+    Times loading a knowledge base and listing its documents, as the app does at startup.
+
+    Args:
+        directory (str): The directory to write the knowledge base to.
+        knowledge_base_documents (dict[str, KnowledgeBaseDocument]): The documents of the knowledge base.
+        backend (str): Either "json" or "sqlite".
+
+    Returns:
+        dict[str, float]: The startup time.
+    """  # noqa
+    json_filepath = os.path.join(directory, "knowledge_base.json")
+    catalog_filepath = os.path.join(directory, "knowledge_base.sqlite3")
+    knowledge_base = KnowledgeBase({KNOWLEDGE_BASE_NAME: knowledge_base_documents})
+    if backend == "json":
+        with open(json_filepath, "w") as f:
+            f.write(knowledge_base.model_dump_json())
+    else:
+        KnowledgeBaseCatalog(catalog_filepath).migrate(knowledge_base)
+
+    def start() -> None:
+        loaded = (
+            KnowledgeBase.load(json_filepath)
+            if backend == "json"
+            else KnowledgeBaseCatalog(catalog_filepath)
+        )
+        helper = KnowledgeBaseHelper(loaded)
+        for name in loaded.get_knowledge_base_names():
+            helper.get_documents(name)
+
+    seconds, _ = _time(start)
+    return {"seconds": seconds}
+
+
+def run(
+    documents: int = 100,
+    words_per_document: int = 2000,
+    document_types: list[str] = DOCUMENT_TYPES,
+    queries: int = 50,
+    dimensions: int = 384,
+    backend: str = "chroma",
+    max_workers: int = 1,
+    seed: int = 0,
+) -> dict[str, Any]:
+    """
+    Runs every stage of the benchmark on a fresh synthetic corpus.
+
+    Args:
+        documents (int, optional): The number of documents. Defaults to 100.
+        words_per_document (int, optional): The number of words per document. Defaults to 2000.
+        document_types (list[str], optional): The file types of the documents. Defaults to txt, py and json.
+        queries (int, optional): The number of queries to time. Defaults to 50.
+        dimensions (int, optional): The size of the fake embeddings. Defaults to 384.
+        backend (str, optional): The vector store backend, "chroma" or "numpy". Defaults to "chroma".
+        max_workers (int, optional): The number of loader processes. Defaults to 1.
+        seed (int, optional): Seeds the corpus and the queries. Defaults to 0.
+
+    Returns:
+        dict[str, Any]: The configuration and the results of every stage.
+    """  # noqa
+    config = {
+        "documents": documents,
+        "words_per_document": words_per_document,
+        "document_types": document_types,
+        "queries": queries,
+        "dimensions": dimensions,
+        "backend": backend,
+        "max_workers": max_workers,
+        "seed": seed,
+    }
+    directory = tempfile.mkdtemp()
+    results: dict[str, dict[str, float]] = {}
+    try:
+        corpus_directory = os.path.join(directory, "corpus")
+        os.makedirs(corpus_directory)
+        knowledge_base_documents = generate_corpus(
+            corpus_directory, documents, words_per_document, document_types, seed
+        )
+        embeddings = DeterministicFakeEmbedding(size=dimensions)
+        persist_directory_root = os.path.join(directory, "vectorstore")
+
+        seconds, loaded = _time(
+            lambda: load_documents(knowledge_base_documents, max_workers=max_workers)
+        )
+        results["load_documents"] = {"seconds": seconds, "documents": len(loaded)}
+
+        seconds, chunks = _time(lambda: get_document_chunks(loaded))
+        results["get_document_chunks"] = {"seconds": seconds, "chunks": len(chunks)}
+
+        def index():
+            return index_knowledge_base(
+                knowledge_base_name=KNOWLEDGE_BASE_NAME,
+                knowledge_base_documents=knowledge_base_documents,
+                embeddings=embeddings,
+                persist_directory_root=persist_directory_root,
+                backend=backend,
+            )
+
+        seconds, index_stats = _time(index)
+        results["vectorstore_create"] = {
+            "seconds": seconds,
+            "chunks": index_stats.added,
+        }
+        seconds, index_stats = _time(index)
+        results["vectorstore_reindex"] = {
+            "seconds": seconds,
+            "skipped": index_stats.skipped,
+        }
+
+        # Drop the in-process state so the vector store is read back from disk
+        numpy_collections.clear()
+        bm25_indexes.clear()
+        seconds, retriever = _time(
+            lambda: get_vectorstore_retriever(
+                documents=[],
+                embeddings=embeddings,
+                knowledge_base_name=KNOWLEDGE_BASE_NAME,
+                persist_directory_root=persist_directory_root,
+                max_tokens=4000,
+                backend=backend,
+            )
+        )
+        results["vectorstore_load"] = {"seconds": seconds}
+
+        generator = random.Random(seed)
+        query_texts = [" ".join(generator.choices(WORDS, k=6)) for _ in range(queries)]
+        results["vectorstore_query"] = _latencies(
+            retriever.get_relevant_documents, query_texts
+        )
+
+        chain = ConversationalRetrievalChain.from_llm(
+            llm=FakeListLLM(responses=["The answer."]),
+            retriever=retriever,
+            memory=ConversationBufferMemory(
+                memory_key="chat_history",
+                return_messages=True,
+                input_key="question",
+                output_key="answer",
+            ),
+        )
+        results["chat_turn"] = _latencies(
+            lambda query: chain({"question": query}), query_texts
+        )
+
+        for knowledge_base_backend in ["json", "sqlite"]:
+            results[
+                f"knowledge_base_startup_{knowledge_base_backend}"
+            ] = benchmark_knowledge_base_startup(
+                directory, knowledge_base_documents, knowledge_base_backend
+            )
+    finally:
+        numpy_collections.clear()
+        bm25_indexes.clear()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {"environment": _get_environment(), "config": config, "results": results}
+
+
+def _get_environment() -> dict[str, Optional[str]]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version()}
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any]) -> list[str]:
+    """
+    Compares the timings of two runs.
+
+    Args:
+        results (dict[str, Any]): The results of this run.
+        baseline (dict[str, Any]): The results of a previous run.
+
+    Returns:
+        list[str]: One line per timing, with the relative change.
+    """
+    lines = []
+    for stage, metrics in results["results"].items():
+        for metric, value in metrics.items():
+            if not (metric == "seconds" or metric.endswith("_ms")):
+                continue
+            previous = baseline.get("results", {}).get(stage, {}).get(metric)
+            change = (
+                f"{(value - previous) / previous * 100:+.1f}%" if previous else "new"
+            )
+            lines.append(f"{stage + '.' + metric:<40}{value:>12.4f}{change:>10}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=100)
+    parser.add_argument("--words-per-document", type=int, default=2000)
+    parser.add_argument("--document-types", default=",".join(DOCUMENT_TYPES))
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--dimensions", type=int, default=384)
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default="chroma")
+    parser.add_argument("--max-workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Writes the results to this JSON file")
+    parser.add_argument("--baseline", help="Compares with the results in this file")
+    args = parser.parse_args()
+
+    results = run(
+        documents=args.documents,
+        words_per_document=args.words_per_document,
+        document_types=args.document_types.split(","),
+        queries=args.queries,
+        dimensions=args.dimensions,
+        backend=args.backend,
+        max_workers=args.max_workers,
+        seed=args.seed,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            print("\n".join(compare(results, json.load(f))))
+    elif not args.output:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
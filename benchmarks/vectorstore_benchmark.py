@@ -0,0 +1,170 @@
+"""
+Compares the Chroma and NumPy vector store backends on ingest time, load time and
+query latency.
+
+Usage:
+    python -m benchmarks.vectorstore_benchmark --documents 5000 --dimensions 384
+"""  # noqa
+import argparse
+import shutil
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+from langchain.vectorstores.chroma import Chroma
+
+from app.core.numpy_vectorstore import NumpyVectorStore, numpy_collections
+
+
+class RandomEmbeddings(Embeddings):
+    """
+    Embeddings that return precomputed random vectors, so the benchmark measures
+    the vector stores rather than the embedding model.
+    """
+
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = vectors
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.vectors[int(text)].tolist() for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.vectors[int(text)].tolist()
+
+
+def _percentile(latencies: list[float], percentile: float) -> float:
+    return float(np.percentile(latencies, percentile) * 1000)
+
+
+def benchmark_backend(
+    backend: str,
+    embeddings: RandomEmbeddings,
+    queries: np.ndarray,
+    k: int,
+    batch_size: int,
+    **numpy_kwargs,
+) -> dict[str, float]:
+    directory = tempfile.mkdtemp()
+    texts = [str(i) for i in range(len(embeddings.vectors))]
+    try:
+        started_at = time.perf_counter()
+        if backend == "chroma":
+            vectorstore = Chroma(
+                collection_name="benchmark",
+                embedding_function=embeddings,
+                client=chromadb.PersistentClient(path=directory),
+            )
+        else:
+            vectorstore = NumpyVectorStore(
+                collection_name="benchmark",
+                embedding_function=embeddings,
+                persist_directory=directory,
+            )
+        for start in range(0, len(texts), batch_size):
+            end = start + batch_size
+            vectorstore.add_texts(texts[start:end], ids=texts[start:end])
+        ingest_seconds = time.perf_counter() - started_at
+
+        # Load from disk, without any state cached in this process
+        numpy_collections.clear()
+        started_at = time.perf_counter()
+        if backend == "chroma":
+            vectorstore = Chroma(
+                collection_name="benchmark",
+                embedding_function=embeddings,
+                client=chromadb.PersistentClient(path=directory),
+            )
+            vectorstore.similarity_search_by_vector(queries[0].tolist(), k=k)
+        else:
+            vectorstore = NumpyVectorStore(
+                collection_name="benchmark",
+                embedding_function=embeddings,
+                persist_directory=directory,
+            )
+            vectorstore.collection.search(queries[0], k, **numpy_kwargs)
+        load_seconds = time.perf_counter() - started_at
+
+        latencies = []
+        for query in queries:
+            started_at = time.perf_counter()
+            if backend == "chroma":
+                vectorstore.similarity_search_by_vector(query.tolist(), k=k)
+            else:
+                vectorstore.collection.search(query, k, **numpy_kwargs)
+            latencies.append(time.perf_counter() - started_at)
+    finally:
+        numpy_collections.clear()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        "ingest_seconds": ingest_seconds,
+        "load_seconds": load_seconds,
+        "query_p50_ms": _percentile(latencies, 50),
+        "query_p95_ms": _percentile(latencies, 95),
+    }
+
+
+def run(
+    documents: int = 5000,
+    dimensions: int = 384,
+    queries: int = 200,
+    k: int = 10,
+    batch_size: int = 256,
+) -> dict[str, dict[str, float]]:
+    """
+    Runs the benchmark on every backend.
+
+    Args:
+        documents (int, optional): The number of vectors to index. Defaults to 5000.
+        dimensions (int, optional): The number of dimensions per vector. Defaults to 384.
+        queries (int, optional): The number of queries to time. Defaults to 200.
+        k (int, optional): The number of results per query. Defaults to 10.
+        batch_size (int, optional): The number of vectors added at a time. Defaults to 256.
+
+    Returns:
+        dict[str, dict[str, float]]: The timings of each backend.
+    """  # noqa
+    generator = np.random.default_rng(0)
+    embeddings = RandomEmbeddings(
+        generator.normal(size=(documents, dimensions)).astype(np.float32)
+    )
+    query_vectors = generator.normal(size=(queries, dimensions)).astype(np.float32)
+    return {
+        "chroma": benchmark_backend("chroma", embeddings, query_vectors, k, batch_size),
+        "numpy-flat": benchmark_backend(
+            "numpy", embeddings, query_vectors, k, batch_size, index_type="flat"
+        ),
+        "numpy-ivf": benchmark_backend(
+            "numpy",
+            embeddings,
+            query_vectors,
+            k,
+            batch_size,
+            index_type="ivf",
+            ivf_min_size=0,
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=5000)
+    parser.add_argument("--dimensions", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    results = run(args.documents, args.dimensions, args.queries, args.k)
+    columns = ["ingest_seconds", "load_seconds", "query_p50_ms", "query_p95_ms"]
+    print(f"{'backend':<12}" + "".join(f"{column:>16}" for column in columns))
+    for backend, timings in results.items():
+        print(
+            f"{backend:<12}"
+            + "".join(f"{timings[column]:>16.3f}" for column in columns)
+        )
+
+
+if __name__ == "__main__":
+    main()
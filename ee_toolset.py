@@ -57,4 +57,7 @@ def main(page: ft.Page):
     logger.info("ee.toolset.started", page=page)
 
 
-ft.app(target=main)
+# The guard keeps worker processes (e.g. the document loader's pool) from
+# starting the app again when they import this module.
+if __name__ == "__main__":
+    ft.app(target=main)